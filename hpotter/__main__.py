@@ -1,29 +1,34 @@
-import importlib
 import signal
-import threading
 
-import hpotter.plugins
-from hpotter.env import logger, stop_shell
+from hpotter.env import metrics_enabled, get_database
+from hpotter.metrics import start_metrics, stop_metrics
+from hpotter.admission import tarpit
+from hpotter.manager import start_plugins, stop_plugins
+from hpotter.docker.pool import stop_shell
+from hpotter.writer import stop_writer
 
 def shutdown_servers(signum, frame):
-    plugins_dict = hpotter.plugins.__dict__
-    for plugin_name in plugins_dict['__all__']:
-        importlib.import_module('hpotter.plugins.' + plugin_name)
-        plugin = plugins_dict[plugin_name]
-        logger.info('Stopping %s', plugin_name)
-        plugin.stop_server()
-        logger.info('Done stopping %s', plugin_name)
+    # the workers' rows come back here to be written, so they're stopped
+    # along with the plugins
+    stop_plugins()
 
     # shell might have been started by telnet, ssh, ...
     stop_shell()
+    tarpit.stop()
+
+    # everything has stopped producing rows, write out what's left
+    stop_writer()
+    stop_metrics()
 
 def startup_servers():
-    plugins_dict = hpotter.plugins.__dict__
-    for plugin_name in plugins_dict['__all__']:
-        importlib.import_module('hpotter.plugins.' + plugin_name)
-        plugin = plugins_dict[plugin_name]
-        logger.info('Starting %s', plugin_name)
-        plugin.start_server()
+    # made or migrated now, rather than when the first row comes in
+    get_database()
+
+    if metrics_enabled:
+        start_metrics()
+
+    # the plugins in [plugins] enabled, all at once
+    start_plugins()
 
 if "__main__" == __name__:
     signal.signal(signal.SIGINT, shutdown_servers)
@@ -0,0 +1,298 @@
+import collections
+import heapq
+import itertools
+import selectors
+import socket
+import threading
+import time
+
+from hpotter.env import logger, admission_enabled, admission_rate, \
+    admission_burst, admission_global_rate, admission_global_burst, \
+    admission_per_address, admission_connections, admission_addresses, \
+    admission_exempt, tarpit_connections, tarpit_interval, tarpit_seconds
+from hpotter.metrics import accepted, counter, gauge
+
+# Every listener asks before handling a connection. An address gets a
+# token bucket of new connections and a cap on how many it has open, and
+# all addresses together get the same again. Over any of them, the
+# connection isn't given a thread: it goes to the tarpit, one selector
+# loop that sends it a byte of banner every few seconds until it gives up,
+# or, with the tarpit full, it's closed.
+
+decisions = counter('hpotter_admission_total', \
+    'Connections admitted, tarpitted or dropped', ('plugin', 'decision'))
+
+class TokenBucket():
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def take(self, now):
+        self.tokens = min(self.burst, \
+            self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+class Admission():
+    def __init__(self, rate=5, burst=20, global_rate=200, global_burst=400, \
+        per_address=16, connections=512, addresses=65536, exempt=(), \
+        enabled=True, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.per_address = per_address
+        self.connections = connections
+        self.addresses = addresses
+        self.exempt = set(exempt)
+        self.enabled = enabled
+        self.clock = clock
+
+        self.lock = threading.Lock()
+        self.buckets = collections.OrderedDict()    # address -> TokenBucket
+        self.everyone = TokenBucket(global_rate, global_burst, clock()) \
+            if global_rate > 0 else None
+        self.open = collections.Counter()
+        self.total = 0
+
+    def take(self, address, now):
+        # the caller holds the lock
+        if self.rate > 0:
+            bucket = self.buckets.get(address)
+            if bucket is None:
+                bucket = self.buckets[address] = \
+                    TokenBucket(self.rate, self.burst, now)
+                # forgetting one only forgets how busy it's been lately
+                if len(self.buckets) > self.addresses:
+                    self.buckets.popitem(last=False)
+            else:
+                self.buckets.move_to_end(address)
+            if not bucket.take(now):
+                return False
+        return not self.everyone or self.everyone.take(now)
+
+    def admit(self, address, plugin='unknown'):
+        ''' Whether a connection from address can be handled now; if so,
+        release(address) when it's finished. '''
+        if not self.enabled or address in self.exempt:
+            decisions.labels(plugin, 'admitted').inc()
+            return True
+
+        with self.lock:
+            allowed = (not self.per_address or \
+                self.open[address] < self.per_address) and \
+                (not self.connections or self.total < self.connections) and \
+                self.take(address, self.clock())
+            if allowed:
+                self.open[address] += 1
+                self.total += 1
+
+        if allowed:
+            decisions.labels(plugin, 'admitted').inc()
+        return allowed
+
+    def release(self, address):
+        with self.lock:
+            # exempt addresses, or ones admitted while disabled, aren't kept
+            if self.open.get(address, 0) <= 0:
+                return
+            self.open[address] -= 1
+            self.total -= 1
+            if not self.open[address]:
+                del self.open[address]
+
+class Held():
+    def __init__(self, banner, deadline):
+        self.banner = banner
+        self.position = 0
+        self.deadline = deadline
+
+class Tarpit():
+    ''' Connections that are kept waiting, all of them in one thread. '''
+    def __init__(self, connections=1024, interval=5, seconds=300):
+        self.connections = connections
+        self.interval = interval
+        self.seconds = seconds
+
+        self.lock = threading.Lock()
+        self.incoming = []
+        self.held = {}              # socket -> Held
+        self.due = []               # heap of (when, order, socket)
+        self.order = itertools.count()
+        self.selector = None
+        self.waker = None
+        self.wake_socket = None
+        self.thread = None
+        self.stopping = False
+
+    def hold(self, sock, banner=b'\r\n'):
+        ''' Keep sock waiting, or return False if the tarpit is full. '''
+        with self.lock:
+            if self.stopping or \
+                len(self.held) + len(self.incoming) >= self.connections:
+                return False
+            self.incoming.append((sock, banner or b'\r\n'))
+            if not self.thread:
+                self.selector = selectors.DefaultSelector()
+                self.waker, self.wake_socket = socket.socketpair()
+                self.waker.setblocking(False)
+                self.selector.register(self.waker, selectors.EVENT_READ)
+                self.thread = threading.Thread(target=self.run, \
+                    name='Tarpit', daemon=True)
+                self.thread.start()
+            wake_socket = self.wake_socket
+        self.wake(wake_socket)
+        return True
+
+    def wake(self, wake_socket):
+        try:
+            wake_socket.send(b'x')
+        except OSError:
+            # already full of wake ups, or closed by stop
+            pass
+
+    def take_incoming(self, now):
+        try:
+            while self.waker.recv(4096):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+
+        with self.lock:
+            incoming, self.incoming = self.incoming, []
+        for sock, banner in incoming:
+            try:
+                sock.setblocking(False)
+                self.selector.register(sock, selectors.EVENT_READ)
+            except (OSError, ValueError):
+                sock.close()
+                continue
+            self.held[sock] = Held(banner, now + self.seconds)
+            heapq.heappush(self.due, (now, next(self.order), sock))
+
+    def drain(self, sock):
+        # what they send is thrown away; reading it notices them leaving
+        try:
+            data = sock.recv(4096)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b''
+        if not data:
+            self.release(sock)
+
+    def drip(self, now):
+        while self.due and self.due[0][0] <= now:
+            _, _, sock = heapq.heappop(self.due)
+            held = self.held.get(sock)
+            if not held:
+                continue
+            if now >= held.deadline:
+                self.release(sock)
+                continue
+            try:
+                sock.send(held.banner[held.position:held.position + 1])
+                held.position = (held.position + 1) % len(held.banner)
+            except (BlockingIOError, InterruptedError):
+                pass
+            except OSError:
+                self.release(sock)
+                continue
+            heapq.heappush(self.due, \
+                (now + self.interval, next(self.order), sock))
+
+    def release(self, sock):
+        if self.held.pop(sock, None):
+            self.selector.unregister(sock)
+            sock.close()
+
+    def run(self):
+        while not self.stopping:
+            timeout = None
+            if self.due:
+                timeout = max(0, self.due[0][0] - time.monotonic())
+            for key, _ in self.selector.select(timeout):
+                if key.fileobj is self.waker:
+                    self.take_incoming(time.monotonic())
+                else:
+                    self.drain(key.fileobj)
+            self.drip(time.monotonic())
+
+        for sock in list(self.held):
+            self.release(sock)
+        self.selector.close()
+        self.waker.close()
+
+    def stop(self, timeout=5):
+        with self.lock:
+            self.stopping = True
+            thread = self.thread
+            incoming, self.incoming = self.incoming, []
+        for sock, _ in incoming:
+            sock.close()
+        if thread:
+            self.wake(self.wake_socket)
+            thread.join(timeout)
+            self.wake_socket.close()
+
+admission = Admission(admission_rate, admission_burst, admission_global_rate, \
+    admission_global_burst, admission_per_address, admission_connections, \
+    admission_addresses, admission_exempt, admission_enabled)
+tarpit = Tarpit(tarpit_connections, tarpit_interval, tarpit_seconds)
+
+gauge('hpotter_admission_open', 'Admitted connections still open', \
+    function=lambda: admission.total)
+gauge('hpotter_tarpit_held', 'Connections being held in the tarpit', \
+    function=lambda: len(tarpit.held))
+
+def turn_away(sock, plugin='unknown', banner=b'\r\n', pit=None):
+    ''' For a connection that wasn't admitted: into the tarpit if there's
+    room, otherwise closed. '''
+    if (pit or tarpit).hold(sock, banner):
+        logger.debug('Tarpitting a %s connection', plugin)
+        decisions.labels(plugin, 'tarpitted').inc()
+        return
+    logger.debug('Dropping a %s connection', plugin)
+    decisions.labels(plugin, 'dropped').inc()
+    sock.close()
+
+class AdmissionMixIn():
+    ''' For socketserver servers, ahead of ThreadingMixIn or PooledMixIn,
+    so only admitted connections get a thread. '''
+    plugin = 'unknown'
+    banner = b'\r\n'
+    # the shared one, unless a server is given its own
+    admission = admission
+
+    def process_request(self, request, client_address):
+        # counted as accepted whatever happens next, as ssh and PipeLoop do
+        accepted.labels(self.plugin).inc()
+        address = client_address[0]
+        if not self.admission.admit(address, self.plugin):
+            turn_away(request, self.plugin, self.banner)
+            return
+        try:
+            super().process_request(request, client_address)
+        except RuntimeError:
+            # no thread to hand it to, so nothing else will release it
+            self.admission.release(address)
+            raise
+
+    def saturated(self, request, client_address):
+        # admitted, but PooledMixIn has no worker for it
+        self.admission.release(client_address[0])
+        super().saturated(request, client_address)
+
+    def discard(self, request, client_address):
+        # PooledMixIn's, for what it never got to
+        self.admission.release(client_address[0])
+        super().discard(request, client_address)
+
+    def finish_request(self, request, client_address):
+        try:
+            super().finish_request(request, client_address)
+        finally:
+            self.admission.release(client_address[0])
@@ -0,0 +1,82 @@
+# How long OneWayThread takes to proxy and capture large transfers, against
+# the old loop that grew an immutable bytes object and stored its repr.
+#
+#   python3 -m hpotter.benchmarks.capture --megabytes 1 4 16
+#
+# The old loop is quadratic; 32 megabytes already takes it minutes.
+#
+# Each transfer goes over a pair of socketpairs with the capture limit set to
+# the transfer size, so everything is captured.
+
+import argparse
+import json
+import socket
+import threading
+import time
+
+from hpotter.plugins.generic import OneWayThread
+
+def legacy_pump(source, dest, limit):
+    # OneWayThread.run before captures were preallocated
+    total = b''
+    while 1:
+        data = source.recv(4096)
+        if not data:
+            break
+        total += data
+        dest.sendall(data)
+        if limit > 0 and len(total) >= limit:
+            break
+    source.close()
+    dest.close()
+    return str(total)
+
+def current_pump(source, dest, limit):
+    thread = OneWayThread(source, dest, limit=limit)
+    thread.run()
+    return thread.capture.getvalue()
+
+def feed(sock, size):
+    chunk = b'\x00\xff' * 32768
+    while size > 0:
+        size -= sock.send(chunk[:size])
+    sock.close()
+
+def drain(sock):
+    while sock.recv(65536):
+        pass
+    sock.close()
+
+def measure(pump, size):
+    client, source = socket.socketpair()
+    dest, sink = socket.socketpair()
+    threads = [threading.Thread(target=feed, args=(client, size)), \
+        threading.Thread(target=drain, args=(sink,))]
+    for thread in threads:
+        thread.start()
+
+    start = time.perf_counter()
+    stored = pump(source, dest, size)
+    elapsed = time.perf_counter() - start
+
+    for thread in threads:
+        thread.join()
+    return elapsed, len(stored)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--megabytes', type=int, nargs='+', \
+        default=[1, 4, 16])
+    args = parser.parse_args()
+
+    for megabytes in args.megabytes:
+        size = megabytes * 1024 * 1024
+        for pump in (legacy_pump, current_pump):
+            elapsed, stored = measure(pump, size)
+            print(json.dumps({'pump': pump.__name__, 'bytes': size, \
+                'seconds': round(elapsed, 4), \
+                'megabytes_per_second': round(megabytes / elapsed, 1), \
+                'stored_bytes': stored}), flush=True)
+
+if "__main__" == __name__:
+    main()
@@ -0,0 +1,79 @@
+# How long a container takes to get running each way hpotter.docker.lifecycle
+# can do it, against the docker on this machine: created from an image
+# that's here (a cold start, as mariadb and httpd always are), and a kept
+# shell container started again (a warm one), plus pulled first with --pull.
+#
+#   python3 -m hpotter.benchmarks.containers --image busybox:latest --runs 5
+#   python3 -m hpotter.benchmarks.containers --image mariadb:latest --pull
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import tempfile
+import time
+
+import docker
+
+from hpotter.docker.lifecycle import Lifecycle
+
+role = 'benchmark'
+
+def clear(lifecycle):
+    for container in lifecycle.leftovers(role):
+        lifecycle.remove(container)
+
+def timed(lifecycle, start):
+    began = time.perf_counter()
+    containers = start()
+    seconds = time.perf_counter() - began
+    # killed rather than waited for, like the shell pool's
+    for container in containers:
+        lifecycle.retire(container, timeout=0)
+    return seconds
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--image', default='busybox:latest')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--pull', action='store_true', \
+        help='remove the image first and time pulling it')
+    args = parser.parse_args()
+
+    client = docker.from_env()
+    directory = tempfile.mkdtemp()
+    lifecycle = Lifecycle(client, os.path.join(directory, 'images.json'))
+    options = {'command': ['/bin/sh'], 'tty': True, 'detach': True}
+
+    def create():
+        return [lifecycle.container(role, args.image, **options)]
+
+    def adopt():
+        return lifecycle.adopt(role, args.image, 1, **options)
+    results = {'pulled': [], 'created': [], 'started': []}
+    try:
+        clear(lifecycle)
+        if args.pull:
+            try:
+                client.images.remove(args.image, force=True)
+            except docker.errors.ImageNotFound:
+                pass
+            results['pulled'].append(timed(lifecycle, create))
+
+        for _ in range(args.runs):
+            results['created'].append(timed(lifecycle, create))
+            results['started'].append(timed(lifecycle, adopt))
+    finally:
+        clear(lifecycle)
+        shutil.rmtree(directory)
+
+    for how, seconds in results.items():
+        if seconds:
+            print(json.dumps({'image': args.image, 'how': how, \
+                'runs': len(seconds), \
+                'median_ms': round(1000 * statistics.median(seconds), 1), \
+                'max_ms': round(1000 * max(seconds), 1)}))
+
+if "__main__" == __name__:
+    main()
@@ -0,0 +1,113 @@
+# Database size, write rate and a top-logins query, with values stored on
+# every row and with them interned in the dictionary table.
+#
+#   python3 -m hpotter.benchmarks.dictionary --logins 200000
+#
+# Logins are drawn from a few hundred common pairs, with a long tail; every
+# tenth connection also sends one of a handful of HTTP requests.
+
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+from sqlalchemy import create_engine, func, select, desc
+
+from hpotter import tables
+from hpotter.dictionary import Interner
+from hpotter.writer import DBWriter
+
+requests = [('GET /%s HTTP/1.1\r\nHost: 10.0.0.1\r\nUser-Agent: %s\r\n' \
+    'Accept: */*\r\n\r\n' % (path, agent)).encode() \
+    for path in ('', 'login.php', 'admin', 'wp-login.php', '.env') \
+    for agent in ('Mozilla/5.0 zgrab/0.x', 'curl/7.58.0', 'Hello, World')]
+
+def rows(logins):
+    generator = random.Random(0)
+    for i in range(logins):
+        connection = tables.Connections(sourceIP='10.1.2.3', \
+            sourcePort=40000, destIP='10.0.0.1', destPort=23, \
+            proto=tables.TCP)
+        yield connection
+        # a few hundred pairs most of the time
+        rank = min(int(generator.paretovariate(1.2)), 100000)
+        yield tables.Credentials(username=('root', 'admin', 'user')[rank % 3], \
+            password='password%d' % rank, connection=connection)
+        if i % 10 == 0:
+            data = generator.choice(requests)
+            yield tables.HTTPCommands(request=data.decode(), payload=data, \
+                connection=connection)
+
+def top_logins(engine, interned):
+    table = tables.Credentials.__table__
+    if interned:
+        # group the ids, and look up the values of the ten that are left
+        top = select([table.c.username_id, table.c.password_id, \
+            func.count().label('count')]) \
+            .group_by(table.c.username_id, table.c.password_id) \
+            .order_by(desc('count')).limit(10).alias('top')
+        dictionary = tables.Dictionary.__table__
+        username = dictionary.alias('username')
+        password = dictionary.alias('password')
+        query = select([username.c.value, password.c.value, top.c.count]) \
+            .select_from(top \
+                .join(username, username.c.id == top.c.username_id) \
+                .join(password, password.c.id == top.c.password_id)) \
+            .order_by(desc(top.c.count))
+    else:
+        query = select([table.c.username, table.c.password, \
+            func.count().label('count')]) \
+            .group_by(table.c.username, table.c.password) \
+            .order_by(desc('count')).limit(10)
+
+    start = time.perf_counter()
+    engine.execute(query).fetchall()
+    return time.perf_counter() - start
+
+def table_bytes(engine):
+    return dict(engine.execute('SELECT name, sum(pgsize) FROM dbstat ' \
+        "WHERE name IN ('credentials', 'httpcommands', 'dictionary') " \
+        'GROUP BY name').fetchall())
+
+def measure(interned, logins):
+    handle, path = tempfile.mkstemp(suffix='.db')
+    os.close(handle)
+    engine = create_engine('sqlite:///' + path)
+    tables.Base.metadata.create_all(engine)
+
+    interner = Interner() if interned else None
+    writer = DBWriter(engine, interner=interner)
+    writer.start()
+    start = time.perf_counter()
+    for row in rows(logins):
+        writer.write(row)
+    writer.stop()
+    elapsed = time.perf_counter() - start
+
+    engine.execute('VACUUM')
+    size = os.path.getsize(path)
+    query = min(top_logins(engine, interned) for _ in range(3))
+    sizes = table_bytes(engine)
+    engine.dispose()
+    os.remove(path)
+
+    result = {'interned': interned, 'logins': logins, \
+        'database_bytes': size, 'table_bytes': sizes, \
+        'rows_per_second': round(writer.stats()['rows'] / elapsed), \
+        'top_logins_seconds': round(query, 4)}
+    if interner:
+        result.update(interner.stats())
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--logins', type=int, default=200000)
+    args = parser.parse_args()
+
+    for interned in (False, True):
+        print(json.dumps(measure(interned, args.logins)), flush=True)
+
+if "__main__" == __name__:
+    main()
@@ -0,0 +1,69 @@
+# Time the ?geoip=1 lookups, a fresh geolite2 reader per request against
+# the shared reader and its cache.
+#
+#   python3 -m hpotter.benchmarks.geoip --addresses 2000 --requests 20
+#
+# Each request looks up the same set of distinct addresses, as a map that
+# refreshes every few seconds would.
+
+import argparse
+import json
+import random
+import time
+
+from geolite2 import geolite2
+
+from hpotter.geoip import locate
+
+class Row():
+    # what the old code got back from session.query(Connections.sourceIP)
+    def __init__(self, address):
+        self.address = address
+
+    def __repr__(self):
+        return "('" + self.address + "',)"
+
+def legacy_request(rows):
+    reader = geolite2.reader()
+    points = 0
+    for result in rows:
+        info = reader.get(str(result).split("'")[1])
+        if info and info.get('location'):
+            points += 1
+    return points
+
+def cached_request(rows):
+    points = 0
+    for result in rows:
+        if locate(result.address):
+            points += 1
+    return points
+
+def measure(name, request, rows, requests):
+    start = time.perf_counter()
+    for _ in range(requests):
+        points = request(rows)
+    elapsed = time.perf_counter() - start
+    return {'lookup': name, 'addresses': len(rows), 'requests': requests, \
+        'points': points, 'seconds': round(elapsed, 4), \
+        'ms_per_request': round(1000 * elapsed / requests, 3)}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--addresses', type=int, default=2000)
+    parser.add_argument('--requests', type=int, default=20)
+    args = parser.parse_args()
+
+    generator = random.Random(0)
+    rows = [Row('.'.join(str(generator.randint(1, 223)) for _ in range(4))) \
+        for _ in range(args.addresses)]
+
+    for name, request in (('geolite2.reader', legacy_request), \
+        ('locate', cached_request)):
+        geolite2.close()
+        locate.cache_clear()
+        print(json.dumps(measure(name, request, rows, args.requests)), \
+            flush=True)
+
+if "__main__" == __name__:
+    main()
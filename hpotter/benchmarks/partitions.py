@@ -0,0 +1,184 @@
+# One database against daily partitions, after the sensor has been up for
+# a while.
+#
+#   python3 -m hpotter.benchmarks.partitions --days 60 --per-day 20000
+#
+# The same connections, a login for every other one, are seeded into one
+# file and into a file per day. Then for each layout: the DBWriter's rate
+# adding connections with their logins, the jsonserver's recent-window
+# queries run the way it runs them, and dropping everything older than
+# --keep days.
+
+import argparse
+import datetime
+import itertools
+import json
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import time
+
+from sqlalchemy import create_engine
+
+from hpotter import tables
+from hpotter.migrations import migrate
+from hpotter.partitions import Partitions, base_of
+from hpotter.jsonserver.query import table_query
+from hpotter.writer import DBWriter
+
+def hours_ago(diff):
+    return datetime.datetime.utcnow() - datetime.timedelta(hours=diff)
+
+def create(path):
+    engine = create_engine('sqlite:///' + path)
+    tables.Base.metadata.create_all(engine)
+    migrate(engine)
+    engine.dispose()
+
+def seed(path, day, count, first_id):
+    generator = random.Random(day.toordinal())
+    start = datetime.datetime.combine(day, datetime.time())
+    connection = sqlite3.connect(path)
+    ids = range(first_id, first_id + count)
+    connection.executemany('INSERT INTO connections (id, created_at, ' \
+        '"sourceIP", "sourcePort", "destIP", "destPort", proto) ' \
+        'VALUES (?, ?, ?, ?, ?, ?, ?)', \
+        ((i, str(start + datetime.timedelta(seconds=generator.randrange(86400))), \
+            '10.%d.%d.%d' % (generator.randrange(256), generator.randrange(256), \
+                generator.randrange(256)), generator.randrange(1024, 65536), \
+            '10.0.0.1', generator.choice((22, 23, 80, 3306)), tables.TCP) \
+            for i in ids))
+    connection.executemany('INSERT INTO credentials (id, username, ' \
+        'password, connections_id) VALUES (?, ?, ?, ?)', \
+        ((i, 'root', str(i % 1000), i) for i in ids if i % 2))
+    connection.commit()
+    connection.close()
+
+def size(paths):
+    return round(sum(os.path.getsize(path) for path in paths \
+        if os.path.exists(path)) / 1e6, 2)
+
+def write(writer, count):
+    now = datetime.datetime.utcnow()
+    writer.start()
+    start = time.perf_counter()
+    for i in range(count):
+        connection = tables.Connections(sourceIP='10.1.2.3', \
+            sourcePort=40000, destIP='10.0.0.1', destPort=23, \
+            proto=tables.TCP, created_at=now)
+        writer.write(connection)
+        if i % 2:
+            writer.write(tables.Credentials(username='root', \
+                password='toor', connection=connection))
+    writer.stop()
+    return round(count / (time.perf_counter() - start))
+
+def queries():
+    connections = tables.Connections.__table__
+    credentials = tables.Credentials.__table__
+    deltas = {'hours_ago': hours_ago}
+    return [
+        ('connections hours_ago=1', connections, {'hours_ago': ['1']}),
+        ('credentials hours_ago=24 limit=100', credentials, \
+            {'hours_ago': ['24'], 'limit': ['100']}),
+        ('connections order=desc limit=100', connections, \
+            {'order': ['desc'], 'limit': ['100']}),
+    ], deltas
+
+def measure(layout, databases, repeat):
+    ''' databases takes the query parameters and returns the engines to
+    ask, in id order, as the jsonserver picks them. '''
+    cases, deltas = queries()
+    for name, table, parameters in cases:
+        query, limit = table_query(table, parameters, deltas)
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            results = itertools.chain.from_iterable(engine.execute(query) \
+                for engine in databases(parameters))
+            count = len(list(itertools.islice(results, limit and limit + 1)))
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        print(json.dumps({'layout': layout, 'query': name, 'rows': count, \
+            'seconds': round(best, 4)}), flush=True)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--days', type=int, default=60)
+    parser.add_argument('--per-day', type=int, default=20000)
+    parser.add_argument('--writes', type=int, default=20000)
+    parser.add_argument('--keep', type=int, default=30)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        single = os.path.join(directory, 'main.db')
+        parts = os.path.join(directory, 'partitions')
+        os.makedirs(parts)
+        partitions = Partitions(parts, \
+            storage=lambda url: create_engine(url))
+        today = datetime.datetime.utcnow().date()
+        days = [today - datetime.timedelta(days=ago) \
+            for ago in range(args.days, 0, -1)]
+
+        start = time.perf_counter()
+        create(single)
+        for number, day in enumerate(days):
+            seed(single, day, args.per_day, number * args.per_day + 1)
+            path = partitions.path_for(day)
+            create(path)
+            seed(path, day, args.per_day, base_of(day) + 1)
+        print(json.dumps({'seeded': args.days * args.per_day, \
+            'seconds': round(time.perf_counter() - start, 2)}), flush=True)
+
+        engine = create_engine('sqlite:///' + single)
+        print(json.dumps({'layout': 'single', 'rows_per_second': \
+            write(DBWriter(engine), args.writes)}), flush=True)
+        print(json.dumps({'layout': 'daily', 'rows_per_second': \
+            write(DBWriter(engine, partitions=partitions), args.writes)}), \
+            flush=True)
+        print(json.dumps({'single_mb': size([single]), \
+            'today_mb': size([partitions.path_for(today)])}), flush=True)
+
+        deltas = queries()[1]
+
+        def window(parameters):
+            for name, delta in deltas.items():
+                if name in parameters:
+                    return delta(int(parameters[name][0]))
+            return None
+
+        measure('single', lambda parameters: [engine], args.repeat)
+        measure('daily', lambda parameters: [partition.engine \
+            for partition in partitions.covering(window(parameters), \
+                descending='desc' in parameters.get('order', []))], \
+            args.repeat)
+
+        cutoff = datetime.datetime.combine(today - \
+            datetime.timedelta(days=args.keep), datetime.time())
+        start = time.perf_counter()
+        with engine.begin() as connection:
+            connection.execute('DELETE FROM credentials WHERE ' \
+                'connections_id IN (SELECT id FROM connections ' \
+                'WHERE created_at < ?)', str(cutoff))
+            connection.execute('DELETE FROM connections ' \
+                'WHERE created_at < ?', str(cutoff))
+        print(json.dumps({'layout': 'single', 'drop_seconds': \
+            round(time.perf_counter() - start, 3)}), flush=True)
+
+        partitions.drop_after = args.keep
+        start = time.perf_counter()
+        partitions.retire(today)
+        print(json.dumps({'layout': 'daily', 'drop_seconds': \
+            round(time.perf_counter() - start, 3)}), flush=True)
+
+        engine.dispose()
+        partitions.close()
+    finally:
+        shutil.rmtree(directory)
+
+if "__main__" == __name__:
+    main()
@@ -0,0 +1,157 @@
+# Compare the threaded PipeThread proxy with the selector based PipeLoop.
+#
+#   python3 -m hpotter.benchmarks.proxy --connections 2000
+#
+# Both proxies sit in front of a local echo server, so the container side is
+# never the bottleneck. Reports how many concurrent connections each engine
+# held, the extra threads it needed to hold them, and echo throughput.
+
+import argparse
+import json
+import os
+import resource
+import selectors
+import socket
+import threading
+import time
+
+from hpotter.plugins.generic import PipeThread, PipeLoop
+
+class EchoServer(threading.Thread):
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(socket.SOMAXCONN)
+        self.listener.setblocking(False)
+        self.address = self.listener.getsockname()
+
+    def run(self):
+        selector = selectors.DefaultSelector()
+        selector.register(self.listener, selectors.EVENT_READ)
+        while True:
+            for key, _ in selector.select():
+                if key.fileobj is self.listener:
+                    try:
+                        client, _ = self.listener.accept()
+                    except BlockingIOError:
+                        continue
+                    client.setblocking(True)
+                    selector.register(client, selectors.EVENT_READ)
+                    continue
+                try:
+                    data = key.fileobj.recv(65536)
+                except OSError:
+                    data = b''
+                if not data:
+                    selector.unregister(key.fileobj)
+                    key.fileobj.close()
+                else:
+                    key.fileobj.sendall(data)
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def wait_for(address, timeout=10):
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        try:
+            socket.create_connection(address, timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise IOError('proxy never started listening')
+
+def hold(address, count):
+    held = []
+    baseline = threading.active_count()
+    peak_threads = 0
+    for _ in range(count):
+        try:
+            sock = socket.create_connection(address, timeout=10)
+            sock.sendall(b'ping')
+            if sock.recv(4) != b'ping':
+                sock.close()
+                break
+        except OSError:
+            break
+        held.append(sock)
+        peak_threads = max(peak_threads, threading.active_count() - baseline)
+
+    for sock in held:
+        sock.close()
+    return len(held), peak_threads
+
+def transfer(address, connections, size):
+    selector = selectors.DefaultSelector()
+    chunk = b'x' * 65536
+    state = {}
+    for _ in range(connections):
+        sock = socket.create_connection(address)
+        sock.setblocking(False)
+        state[sock] = [size, size]      # left to send, left to receive
+        selector.register(sock, selectors.EVENT_READ | selectors.EVENT_WRITE)
+
+    start = time.monotonic()
+    while state:
+        for key, mask in selector.select(timeout=10):
+            sock = key.fileobj
+            left = state[sock]
+            if mask & selectors.EVENT_WRITE and left[0]:
+                try:
+                    left[0] -= sock.send(chunk[:min(left[0], len(chunk))])
+                except BlockingIOError:
+                    pass
+                if not left[0]:
+                    selector.modify(sock, selectors.EVENT_READ)
+            if mask & selectors.EVENT_READ:
+                try:
+                    data = sock.recv(65536)
+                except BlockingIOError:
+                    continue
+                left[1] -= len(data)
+                if not data or left[1] <= 0:
+                    selector.unregister(sock)
+                    sock.close()
+                    del state[sock]
+    elapsed = time.monotonic() - start
+    return connections * size / elapsed
+
+def run(engine, echo, args):
+    address = ('127.0.0.1', free_port())
+    proxy = engine(address, echo, None, 0)
+    proxy.start()
+    wait_for(address)
+
+    held, peak_threads = hold(address, args.connections)
+    time.sleep(1)   # let the proxy notice the hang ups
+    throughput = transfer(address, args.transfer_connections, args.bytes)
+
+    proxy.request_shutdown()
+    proxy.join()
+    return {'engine': engine.__name__, 'held': held, \
+        'peak_threads': peak_threads, 'bytes_per_second': int(throughput)}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--connections', type=int, default=1000)
+    parser.add_argument('--transfer-connections', type=int, default=50)
+    parser.add_argument('--bytes', type=int, default=4 * 1024 * 1024)
+    args = parser.parse_args()
+
+    # every held connection costs the proxy two descriptors
+    _, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    echo = EchoServer()
+    echo.start()
+    for engine in (PipeThread, PipeLoop):
+        print(json.dumps(run(engine, echo.address, args)), flush=True)
+
+    # PipeThread leaves its two minute Timers behind; don't wait for them
+    os._exit(0)
+
+if "__main__" == __name__:
+    main()
@@ -0,0 +1,82 @@
+# SSH handshake throughput with a local paramiko client.
+#
+#   python3 -m hpotter.benchmarks.ssh --handshakes 200 --clients 16
+#
+# Each client connects, negotiates keys, logs in with a password and hangs
+# up, which is what a password sprayer does. The server runs once with a
+# single worker, which is how connections used to be handled, and once with
+# the configured pool.
+
+import argparse
+import json
+import socket
+import threading
+import time
+
+import paramiko
+
+from hpotter.env import ssh_workers
+from hpotter.plugins.ssh import SshThread
+
+def handshake(address):
+    start = time.perf_counter()
+    sock = socket.create_connection(address, timeout=30)
+    transport = paramiko.Transport(sock)
+    try:
+        transport.start_client(timeout=30)
+        transport.auth_password('root', 'password')
+    finally:
+        transport.close()
+    return time.perf_counter() - start
+
+def client(address, count, latencies, errors):
+    for _ in range(count):
+        try:
+            latencies.append(handshake(address))
+        except (paramiko.SSHException, OSError, EOFError):
+            errors.append(1)
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def run(workers, args):
+    server = SshThread(('127.0.0.1', 0), workers=workers)
+    server.start()
+    address = server.ssh_socket.getsockname()
+
+    latencies = []
+    errors = []
+    per_client = args.handshakes // args.clients
+    clients = [threading.Thread(target=client, \
+        args=(address, per_client, latencies, errors)) \
+        for _ in range(args.clients)]
+
+    start = time.perf_counter()
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    server.stop()
+    server.join()
+    return {'workers': workers, 'clients': args.clients, \
+        'handshakes': len(latencies), 'errors': len(errors), \
+        'handshakes_per_second': round(len(latencies) / elapsed, 1), \
+        'p50_seconds': round(percentile(latencies, 0.5), 4), \
+        'p99_seconds': round(percentile(latencies, 0.99), 4)}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--handshakes', type=int, default=200)
+    parser.add_argument('--clients', type=int, default=16)
+    args = parser.parse_args()
+
+    for workers in (1, ssh_workers):
+        print(json.dumps(run(workers, args)), flush=True)
+
+if "__main__" == __name__:
+    main()
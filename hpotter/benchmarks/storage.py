@@ -0,0 +1,128 @@
+# The honeypot writing connections while the jsonserver reads them, for
+# each storage profile.
+#
+#   python3 -m hpotter.benchmarks.storage --seconds 5 --readers 4
+#
+# After 10000 rows are seeded, one thread feeds the DBWriter as fast as it takes rows. The readers are
+# separate processes, as the jsonserver is, asking for the newest thousand
+# connections over and over.
+
+import argparse
+import json
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+
+from sqlalchemy import select
+from sqlalchemy.exc import OperationalError
+
+from hpotter import tables
+from hpotter.migrations import migrate
+from hpotter.storage import create_storage_engine, profiles
+from hpotter.writer import DBWriter
+
+def connection():
+    return tables.Connections(sourceIP='10.1.2.3', sourcePort=40000, \
+        destIP='10.0.0.1', destPort=23, proto=tables.TCP)
+
+def produce(writer, stop):
+    while not stop.is_set():
+        writer.write(connection())
+
+def read(path, profile, stop, results):
+    engine = create_storage_engine('sqlite:///' + path, profile, 1)
+    connections = tables.Connections.__table__
+    query = select([connections]).order_by(connections.c.id.desc()) \
+        .limit(1000)
+    latencies = []
+    errors = 0
+    while not stop.is_set():
+        start = time.perf_counter()
+        try:
+            engine.execute(query).fetchall()
+        except OperationalError:
+            errors += 1
+            continue
+        latencies.append(time.perf_counter() - start)
+    engine.dispose()
+    results.put((latencies, errors))
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(1000 * values[min(len(values) - 1, \
+        int(fraction * len(values)))], 3)
+
+def measure(profile, seconds, readers, batch_size):
+    handle, path = tempfile.mkstemp(suffix='.db')
+    os.close(handle)
+    engine = create_storage_engine('sqlite:///' + path, profile, 1)
+    tables.Base.metadata.create_all(engine)
+    migrate(engine)
+
+    # so every read has a full page to fetch
+    engine.execute(tables.Connections.__table__.insert(), \
+        [{'sourceIP': '10.1.2.3', 'destPort': 23}] * 10000)
+
+    writer = DBWriter(engine, batch_size, flush_interval=0.1)
+    writer.start()
+    stop = threading.Event()
+    producer = threading.Thread(target=produce, args=(writer, stop))
+    reading = multiprocessing.Event()
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=read, \
+        args=(path, profile, reading, results)) for _ in range(readers)]
+
+    start = time.perf_counter()
+    producer.start()
+    for process in processes:
+        process.start()
+    time.sleep(seconds)
+    reading.set()
+    stop.set()
+    latencies = []
+    errors = 0
+    for process in processes:
+        found, failed = results.get()
+        latencies += found
+        errors += failed
+        process.join()
+    producer.join()
+    writer.stop()
+    elapsed = time.perf_counter() - start
+
+    stats = writer.stats()
+    engine.dispose()
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+    return {'profile': profile, 'readers': readers, \
+        'batch_size': batch_size, \
+        'rows_per_second': round(stats['rows'] / elapsed), \
+        'failed_rows': stats['failed'], \
+        'max_commit_ms': round(1000 * stats['max_commit_seconds'], 3), \
+        'reads_per_second': round(len(latencies) / elapsed), \
+        'read_errors': errors, \
+        'read_p50_ms': percentile(latencies, 0.5), \
+        'read_p99_ms': percentile(latencies, 0.99)}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--readers', type=int, default=4)
+    # 1 is how rows were written before the DBWriter
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--profile', choices=sorted(profiles), \
+        action='append')
+    args = parser.parse_args()
+
+    for profile in args.profile or ('default', 'safe', 'tuned'):
+        print(json.dumps(measure(profile, args.seconds, args.readers, \
+            args.batch_size)), flush=True)
+
+if "__main__" == __name__:
+    main()
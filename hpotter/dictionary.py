@@ -0,0 +1,126 @@
+import collections
+import datetime
+import hashlib
+
+from sqlalchemy import select, bindparam, cast, func, String
+
+from hpotter.tables import Dictionary
+
+# Bots send the same logins, commands and requests over and over, so rather
+# than store each value on every row, the DBWriter stores it once in the
+# dictionary table and the row gets its id. Recent values' ids are kept in
+# memory so most rows need no lookup at all.
+
+# the columns stored through the dictionary, by table; each has a
+# column_id alongside it
+interned = {
+    'credentials': ('username', 'password'),
+    'shellcommands': ('command',),
+    'httpcommands': ('request', 'payload'),
+    'sql': ('request', 'payload'),
+}
+
+def as_bytes(value):
+    if isinstance(value, str):
+        return value.encode('utf-8', 'backslashreplace')
+    return bytes(value)
+
+class Interner():
+    def __init__(self, entries=100000):
+        self.entries = entries
+        # (database, digest) -> dictionary id; each partition has its own
+        self.ids = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, session, data, digest, now, database=None):
+        key = (database, digest)
+        found = self.ids.get(key)
+        if found:
+            self.hits += 1
+            self.ids.move_to_end(key)
+            return found
+
+        self.misses += 1
+        table = Dictionary.__table__
+        found = session.execute(select([table.c.id]) \
+            .where(table.c.digest == digest)).scalar()
+        if not found:
+            found = session.execute(table.insert().values(digest=digest, \
+                value=data, count=0, first_seen=now, last_seen=now)) \
+                .inserted_primary_key[0]
+
+        self.ids[key] = found
+        if len(self.ids) > self.entries:
+            self.ids.popitem(last=False)
+        return found
+
+    def intern(self, session, rows, now=None):
+        ''' Move the rows' values into the dictionary, through session,
+        before they're flushed. '''
+        now = now or datetime.datetime.utcnow()
+        database = str(session.get_bind().url)
+        seen = collections.Counter()
+        for row in rows:
+            fields = interned.get(getattr(row, '__tablename__', None))
+            if not fields:
+                continue
+
+            # kept for reset
+            values = {field: getattr(row, field) for field in fields}
+            row.interned_values = values
+
+            for field, value in values.items():
+                if value is None:
+                    continue
+                data = as_bytes(value)
+                found = self.lookup(session, data, \
+                    hashlib.sha256(data).digest(), now, database)
+                seen[found] += 1
+                setattr(row, field + '_id', found)
+                setattr(row, field, None)
+
+        if seen:
+            table = Dictionary.__table__
+            session.execute(table.update() \
+                .where(table.c.id == bindparam('found')) \
+                .values(count=table.c.count + bindparam('seen'), \
+                    last_seen=now), \
+                [{'found': found, 'seen': count} \
+                    for found, count in seen.items()])
+
+    def reset(self, rows=()):
+        ''' After a rollback: forget every id, as inserts may have been
+        undone, and put the rows back as they were. '''
+        self.ids.clear()
+        for row in rows:
+            values = getattr(row, 'interned_values', None)
+            for field, value in (values or {}).items():
+                setattr(row, field, value)
+                setattr(row, field + '_id', None)
+
+    def stats(self):
+        return {'entries': len(self.ids), 'hits': self.hits, \
+            'misses': self.misses}
+
+def source(table):
+    ''' The table's columns by name, with interned values filled back in,
+    and what to select them from. '''
+    fields = interned.get(table.name, ())
+    dictionary = Dictionary.__table__
+    columns = collections.OrderedDict()
+    selectable = table
+    for column in table.columns:
+        if column.name in fields:
+            entry = dictionary.alias('dictionary_' + column.name)
+            selectable = selectable.outerjoin(entry, \
+                table.c[column.name + '_id'] == entry.c.id)
+            value = entry.c.value
+            if isinstance(column.type, String):
+                value = cast(value, String)
+            columns[column.name] = func.coalesce(value, column) \
+                .label(column.name)
+        elif not (column.name.endswith('_id') and \
+            column.name[:-len('_id')] in fields):
+            columns[column.name] = column
+    return columns, selectable
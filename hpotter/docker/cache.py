@@ -0,0 +1,107 @@
+import collections
+import shlex
+import threading
+import time
+
+# Output of commands that only look at the system, kept for a while so the
+# same recon from thousands of bots doesn't mean thousands of docker execs.
+
+# commands without side effects whose output is worth reusing
+deterministic = frozenset(('cat', 'df', 'du', 'env', 'find', 'free', 'grep', \
+    'head', 'hostname', 'id', 'ifconfig', 'ls', 'lscpu', 'netstat', 'nproc', \
+    'printenv', 'ps', 'stat', 'tail', 'uname', 'wc', 'which', 'who', \
+    'whoami'))
+
+# arguments that make one of them change something after all
+side_effects = {
+    'find': frozenset(('-delete', '-exec', '-execdir', '-ok', '-okdir', \
+        '-fprint', '-fprint0', '-fprintf', '-fls')),
+}
+
+# things that would mean something else to a real shell
+shell_syntax = ('>', '<', '|', ';', '&', '`', '$(')
+
+def normalize(command):
+    ''' The command as docker will run it, or None if it isn't cacheable. '''
+    try:
+        args = shlex.split(command)
+    except ValueError:
+        return None
+    if not args or args[0] not in deterministic:
+        return None
+    if side_effects.get(args[0], frozenset()).intersection(args[1:]):
+        return None
+    if any(syntax in command for syntax in shell_syntax):
+        return None
+    return ' '.join(args)
+
+class OutputCache():
+    def __init__(self, entries=1024, ttl=300, max_bytes=8 * 1024 * 1024, \
+        clock=time.monotonic):
+        self.max_entries = entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.clock = clock
+
+        self.lock = threading.Lock()
+        # key -> (expires, exit_code, output), least recently used first
+        self.entries = collections.OrderedDict()
+        self.bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def remove(self, key):
+        _, _, output = self.entries.pop(key)
+        self.bytes -= len(output)
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[0] <= self.clock():
+                self.remove(key)
+                self.expirations += 1
+                entry = None
+
+            if not entry:
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1], entry[2]
+
+    def put(self, key, exit_code, output):
+        if len(output) > self.max_bytes:
+            return
+
+        with self.lock:
+            if key in self.entries:
+                self.remove(key)
+            self.entries[key] = (self.clock() + self.ttl, exit_code, output)
+            self.bytes += len(output)
+
+            while len(self.entries) > self.max_entries or \
+                self.bytes > self.max_bytes:
+                self.remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'bytes': self.bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,256 @@
+import io
+import posixpath
+import shlex
+import tarfile
+import threading
+
+from hpotter.env import logger
+
+# Answers the commands bots send most from an in-memory snapshot of the shell
+# image, so they never need a docker exec. A command that isn't emulated, or
+# that uses something the emulation doesn't cover, returns None from emulate
+# and goes to the container as before.
+#
+# Output matches what exec_run would give: docker splits the command with
+# shlex and runs it without a shell, and without a tty.
+
+# copied out of the image, skipping /proc, /sys and /dev
+snapshot_paths = ('/bin', '/etc', '/home', '/lib', '/root', '/sbin', '/tmp', \
+    '/usr', '/var')
+
+# files bigger than this are listed but not kept
+max_file_size = 64 * 1024
+
+# run once in the container, their output is replayed from then on
+snapshot_commands = ('uname', 'uname -a', 'uname -s', 'uname -n', 'uname -r', \
+    'uname -v', 'uname -m', 'id', 'whoami', 'hostname', 'cat /proc/cpuinfo', \
+    'cat /proc/meminfo', 'cat /proc/version')
+
+def covered(path):
+    ''' Whether path is somewhere the snapshot was taken from; anything
+    else, it can't say isn't there. '''
+    return path == '/' or any(path == root or path.startswith(root + '/') \
+        for root in snapshot_paths)
+
+class Node():
+    def __init__(self, kind, content=None, target=None):
+        self.kind = kind            # 'dir', 'file' or 'link'
+        self.content = content      # None when too big to keep
+        self.target = target        # where a link points
+        self.children = set()
+
+class Snapshot():
+    def __init__(self):
+        self.nodes = {'/': Node('dir')}
+        self.outputs = {}
+
+    def add(self, path, node):
+        parent = posixpath.dirname(path)
+        if parent not in self.nodes:
+            self.add(parent, Node('dir'))
+        self.nodes[parent].children.add(posixpath.basename(path))
+        if path in self.nodes and node.kind == 'dir':
+            # keep children found before the directory itself
+            node.children = self.nodes[path].children
+        self.nodes[path] = node
+
+    def add_tar(self, fileobj, parent='/'):
+        # docker names archive members relative to the archived path's parent
+        with tarfile.open(fileobj=fileobj) as archive:
+            for member in archive:
+                path = posixpath.normpath(posixpath.join(parent, member.name))
+                if member.isdir():
+                    self.add(path, Node('dir'))
+                elif member.issym():
+                    self.add(path, Node('link', target=member.linkname))
+                elif member.isfile() or member.islnk():
+                    content = None
+                    if member.size <= max_file_size:
+                        content = archive.extractfile(member).read()
+                    self.add(path, Node('file', content))
+
+    def add_output(self, command, exit_code, output):
+        self.outputs[command] = (exit_code, output)
+
+    def realpath(self, path, follow=8):
+        ''' path with every link in it followed, or None for a loop. '''
+        resolved = '/'
+        for part in path.split('/'):
+            if part in ('', '.'):
+                continue
+            if part == '..':
+                resolved = posixpath.dirname(resolved)
+                continue
+
+            candidate = posixpath.join(resolved, part)
+            node = self.nodes.get(candidate)
+            if node and node.kind == 'link':
+                if follow <= 0:
+                    return None
+                candidate = self.realpath(posixpath.join(resolved, \
+                    node.target), follow - 1)
+                if candidate is None:
+                    return None
+            resolved = candidate
+        return resolved
+
+    def lookup(self, path):
+        path = self.realpath(path)
+        return self.nodes.get(path) if path else None
+
+    def isdir(self, path):
+        node = self.lookup(path)
+        return node is not None and node.kind == 'dir'
+
+    @classmethod
+    def from_container(cls, container):
+        snapshot = cls()
+        for path in snapshot_paths:
+            try:
+                chunks, _ = container.get_archive(path)
+            except Exception as exc:
+                logger.debug('No %s in shell image: %s', path, exc)
+                continue
+            snapshot.add_tar(io.BytesIO(b''.join(chunks)), \
+                posixpath.dirname(path))
+
+        for command in snapshot_commands:
+            exit_code, output = container.exec_run(command)
+            snapshot.add_output(command, exit_code, output)
+        return snapshot
+
+commands = {}
+
+def command(name):
+    ''' Register a function to emulate name. It's called with the command's
+    arguments, the working directory and the snapshot, and returns
+    (exit_code, output), or None to leave the command to docker. '''
+    def register(function):
+        commands[name] = function
+        return function
+    return register
+
+def resolve(path, workdir):
+    return posixpath.normpath(posixpath.join(workdir, path))
+
+@command('pwd')
+def pwd(args, workdir, snapshot):
+    if args:
+        return None
+    return 0, workdir.encode() + b'\n'
+
+@command('echo')
+def echo(args, workdir, snapshot):
+    newline = b'\n'
+    if args and args[0] == '-n':
+        args = args[1:]
+        newline = b''
+    if any(arg.startswith('-') for arg in args[:1]):
+        return None
+    return 0, ' '.join(args).encode() + newline
+
+@command('cat')
+def cat(args, workdir, snapshot):
+    if not args or any(arg.startswith('-') for arg in args):
+        return None
+
+    exit_code = 0
+    output = b''
+    for arg in args:
+        path = resolve(arg, workdir)
+        node = snapshot.lookup(path)
+        if node is None:
+            if not covered(path):
+                return None
+            output += b"cat: can't open '" + arg.encode() + \
+                b"': No such file or directory\n"
+            exit_code = 1
+        elif node.kind == 'dir':
+            output += b'cat: read error: Is a directory\n'
+            exit_code = 1
+        elif node.content is None:
+            return None
+        else:
+            output += node.content
+    return exit_code, output
+
+@command('ls')
+def ls(args, workdir, snapshot):
+    show_all = False
+    paths = []
+    for arg in args:
+        if arg in ('-a', '-1', '-1a', '-a1'):
+            show_all = show_all or 'a' in arg
+        elif arg.startswith('-'):
+            return None
+        else:
+            paths.append(arg)
+
+    exit_code = 0
+    listings = []
+    for arg in paths or ['.']:
+        path = resolve(arg, workdir)
+        node = snapshot.lookup(path)
+        if node is None:
+            if not covered(path):
+                return None
+            listings.append((None, 'ls: ' + arg + \
+                ': No such file or directory\n'))
+            exit_code = 1
+        elif node.kind != 'dir':
+            listings.append((None, arg + '\n'))
+        else:
+            names = sorted(node.children)
+            if show_all:
+                names = ['.', '..'] + names
+            else:
+                names = [name for name in names if not name.startswith('.')]
+            listings.append((arg, ''.join(name + '\n' for name in names)))
+
+    if len(listings) == 1:
+        return exit_code, listings[0][1].encode()
+
+    # errors and plain files first, then a heading for each directory
+    output = ''.join(text for name, text in listings if name is None)
+    directories = [name + ':\n' + text for name, text in listings if name]
+    if output and directories:
+        output += '\n'
+    output += '\n'.join(directories)
+    return exit_code, output.encode()
+
+image_snapshot = None
+image_snapshot_lock = threading.Lock()
+
+def get_snapshot(container):
+    ''' The snapshot, taken from container the first time through. '''
+    global image_snapshot
+    with image_snapshot_lock:
+        if image_snapshot is None:
+            logger.info('Taking shell image snapshot')
+            try:
+                image_snapshot = Snapshot.from_container(container)
+            except Exception as exc:
+                # emulate nothing, everything goes to docker
+                logger.info('Could not snapshot shell image: %s', exc)
+                image_snapshot = False
+        return image_snapshot
+
+def emulate(line, workdir, snapshot):
+    if not snapshot:
+        return None
+
+    try:
+        args = shlex.split(line)
+    except ValueError:
+        return None
+    if not args:
+        return None
+
+    canned = snapshot.outputs.get(' '.join(args))
+    if canned:
+        return canned
+
+    function = commands.get(args[0])
+    if not function:
+        return None
+    return function(args[1:], workdir, snapshot)
@@ -0,0 +1,177 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+import docker
+
+from hpotter.env import logger, docker_pins, docker_reuse
+from hpotter.metrics import histogram
+
+# Where the containers mariadb, httpipe and the shell pool run come from.
+#
+# An image is pulled only if it isn't here already, the first time it's
+# asked for, and the digest it resolved to is written to the pins file;
+# from then on that exact image is used, with no pulls, until its line is
+# taken out of the file.
+#
+# Containers are labelled with what they're for and a hash of how they
+# were run. mariadb's and httpd's are made afresh from the pinned image
+# every start, and whatever was left of last run's removed, volumes and
+# all, as an attacker may have written to them. With reuse on, the shell
+# containers still idle when the pool stops, never handed to anyone, are
+# stopped rather than removed, and the next pool starts with the ones that
+# match.
+
+starts = histogram('hpotter_container_start_seconds', \
+    'Time to get a container running, by how it was done', ('role', 'how'), \
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600))
+
+# how a container came to be running; the rest are cold starts
+warm = ('started',)
+
+def fingerprint(image, options):
+    text = json.dumps([image, options], sort_keys=True, default=str)
+    return hashlib.sha1(text.encode()).hexdigest()[:16]
+
+def healthy(container):
+    if container.status in ('dead', 'removing'):
+        return False
+    health = container.attrs.get('State', {}).get('Health') or {}
+    return health.get('Status') != 'unhealthy'
+
+class Lifecycle():
+    def __init__(self, client, pins=None, reuse=True):
+        self.client = client
+        self.path = pins
+        self.reuse = reuse
+        self.lock = threading.Lock()
+        self.pins = self.load()
+
+    def load(self):
+        if not self.path:
+            return {}
+        try:
+            with open(self.path) as pins:
+                return json.load(pins)
+        except FileNotFoundError:
+            return {}
+        except ValueError as exc:
+            logger.info('Ignoring image pins in %s: %s', self.path, exc)
+            return {}
+
+    def save(self):
+        # the caller holds the lock
+        if not self.path:
+            return
+        with open(self.path + '.part', 'w') as pins:
+            json.dump(self.pins, pins, indent=2, sort_keys=True)
+        os.replace(self.path + '.part', self.path)
+
+    def image(self, reference):
+        ''' The image pinned for reference, pulled if it isn't here; returns
+        it and whether it was pulled. '''
+        with self.lock:
+            pinned = self.pins.get(reference)
+        try:
+            image = self.client.images.get(pinned or reference)
+            pulled = False
+        except docker.errors.ImageNotFound:
+            logger.info('Pulling %s', pinned or reference)
+            image = self.client.images.pull(pinned or reference)
+            pulled = True
+
+        if not pinned:
+            # built here, it has no digest from a registry, just its id
+            digests = image.attrs.get('RepoDigests') or []
+            pinned = digests[0] if digests else image.id
+            logger.info('Pinning %s to %s', reference, pinned)
+            with self.lock:
+                self.pins[reference] = pinned
+                self.save()
+        return pinned, pulled
+
+    def record(self, role, how, began):
+        seconds = time.perf_counter() - began
+        starts.labels(role, how).observe(seconds)
+        logger.info('%s container %s in %.2fs, a %s start', role, how, \
+            seconds, 'warm' if how in warm else 'cold')
+
+    def leftovers(self, role):
+        return self.client.containers.list(all=True, \
+            filters={'label': 'hpotter.role=' + role})
+
+    def remove(self, container):
+        try:
+            # and its anonymous volumes, where mariadb keeps its data
+            container.remove(force=True, v=True)
+        except docker.errors.APIError as exc:
+            logger.info('Could not remove container %s: %s', \
+                container.name, exc)
+
+    def create(self, role, image, pulled, options, began):
+        labels = {'hpotter.role': role, \
+            'hpotter.config': fingerprint(image, options)}
+        container = self.client.containers.run(image, labels=labels, \
+            **options)
+        self.record(role, 'pulled' if pulled else 'created', began)
+        return container
+
+    def run(self, role, reference, **options):
+        ''' A new container for role. '''
+        began = time.perf_counter()
+        image, pulled = self.image(reference)
+        return self.create(role, image, pulled, options, began)
+
+    def container(self, role, reference, **options):
+        ''' role's one container, new, in place of any left from last
+        time. '''
+        began = time.perf_counter()
+        image, pulled = self.image(reference)
+        for container in self.leftovers(role):
+            self.remove(container)
+        return self.create(role, image, pulled, options, began)
+
+    def adopt(self, role, reference, limit, **options):
+        ''' Up to limit of role's containers that were stopped last time,
+        started again. Any left running might have been used, so they go
+        with the rest. '''
+        began = time.perf_counter()
+        image, _ = self.image(reference)
+        config = fingerprint(image, options)
+
+        adopted = []
+        for container in self.leftovers(role):
+            if self.reuse and len(adopted) < limit and \
+                container.status != 'running' and healthy(container) and \
+                container.labels.get('hpotter.config') == config:
+                container.start()
+                adopted.append(container)
+            else:
+                self.remove(container)
+        if adopted:
+            self.record(role, 'started', began)
+        return adopted
+
+    def retire(self, container, timeout=10):
+        ''' Keep a container nobody has used for next time, or with reuse
+        off, remove it. '''
+        if not self.reuse:
+            self.remove(container)
+            return
+        try:
+            container.stop(timeout=timeout)
+        except docker.errors.APIError as exc:
+            logger.info('Could not stop container %s: %s', \
+                container.name, exc)
+
+lifecycle = None
+lifecycle_lock = threading.Lock()
+
+def get_lifecycle():
+    global lifecycle
+    with lifecycle_lock:
+        if not lifecycle:
+            lifecycle = Lifecycle(docker.from_env(), docker_pins, docker_reuse)
+        return lifecycle
@@ -0,0 +1,260 @@
+import collections
+import queue
+import threading
+import time
+
+from hpotter.env import logger, machine, get_busybox, shell_pool_size, \
+    shell_pool_maximum
+from hpotter.metrics import gauge
+from hpotter.docker.lifecycle import get_lifecycle
+
+# Every telnet or ssh session gets a shell container of its own, leased from
+# a pool that is kept topped up in the background so sessions never wait
+# for a container to start. Containers aren't reused: once a session is done
+# with one it's removed and a fresh one takes its place. The ones still idle
+# when the pool stops were never used, so they're stopped rather than
+# removed, and the next start begins with them.
+
+class ContainerPool():
+    def __init__(self, create, destroy, size=2, maximum=10, keep=None):
+        self.create = create
+        self.destroy = destroy
+        self.keep = keep
+        self.size = size
+        self.maximum = maximum
+
+        self.condition = threading.Condition()
+        self.idle = collections.deque()
+        self.recycle = queue.Queue()
+        self.alive = 0          # idle, leased and starting
+        self.leased = 0
+        self.waiting = 0
+        self.running = False
+        self.threads = []
+
+        self.hits = 0
+        self.misses = 0
+        self.created = 0
+        self.recycled = 0
+        self.failures = 0
+        self.lease_wait_seconds = 0.0
+        self.max_lease_wait_seconds = 0.0
+
+    def adopt(self, containers):
+        ''' Begin with containers, before start. '''
+        with self.condition:
+            self.idle.extend(containers)
+            self.alive += len(containers)
+
+    def start(self):
+        self.running = True
+        self.threads = [
+            threading.Thread(target=self.refill, name='PoolRefill', \
+                daemon=True),
+            threading.Thread(target=self.reap, name='PoolReap', daemon=True)]
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+            idle = list(self.idle)
+            self.idle.clear()
+            self.alive -= len(idle)
+        self.recycle.put(None)
+        for thread in self.threads:
+            thread.join()
+        for container in idle:
+            if self.keep:
+                self.put_away(container)
+            else:
+                self.remove(container)
+
+    def put_away(self, container):
+        try:
+            self.keep(container)
+        except Exception as exc:
+            logger.info('Could not keep shell container: %s', exc)
+
+    def needed(self):
+        # keep size idle containers ready, plus one for each waiting lease,
+        # without going over maximum
+        starting = self.alive - len(self.idle) - self.leased
+        wanted = self.size + self.waiting - len(self.idle) - starting
+        return self.running and wanted > 0 and self.alive < self.maximum
+
+    def refill(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.needed() or \
+                    not self.running)
+                if not self.running:
+                    return
+                self.alive += 1
+
+            try:
+                container = self.create()
+            except Exception as exc:
+                logger.info('Could not start shell container: %s', exc)
+                with self.condition:
+                    self.alive -= 1
+                    self.failures += 1
+                time.sleep(1)
+                continue
+
+            with self.condition:
+                self.created += 1
+                if self.running:
+                    self.idle.append(container)
+                    self.condition.notify_all()
+                    continue
+                self.alive -= 1
+            self.remove(container)
+
+    def reap(self):
+        while True:
+            container = self.recycle.get()
+            if container is None:
+                return
+            self.remove(container)
+
+    def remove(self, container):
+        try:
+            self.destroy(container)
+        except Exception as exc:
+            logger.info('Could not remove shell container: %s', exc)
+
+    def lease(self, timeout=30):
+        start = time.perf_counter()
+        with self.condition:
+            if self.idle:
+                self.hits += 1
+            else:
+                self.misses += 1
+                self.waiting += 1
+                self.condition.notify_all()
+                self.condition.wait_for(lambda: self.idle or \
+                    not self.running, timeout)
+                self.waiting -= 1
+                if not self.idle:
+                    raise IOError('No shell container available')
+
+            container = self.idle.popleft()
+            self.leased += 1
+            # start a replacement
+            self.condition.notify_all()
+
+            waited = time.perf_counter() - start
+            self.lease_wait_seconds += waited
+            self.max_lease_wait_seconds = max(self.max_lease_wait_seconds, \
+                waited)
+            return container
+
+    def release(self, container):
+        with self.condition:
+            self.leased -= 1
+            self.alive -= 1
+            self.recycled += 1
+            self.condition.notify_all()
+            running = self.running
+        if running:
+            self.recycle.put(container)
+        else:
+            self.remove(container)
+
+    def stats(self):
+        with self.condition:
+            return {
+                'size': self.size,
+                'maximum': self.maximum,
+                'idle': len(self.idle),
+                'leased': self.leased,
+                'alive': self.alive,
+                'hits': self.hits,
+                'misses': self.misses,
+                'created': self.created,
+                'recycled': self.recycled,
+                'failures': self.failures,
+                'lease_wait_seconds': self.lease_wait_seconds,
+                'max_lease_wait_seconds': self.max_lease_wait_seconds,
+            }
+
+def shell_image():
+    ''' What a shell container is run from, and how. '''
+    if get_busybox():
+        return machine + 'busybox:latest', {'command': ['/bin/ash'], \
+            'tty': True, 'detach': True, 'read_only': True}
+    return machine + 'alpine:latest', {'command': ['/bin/ash'], \
+        'user': 'guest', 'tty': True, 'detach': True, 'read_only': True}
+
+def shell_role():
+    # each worker process has a pool, and containers, of its own
+    import hpotter.processes
+    number = hpotter.processes.worker_number
+    return 'shell' if number is None else 'shell-%d' % number
+
+def run_shell_container(lifecycle, role):
+    reference, options = shell_image()
+    container = lifecycle.run(role, reference, **options)
+    # a kept one is still disconnected when it's started again
+    lifecycle.client.networks.get('bridge').disconnect(container)
+    return container
+
+def remove_shell_container(container):
+    container.remove(force=True)
+
+shell_pool = None
+shell_pool_lock = threading.Lock()
+
+def start_shell():
+    global shell_pool
+    with shell_pool_lock:
+        if shell_pool:
+            logger.info('Shell pool already started')
+            return
+
+        logger.info('Starting shell pool')
+        lifecycle = get_lifecycle()
+        role = shell_role()
+        reference, options = shell_image()
+        # /bin/ash ignores SIGTERM, so don't wait for it
+        shell_pool = ContainerPool(lambda: run_shell_container(lifecycle, \
+            role), remove_shell_container, shell_pool_size, \
+            shell_pool_maximum, lambda container: lifecycle.retire( \
+                container, timeout=0))
+        shell_pool.adopt(lifecycle.adopt(role, reference, shell_pool_size, \
+            **options))
+        shell_pool.start()
+
+def stop_shell():
+    global shell_pool
+    with shell_pool_lock:
+        if not shell_pool:
+            return
+
+        logger.info('Stopping shell pool')
+        shell_pool.stop()
+        shell_pool = None
+
+def pool_stats():
+    pool = shell_pool
+    if not pool:
+        return {}
+    stats = pool.stats()
+    return {(name,): stats[name] for name in \
+        ('idle', 'leased', 'alive', 'hits', 'misses', 'failures')}
+
+gauge('hpotter_shell_pool', 'Shell containers, and how leases went', \
+    ('state',), pool_stats)
+
+def lease_shell():
+    start_shell()
+    return shell_pool.lease()
+
+def release_shell(container):
+    pool = shell_pool
+    if pool:
+        pool.release(container)
+    else:
+        remove_shell_container(container)
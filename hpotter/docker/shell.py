@@ -1,49 +1,124 @@
+import posixpath
 import re
-
-from hpotter.env import logger, start_shell, get_busybox, get_shell_container
+import shlex
+import time
+
+from hpotter.env import logger, get_busybox, output_cache_entries, \
+    output_cache_ttl, output_cache_bytes
+from hpotter.docker.pool import lease_shell, release_shell
+from hpotter.docker.emulator import get_snapshot, emulate, covered
+from hpotter.docker.cache import OutputCache, normalize, deterministic
 from hpotter import tables
-
-def get_string(client_socket, limit=4096, telnet=False):
-    character = client_socket.recv(1)
-    if not telnet:
-        client_socket.send(character)
-
-    # while there are telnet commands
-    while telnet and character == b'\xff':
-        # skip the next two as they are part of the telnet command
-        client_socket.recv(1)
-        client_socket.recv(1)
-        character = client_socket.recv(1)
-
-    string = ''
-    while character not in (b'\n', b'\r'):
-        if character == b'\b':      # backspace
-            string = string[:-1]
-        elif character == '\x15':   # control-u
-            string = ''
-        elif ord(character) > 127:
-            logger.debug('Meta character')
-            raise UnicodeError('Meta character')
-        elif len(string) > limit:
-            logger.debug('Too many characters')
-            raise IOError('Too many characters')
-        else:
-            string += character.decode('utf-8')
-
-        character = client_socket.recv(1)
-        if not telnet:
-            client_socket.send(character)
-
-
-    if not telnet:
-        client_socket.send(b'\n')
-
-    # read the newline
-    if telnet and character == b'\r':
-        character = client_socket.recv(1)
-
-    logger.debug('get_string returing %s', string.strip())
-    return string.strip()
+from hpotter.writer import write
+from hpotter.metrics import histogram
+
+# https://tools.ietf.org/html/rfc854
+IAC = 255
+DONT = 254
+DO = 253
+WONT = 252
+WILL = 251
+SB = 250
+SE = 240
+
+# where LineReader is in a telnet command
+DATA, COMMAND, OPTION, SUBNEGOTIATION, SUBNEGOTIATION_IAC = range(5)
+
+class LineReader():
+    ''' Reads lines from a socket a chunk at a time rather than a byte per
+    recv. Telnet commands are stripped out as they arrive, even when split
+    across chunks, and when not in telnet mode the echo of each chunk goes
+    back in one send. Keep one per connection: what's read past the end of
+    a line is kept for the next one. '''
+    def __init__(self, client_socket, telnet=False, size=4096):
+        self.client_socket = client_socket
+        self.telnet = telnet
+        self.size = size
+        self.buffer = b''
+        self.offset = 0
+        self.state = DATA
+        # skip the LF or NUL of a CR LF or CR NUL
+        self.after_cr = False
+
+    def telnet_byte(self, byte):
+        ''' Return the data byte, or None if byte is part of a command. '''
+        if self.state == DATA:
+            if byte == IAC:
+                self.state = COMMAND
+                return None
+            return byte
+
+        if self.state == COMMAND:
+            if byte == IAC:         # an escaped 255
+                self.state = DATA
+                return byte
+            if byte in (WILL, WONT, DO, DONT):
+                self.state = OPTION
+            elif byte == SB:
+                self.state = SUBNEGOTIATION
+            else:                   # NOP, GA, and friends
+                self.state = DATA
+        elif self.state == OPTION:
+            self.state = DATA
+        elif self.state == SUBNEGOTIATION:
+            if byte == IAC:
+                self.state = SUBNEGOTIATION_IAC
+        elif self.state == SUBNEGOTIATION_IAC:
+            self.state = DATA if byte == SE else SUBNEGOTIATION
+        return None
+
+    def readline(self, limit=4096):
+        line = bytearray()
+        echo = bytearray()
+        while True:
+            if self.offset >= len(self.buffer):
+                if echo:
+                    self.client_socket.sendall(bytes(echo))
+                    echo.clear()
+                self.buffer = self.client_socket.recv(self.size)
+                self.offset = 0
+                if not self.buffer:
+                    raise IOError('Connection closed')
+
+            byte = self.buffer[self.offset]
+            self.offset += 1
+
+            if self.telnet:
+                byte = self.telnet_byte(byte)
+                if byte is None:
+                    continue
+
+            if self.after_cr:
+                self.after_cr = False
+                if byte in (0, 10):
+                    continue
+
+            if not self.telnet:
+                echo.append(byte)
+
+            if byte in (10, 13):    # LF, CR
+                self.after_cr = byte == 13
+                break
+            elif byte in (8, 127):  # backspace, delete
+                del line[-1:]
+            elif byte == 21:        # control-u
+                line.clear()
+            elif byte > 127:
+                logger.debug('Meta character')
+                raise UnicodeError('Meta character')
+            elif len(line) > limit:
+                logger.debug('Too many characters')
+                raise IOError('Too many characters')
+            else:
+                line.append(byte)
+
+        if not self.telnet:
+            echo += b'\n'
+            self.client_socket.sendall(bytes(echo))
+
+        string = line.decode('utf-8').strip()
+        logger.debug('readline returning %s', string)
+        return string
 
 def deal_with_dots(path, workdir):
     while path.startswith('.'):
@@ -81,24 +156,75 @@ def change_directory(command, workdir):
     if directory.startswith('.'):
         return deal_with_dots(directory, workdir)
 
-    if directory == '/':
-        return '/'
+    if directory.startswith('/'):
+        # posix keeps a leading //, the shell doesn't
+        return '/' + posixpath.normpath(directory).lstrip('/')
 
     if workdir == '/':
         return workdir + directory
 
     return workdir + '/' + directory
 
-def fake_shell(client_socket, session, connection, prompt, telnet=False):
-    start_shell()
-
+output_cache = OutputCache(output_cache_entries, output_cache_ttl, \
+    output_cache_bytes)
+
+exec_seconds = histogram('hpotter_shell_command_seconds', \
+    'Time to answer a shell command, by command and what answered it', \
+    ('command', 'via'))
+
+def command_label(command):
+    # bots send anything, so only the commands worth caching get a label
+    # of their own
+    try:
+        name = shlex.split(command)[0]
+    except (ValueError, IndexError):
+        return 'other'
+    return name if name in deterministic else 'other'
+
+def exec_command(container, command, workdir):
+    # every session's container is a fresh copy of the same image, so what
+    # one of them answered holds for all of them
+    start = time.perf_counter()
+    normalized = normalize(command)
+    if normalized is None:
+        result = container.exec_run(command, workdir=workdir)
+        exec_seconds.labels(command_label(command), 'docker') \
+            .observe(time.perf_counter() - start)
+        return result
+
+    key = (normalized, workdir, container.attrs['Config']['Image'])
+    cached = output_cache.get(key)
+    if cached:
+        exec_seconds.labels(command_label(command), 'cache') \
+            .observe(time.perf_counter() - start)
+        return cached
+
+    exit_code, output = container.exec_run(command, workdir=workdir)
+    output_cache.put(key, exit_code, output)
+    exec_seconds.labels(command_label(command), 'docker') \
+        .observe(time.perf_counter() - start)
+    return exit_code, output
+
+def fake_shell(client_socket, connection, prompt, telnet=False, reader=None):
+    if not reader:
+        reader = LineReader(client_socket, telnet=telnet)
+
+    # a container of our own for the session, handed back when we're done
+    container = lease_shell()
+    try:
+        run_shell(client_socket, connection, prompt, reader, container)
+    finally:
+        release_shell(container)
+
+def run_shell(client_socket, connection, prompt, reader, container):
+    snapshot = get_snapshot(container)
     command_count = 0
     workdir = '/'
     while command_count < 4:
         client_socket.sendall(prompt)
 
         try:
-            command = get_string(client_socket, telnet=telnet)
+            command = reader.readline()
             command_count += 1
         except Exception as exception:
             logger.debug(exception)
@@ -111,20 +237,39 @@ def fake_shell(client_socket, session, connection, prompt, telnet=False):
         if command == 'exit':
             break
 
-        if command.startswith('cd'):
-            workdir = change_directory(command, workdir)
-
-        logger.debug('Shell workdir %s', workdir)
-
         cmd = tables.ShellCommands(command=command, connection=connection)
-        session.add(cmd)
-        session.commit()
-        logger.debug('Shell committed command')
+        write(cmd)
+        logger.debug('Shell queued command')
+
+        if command.startswith('cd'):
+            directory = change_directory(command, workdir)
+            if not snapshot:
+                found = True
+            elif covered(directory):
+                found = snapshot.isdir(directory)
+            else:
+                # /proc, /dev and the like are only in the container
+                exit_code, _ = exec_command(container, \
+                    'test -d ' + shlex.quote(directory), '/')
+                found = exit_code == 0
+            if not found:
+                client_socket.sendall(b"sh: cd: can't cd to " + \
+                    command[3:].strip().encode('utf-8') + b'\r\n')
+            else:
+                workdir = directory
+            logger.debug('Shell workdir %s', workdir)
+            continue
 
         # timeout = 'timeout 1 ' if get_busybox() else 'timeout -t 1 '
 
-        exit_code, output = get_shell_container().exec_run(command, \
-            workdir=workdir)
+        start = time.perf_counter()
+        result = emulate(command, workdir, snapshot)
+        if result is not None:
+            exit_code, output = result
+            exec_seconds.labels(command_label(command), 'emulator') \
+                .observe(time.perf_counter() - start)
+        else:
+            exit_code, output = exec_command(container, command, workdir)
 
         logger.debug('Shell exit_code %s', str(exit_code))
         logger.debug('Shell output %s', str(output))
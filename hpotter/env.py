@@ -1,62 +1,143 @@
+import configparser
 import logging
 import logging.config
+import os
 import platform
-import docker
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, scoped_session
+import threading
 from hpotter.tables import Base
+from hpotter.storage import create_storage_engine
+from hpotter.partitions import Partitions
+from hpotter.migrations import migrate
 
-logging.config.fileConfig('hpotter/logging.conf')
+# partitions and migrations have already asked for the logger
+logging.config.fileConfig('hpotter/logging.conf', \
+    disable_existing_loggers=False)
 logger = logging.getLogger('hpotter')
 
+config = configparser.ConfigParser()
+config.read(os.environ.get('HPOTTER_CONFIG', 'hpotter/hpotter.conf'))
+
 # note sqlite:///:memory: can't be used, even for testing, as it
 # doesn't work with threads.
-db = 'sqlite:///main.db'
-engine = create_engine(db)
-# engine = create_engine(db, echo=True)
-Base.metadata.create_all(engine)
-Session = scoped_session(sessionmaker(engine))
+db = config.get('database', 'url', fallback='sqlite:///main.db')
+db_profile = config.get('database', 'profile', fallback='tuned')
+db_pool_size = config.getint('database', 'pool_size', fallback=5)
+db_pragmas = {name: config.get('database', name) for name in \
+    ('synchronous', 'mmap_size', 'cache_size', 'busy_timeout') \
+    if config.has_option('database', name)}
+intern = config.getboolean('database', 'intern', fallback=True)
+intern_cache = config.getint('database', 'intern_cache', fallback=100000)
+# with partitioning, url is only read; new rows go to the partitions
+db_partition = config.get('database', 'partition', fallback='day')
+
+# opened, and made or migrated, the first time it's asked for rather than
+# on import, as worker processes import this for their settings alone
+database = None
+database_lock = threading.Lock()
+
+def get_database():
+    ''' The engine on url, and the Partitions or None. '''
+    global database
+    with database_lock:
+        if database:
+            return database
+        engine = create_storage_engine(db, db_profile, db_pool_size, \
+            db_pragmas)
+        Base.metadata.create_all(engine)
+        migrate(engine)
+
+        partitions = None
+        if db_partition != 'none' and db.startswith('sqlite'):
+            partitions = Partitions( \
+                config.get('database', 'partition_directory', \
+                    fallback='partitions'), \
+                db_partition, engine, \
+                config.getint('database', 'archive_after', fallback=0), \
+                config.getint('database', 'drop_after', fallback=0), \
+                config.getint('database', 'open_partitions', fallback=32), \
+                lambda url: create_storage_engine(url, db_profile, \
+                    db_pool_size, db_pragmas))
+        database = engine, partitions
+        return database
 
 # a start, for a Pi 0.
 machine = 'arm32v6/' if platform.machine() == 'armv6l' else ''
 
 busybox = True
-shell_container = None
 
 def get_busybox():
     return busybox
 
-def get_shell_container():
-    return shell_container
-
-def start_shell():
-    global shell_container
-    if shell_container:
-        logger.info('Shell container already started')
-        return
-
-    logger.info('Starting shell container')
-    client = docker.from_env()
-    if busybox:
-        shell_container = client.containers.run(machine + 'busybox:latest', \
-            command=['/bin/ash'], tty=True, detach=True, read_only=True)
-    else:
-        shell_container = client.containers.run(machine + 'alpine:latest', \
-            command=['/bin/ash'], user='guest', tty=True, detach=True, \
-                read_only=True)
-
-    client.networks.get('bridge').disconnect(shell_container)
-
-def stop_shell():
-    if not shell_container:
-        return
-
-    logger.info('Stopping shell container')
-    shell_container.stop()
-    logger.info('Removing shell container')
-    shell_container.remove()
-
-jsonserverport = 8000
+# see hpotter.conf for what these are
+shell_pool_size = config.getint('shell', 'pool_size', fallback=2)
+shell_pool_maximum = config.getint('shell', 'pool_maximum', fallback=10)
+
+docker_pins = config.get('docker', 'pins', fallback='images.json')
+docker_reuse = config.getboolean('docker', 'reuse', fallback=True)
+
+output_cache_entries = config.getint('shell', 'cache_entries', fallback=1024)
+output_cache_ttl = config.getint('shell', 'cache_ttl', fallback=300)
+output_cache_bytes = config.getint('shell', 'cache_bytes', \
+    fallback=8 * 1024 * 1024)
+
+ssh_workers = config.getint('ssh', 'workers', fallback=32)
+ssh_backlog = config.getint('ssh', 'backlog', fallback=64)
+
+telnet_workers = config.getint('telnet', 'workers', fallback=32)
+telnet_backlog = config.getint('telnet', 'backlog', fallback=64)
+telnet_when_full = config.get('telnet', 'when_full', fallback='tarpit')
+http500_workers = config.getint('http500', 'workers', fallback=16)
+http500_backlog = config.getint('http500', 'backlog', fallback=64)
+http500_when_full = config.get('http500', 'when_full', fallback='tarpit')
+
+admission_enabled = config.getboolean('admission', 'enabled', fallback=True)
+admission_rate = config.getfloat('admission', 'rate', fallback=5)
+admission_burst = config.getint('admission', 'burst', fallback=20)
+admission_global_rate = config.getfloat('admission', 'global_rate', \
+    fallback=200)
+admission_global_burst = config.getint('admission', 'global_burst', \
+    fallback=400)
+admission_per_address = config.getint('admission', 'per_address', \
+    fallback=16)
+admission_connections = config.getint('admission', 'connections', \
+    fallback=512)
+admission_addresses = config.getint('admission', 'addresses', \
+    fallback=65536)
+admission_exempt = [address.strip() for address in config.get('admission', \
+    'exempt', fallback='127.0.0.1, ::1').split(',') if address.strip()]
+tarpit_connections = config.getint('admission', 'tarpit_connections', \
+    fallback=1024)
+tarpit_interval = config.getfloat('admission', 'tarpit_interval', \
+    fallback=5)
+tarpit_seconds = config.getfloat('admission', 'tarpit_seconds', \
+    fallback=300)
+
+geoip_enrich = config.getboolean('geoip', 'enrich', fallback=True)
+geoip_cache_size = config.getint('geoip', 'cache_size', fallback=65536)
+geoip_bin_ttl = config.getint('geoip', 'bin_ttl', fallback=60)
+
+jsonserverport = config.getint('jsonserver', 'port', fallback=8000)
+jsonserver_cache_entries = config.getint('jsonserver', 'cache_entries', \
+    fallback=256)
+jsonserver_cache_bytes = config.getint('jsonserver', 'cache_bytes', \
+    fallback=64 * 1024 * 1024)
+jsonserver_cache_response_bytes = config.getint('jsonserver', \
+    'cache_response_bytes', fallback=4 * 1024 * 1024)
+
+metrics_enabled = config.getboolean('metrics', 'enabled', fallback=True)
+metrics_address = config.get('metrics', 'address', fallback='127.0.0.1')
+metrics_port = config.getint('metrics', 'port', fallback=9180)
+
+plugins_enabled = [name.strip() for name in config.get('plugins', \
+    'enabled', fallback='mariadb').split(',') if name.strip()]
+plugin_start_timeout = config.getint('plugins', 'start_timeout', \
+    fallback=300)
+plugin_ready_timeout = config.getint('plugins', 'ready_timeout', \
+    fallback=120)
+
+process_workers = config.getint('processes', 'workers', fallback=0)
+process_plugins = [name.strip() for name in config.get('processes', \
+    'plugins', fallback='ssh, telnet, http500').split(',') if name.strip()]
 
 # some singletons
 telnet_server = None
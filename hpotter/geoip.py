@@ -0,0 +1,116 @@
+import functools
+import threading
+
+import maxminddb
+from geolite2 import geolite2
+from sqlalchemy import select, bindparam
+
+from hpotter.env import logger, geoip_cache_size
+from hpotter.tables import Connections
+
+# Where an address is, from the packaged GeoLite2 database. The database is
+# opened once, memory mapped, and shared by every thread; recent answers are
+# kept, as the same addresses come back over and over.
+
+reader = None
+reader_lock = threading.Lock()
+
+def get_reader():
+    global reader
+    with reader_lock:
+        if reader is None:
+            # the C extension maps the file too, and is much quicker
+            for mode in (maxminddb.MODE_MMAP_EXT, maxminddb.MODE_MMAP):
+                try:
+                    reader = maxminddb.open_database(geolite2.filename, mode)
+                    break
+                except Exception as exc:
+                    logger.info('Could not open GeoIP database: %s', exc)
+                    reader = False
+        return reader
+
+@functools.lru_cache(maxsize=geoip_cache_size)
+def locate(address):
+    ''' (country, latitude, longitude) for address, or None if it isn't in
+    the database. '''
+    database = get_reader()
+    if not database:
+        return None
+
+    try:
+        info = database.get(str(address))
+    except ValueError:
+        return None
+    if not info or not info.get('location'):
+        return None
+
+    location = info['location']
+    country = info.get('country') or info.get('registered_country') or {}
+    return country.get('iso_code'), location.get('latitude'), \
+        location.get('longitude')
+
+def enrich(row):
+    ''' Fill in where a connection came from, before it's written. '''
+    if not isinstance(row, Connections) or not row.sourceIP or \
+        row.latitude is not None:
+        return
+
+    found = locate(str(row.sourceIP))
+    if found:
+        row.country, row.latitude, row.longitude = found
+
+# Rows written before enriching was turned on, or while it was off, are
+# filled in behind, a batch at a time, by a thread of its own; the map
+# reads only rows that have been.
+
+def backfill(engine, batch_size=500):
+    ''' Fill in where engine's connections that weren't enriched came
+    from; returns how many could be. '''
+    table = Connections.__table__
+    after = 0
+    filled = 0
+    while True:
+        with engine.begin() as connection:
+            found = connection.execute(select([table.c.id, \
+                table.c.sourceIP]) \
+                .where(table.c.latitude.is_(None)) \
+                .where(table.c.sourceIP.isnot(None)) \
+                .where(table.c.id > after) \
+                .order_by(table.c.id).limit(batch_size)).fetchall()
+            if not found:
+                return filled
+            after = found[-1][0]
+
+            located = []
+            for row, address in found:
+                place = locate(str(address))
+                if place and place[1] is not None:
+                    located.append({'row': row, 'place_country': place[0], \
+                        'place_latitude': place[1], \
+                        'place_longitude': place[2]})
+            if located:
+                connection.execute(table.update() \
+                    .where(table.c.id == bindparam('row')) \
+                    .values(country=bindparam('place_country'), \
+                        latitude=bindparam('place_latitude'), \
+                        longitude=bindparam('place_longitude')), located)
+                filled += len(located)
+
+def start_backfill(engine, partitions=None):
+    ''' Backfill engine, or every partition, in the background. '''
+    def run():
+        engines = [partition.engine for partition in partitions.covering()] \
+            if partitions else [engine]
+        for found in engines:
+            try:
+                filled = backfill(found)
+            except Exception as exc:
+                logger.info('GeoIP backfill of %s failed: %s', found.url, exc)
+                continue
+            if filled:
+                logger.info('GeoIP backfill located %d connections in %s', \
+                    filled, found.url)
+
+    thread = threading.Thread(target=run, name='GeoIPBackfill', daemon=True)
+    thread.start()
+    return thread
@@ -1,27 +1,55 @@
+import base64
+import collections
 import datetime
 import decimal
-import json
+import hashlib
 import ipaddress
+import itertools
+import socket
+import time
 
-from http.server import HTTPServer, SimpleHTTPRequestHandler
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
 from urllib.parse import urlparse, parse_qs
 
-from sqlalchemy import create_engine
+from sqlalchemy import func
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.sql import select
 
-from geolite2 import geolite2
-
-from hpotter.env import db, jsonserverport
+from hpotter.env import get_database, jsonserverport, geoip_bin_ttl, \
+    jsonserver_cache_entries, jsonserver_cache_bytes, \
+    jsonserver_cache_response_bytes
+from hpotter.dictionary import interned
 from hpotter.tables import Base, Connections
+from hpotter.jsonserver.stream import CachingWriter, rows, write_json, \
+    write_jsonp, write_header_and_data
+from hpotter.jsonserver.cache import ResponseCache
+from hpotter.jsonserver.query import table_query, next_link, since, \
+    integer, single
+from hpotter.jsonserver.stats import stats_query, merge
+from hpotter.jsonserver.binning import BinCache, cell_size, bin_points, \
+    feature_collection
 
 # http://codeandlife.com/2014/12/07/sqlalchemy-results-to-json-the-easy-way/
 
-engine = create_engine(db) #, echo=True)
-session = sessionmaker(bind=engine)
-session = session()
-# magic to get all the tables.
-Base.metadata.reflect(bind=engine)
+engine, partitions = get_database()
+# one per request
+Session = sessionmaker(bind=engine)
+# magic to get all the tables, but not the statistics ANALYZE keeps, which
+# create_all can't make
+Base.metadata.reflect(bind=engine, \
+    only=lambda name, _: not name.startswith('sqlite_'))
+
+bin_cache = BinCache(geoip_bin_ttl)
+response_cache = ResponseCache(jsonserver_cache_entries, \
+    jsonserver_cache_bytes)
+
+# tables whose rows change in place, and the tables whose new rows are
+# what changes them
+changed_by = {
+    'dictionary': tuple(interned),
+    'portcounts': ('connections',),
+    'credentialcounts': ('credentials',),
+}
 
 def minutes_ago(diff):
     return datetime.datetime.utcnow() - datetime.timedelta(minutes=diff)
@@ -42,6 +70,15 @@ def months_ago(diff):
 def years_ago(diff):
     return weeks_ago(diff*52)
 
+deltas = {
+    'minutes_ago':  minutes_ago,
+    'hours_ago':    hours_ago,
+    'days_ago':     days_ago,
+    'weeks_ago':    weeks_ago,
+    'months_ago':   months_ago,
+    'years_ago':    years_ago,
+}
+
 def alchemyencoder(obj):
     """JSON encoder function for SQLAlchemy special classes."""
     if isinstance(obj, datetime.date):
@@ -56,75 +93,115 @@ def alchemyencoder(obj):
     if isinstance(obj, ipaddress.IPv6Address):
         return str(obj)
 
-class JSONHandler(SimpleHTTPRequestHandler):
-
-    # this is for https://datatables.net/ and
-    # https://github.com/daleroy1/freeboard-table
-    def header_and_data(self, database, res):
-        self.wfile.write(b'{"header":[')
-        for column in database.__table__.columns:
-            self.wfile.write(b'"' + column.name.encode() + b'", ')
-        self.wfile.write(b'], "data": [')
-        for row in res:
-            self.wfile.write(b'{')
-            for column in database.__table__.columns:
-                self.wfile.write(b'"' + column.name.encode() + b'" : "' + \
-                    str(row[column.name]).encode() + b'", ')
-            self.wfile.write(b'} ,')
-        self.wfile.write(b']}')
+    if isinstance(obj, bytes):
+        return base64.b64encode(obj).decode()
 
+class JSONHandler(SimpleHTTPRequestHandler):
+    # needed for chunked responses
+    protocol_version = 'HTTP/1.1'
 
     def geoip_header(self):
-        self.wfile.write(b'{')
-        self.wfile.write(b'"type": "Feature",')
-        self.wfile.write(b'"geometry": {')
-        self.wfile.write(b'"type": "MultiPoint",')
-        self.wfile.write(b'"coordinates": [')
-
-    def geoip_results(self, results):
-        reader = geolite2.reader()
-        previous = False
-
-        for result in results:
-            info = reader.get(str(result).split("'")[1])
-            if not info:
-                continue
+        self.out.write(b'{')
+        self.out.write(b'"type": "Feature",')
+        self.out.write(b'"geometry": {')
+        self.out.write(b'"type": "MultiPoint",')
+        self.out.write(b'"coordinates": [')
 
-            location = info['location']
-            if not location:
-                continue
+    def geoip_results(self, points):
+        previous = False
 
+        for longitude, latitude in points:
             if previous:
-                self.wfile.write(b',')
+                self.out.write(b',')
             previous = True
 
-            self.wfile.write(b'[')
-            self.wfile.write(str(location['longitude']).encode())
-            self.wfile.write(b',')
-            self.wfile.write(str(location['latitude']).encode())
-            self.wfile.write(b']')
-
-        self.wfile.write(b']}}')
+            self.out.write(b'[')
+            self.out.write(str(longitude).encode())
+            self.out.write(b',')
+            self.out.write(str(latitude).encode())
+            self.out.write(b']')
 
-    # https://tools.ietf.org/html/rfc7946#appendix-A.4
-    def geoip(self):
-        self.geoip_header()
+        self.out.write(b']}}')
 
-        query = Connections.sourceIP
+    def window(self):
+        ''' The *_ago asked for, as (name, amount), or None. '''
         # this order on the assumption there are fewer queries than deltas
         for delta in self.queries:
             if delta in self.deltas:
-                diff = int(self.queries[delta][0])
-                results = session.query(query) \
-                    .filter(Connections.created_at > self.deltas[delta](diff)) \
-                    .distinct()
-                break
-        else:
-            results = session.query(query).distinct()
+                return delta, int(self.queries[delta][0])
+        return None
+
+    def when(self, window):
+        if not window:
+            return None
+        name, diff = window
+        return self.deltas[name](diff)
+
+    def databases(self, window=None, after_id=None, descending=False, \
+        rollups=False):
+        ''' A session on each database the request needs, in id order. '''
+        if not partitions:
+            return [self.session]
+        found = []
+        for partition in partitions.covering(self.when(window), after_id, \
+            descending, rollups):
+            if partition.path not in self.opened:
+                self.opened[partition.path] = partition.Session()
+            found.append(self.opened[partition.path])
+        return found
+
+    def since(self, query, window):
+        if window:
+            name, diff = window
+            query = query.filter(since(self.deltas[name](diff)))
+        return query
 
-        self.geoip_results(results)
+    # https://tools.ietf.org/html/rfc7946#appendix-A.4
+    def geoip(self, window):
+        self.geoip_header()
 
-    def send_headers(self):
+        points = []
+        for session in self.databases(window):
+            # only what's been located; older rows are filled in behind,
+            # by hpotter.geoip's backfill
+            stored = session.query(Connections.longitude, \
+                Connections.latitude) \
+                .filter(Connections.latitude.isnot(None))
+            points.append(self.since(stored, window).distinct())
+
+        points = itertools.chain.from_iterable(points)
+        if partitions:
+            # the same address can turn up in more than one partition
+            points = collections.OrderedDict.fromkeys(points)
+        self.geoip_results(points)
+
+    def geoip_binned(self, window, size):
+        # by the ETag too, so a new row means new bins rather than the old
+        # ones under a new tag
+        key = (window, size, self.tag)
+        body = bin_cache.get(key)
+        if body is None:
+            longitudes, latitudes, weights = [], [], []
+
+            # cells add up their points' weights, so a point in two
+            # partitions is counted right
+            for session in self.databases(window):
+                stored = session.query(Connections.longitude, \
+                    Connections.latitude, func.count()) \
+                    .filter(Connections.latitude.isnot(None)) \
+                    .group_by(Connections.longitude, Connections.latitude)
+                for longitude, latitude, count in self.since(stored, window):
+                    longitudes.append(longitude)
+                    latitudes.append(latitude)
+                    weights.append(count)
+
+            body = feature_collection(*bin_points(longitudes, latitudes, \
+                weights, size))
+            bin_cache.put(key, body)
+
+        self.out.write(body)
+
+    def send_headers(self, headers=(), length=None):
         self.send_response(200)
         if 'callback' in self.queries:
             mime = 'application/javascript'
@@ -132,8 +209,108 @@ class JSONHandler(SimpleHTTPRequestHandler):
             mime = 'text/javascript'
         self.send_header('Content-type', mime)
         self.send_header('Access-Control-Allow-Origin', '*')
+        # use it, but check back first
+        self.send_header('Cache-Control', 'no-cache')
+        if length is None:
+            self.send_header('Transfer-Encoding', 'chunked')
+        else:
+            self.send_header('Content-Length', str(length))
+        for header in headers:
+            self.send_header(*header)
         self.end_headers()
 
+    def etag(self, names):
+        ''' A tag for what this request would get back now: the request,
+        and the newest id of every table it reads. '''
+        tables = Base.metadata.tables
+        names = set(names)
+        for name in list(names):
+            names.update(changed_by.get(name, ()))
+        columns = [select([func.max(tables[name].c.id)]).as_scalar() \
+            for name in sorted(names) if 'id' in tables[name].c]
+        state = ()
+        if columns:
+            state = tuple(tuple(session.execute(select(columns)).fetchone()) \
+                for session in self.databases(self.window()))
+
+        # a window moves on even when nothing is added
+        minute = int(time.time() // 60) if self.window() else None
+        return '"%s"' % hashlib.sha1(repr((self.path, state, minute)) \
+            .encode()).hexdigest()
+
+    def not_modified(self, etag):
+        tags = self.headers.get('If-None-Match')
+        if not tags:
+            return False
+        tags = [tag.strip() for tag in tags.split(',')]
+        return etag in tags or '*' in tags
+
+    def respond(self, names, prepare):
+        ''' Answer with what prepare's write function writes, unless the
+        tables in names haven't changed since the client or the cache last
+        saw it. prepare returns the extra headers and the write function. '''
+        etag = self.etag(names)
+        # pylint: disable=W0201
+        self.tag = etag
+        if self.not_modified(etag):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+            return
+
+        cached = response_cache.get(self.path, etag)
+        if cached:
+            headers, body = cached
+            self.send_headers(headers + [('ETag', etag)], len(body))
+            self.wfile.write(body)
+            return
+
+        headers, write = prepare()
+        self.send_headers(headers + [('ETag', etag)])
+        # pylint: disable=W0201
+        self.out = CachingWriter(self.wfile, jsonserver_cache_response_bytes)
+        try:
+            write()
+        except Exception:
+            # the headers are gone, so the only way left to say the body is
+            # short is to drop the connection without its last chunk
+            self.close_connection = True
+            try:
+                self.connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            raise
+        self.out.close()
+        if self.out.copy is not None:
+            response_cache.put(self.path, etag, headers, bytes(self.out.copy))
+
+    def not_found(self):
+        self.send_response(404)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def stats(self, name):
+        try:
+            query = stats_query(name, self.queries, self.deltas)
+        except KeyError:
+            self.not_found()
+            return
+        except ValueError as error:
+            self.send_error(400, str(error))
+            return
+
+        def prepare():
+            databases = self.databases(self.window(), rollups=True)
+            if len(databases) == 1:
+                results = databases[0].execute(query).fetchall()
+            else:
+                results = merge([session.execute(query.limit(None)) \
+                    for session in databases], self.queries)
+            return [], lambda: self.write_results(query, results)
+
+        self.respond(('connections', 'credentials'), prepare)
+
     # pylint: disable=C0103
     def do_GET(self):
         url = urlparse(self.path)
@@ -141,67 +318,106 @@ class JSONHandler(SimpleHTTPRequestHandler):
             SimpleHTTPRequestHandler.do_GET(self)
             return
 
-        tables = Base.metadata.tables
-        table_name = url.path[1:]
-
-        if table_name in tables.keys():
-            database = tables[table_name]
-        else:
-            self.send_response(404)
-            return
-
         # here, so as not to override __init__
         # pylint: disable=W0201
         self.queries = {}
         if url.query:
             self.queries = parse_qs(url.query)
 
-        self.send_headers()
-
-        # here, so as not to override __init__
         # pylint: disable=W0201
-        self.deltas = { \
-            'minutes_ago':  minutes_ago, \
-            'hours_ago':    hours_ago, \
-            'days_ago':     days_ago, \
-            'weeks_ago':    weeks_ago, \
-            'months_ago':   months_ago, \
-            'years_ago':    years_ago \
-        }
+        self.deltas = deltas
 
-        if table_name == 'connections' and 'geoip' in self.queries:
-            self.geoip()
+        # pylint: disable=W0201
+        self.session = Session()
+        # sessions on partitions, by path
+        # pylint: disable=W0201
+        self.opened = {}
+        try:
+            self.answer(url)
+        finally:
+            self.session.close()
+            for session in self.opened.values():
+                session.close()
+
+    def answer(self, url):
+        if url.path.startswith('/stats/'):
+            self.stats(url.path[len('/stats/'):])
             return
 
-        query = select([database])
-
-        for delta in self.deltas:
-            if delta in self.queries:
-                diff = int(self.queries[delta][0])
-                query = session.query(database).join(Connections) \
-                    .filter(Connections.created_at > self.deltas[delta](diff))
-                break
+        tables = Base.metadata.tables
+        table_name = url.path[1:]
 
-        results = session.execute(query)
+        if table_name in tables.keys():
+            database = tables[table_name]
+        else:
+            self.not_found()
+            return
 
-        if 'handd' in self.queries:
-            self.header_and_data(database, results)
+        if table_name == 'connections' and 'geoip' in self.queries:
+            try:
+                window = self.window()
+                size = cell_size(self.queries)
+            except ValueError as error:
+                self.send_error(400, str(error))
+                return
+
+            def geoip():
+                if size:
+                    self.geoip_binned(window, size)
+                else:
+                    self.geoip(window)
+
+            self.respond(('connections',), lambda: ([], geoip))
             return
 
-        dump = json.dumps([dict(r) for r in results], default=alchemyencoder)
+        try:
+            query, limit = table_query(database, self.queries, self.deltas)
+        except ValueError as error:
+            self.send_error(400, str(error))
+            return
 
-        # JSONP
-        if 'callback' in self.queries:
-            self.wfile.write(self.queries['callback'][0].encode() + b'(')
-            self.wfile.write(dump[1:-1].encode())
-            self.wfile.write(b')')
+        def prepare():
+            # ids go up from partition to partition, so their rows one
+            # after the other are in id order
+            results = itertools.chain.from_iterable(rows(session.execute( \
+                query.execution_options(stream_results=True))) \
+                for session in self.databases(self.window(), \
+                    integer(self.queries, 'after_id'), \
+                    single(self.queries, 'order') == 'desc'))
+            headers = []
+            if limit is not None:
+                # a page is small, so it's read before the headers go out
+                results = list(itertools.islice(results, limit + 1))
+                if len(results) > limit:
+                    results = results[:limit]
+                    after_id = results[-1]['id']
+                    headers = [('Link', '<%s>; rel="next"' % \
+                        next_link(url.path, self.queries, after_id)), \
+                        ('X-Next-After-Id', str(after_id))]
+            return headers, lambda: self.write_results(query, results)
+
+        names = [table_name]
+        if self.window():
+            names.append('connections')
+        if table_name in interned:
+            names.append('dictionary')
+        self.respond(names, prepare)
+
+    def write_results(self, query, results):
+        if 'handd' in self.queries:
+            write_header_and_data(self.out, query.columns, results)
+        elif 'callback' in self.queries:
+            # JSONP
+            write_jsonp(self.out, self.queries['callback'][0], results, \
+                alchemyencoder)
         else:
-            self.wfile.write(dump.encode())
+            write_json(self.out, results, alchemyencoder)
 
-try:
-    server = HTTPServer(('', jsonserverport), JSONHandler)
-    server.serve_forever()
+if "__main__" == __name__:
+    try:
+        server = ThreadingHTTPServer(('', jsonserverport), JSONHandler)
+        server.serve_forever()
 
-except KeyboardInterrupt:
-    print('Shutting down the web server')
-    server.socket.close()
+    except KeyboardInterrupt:
+        print('Shutting down the web server')
+        server.socket.close()
@@ -0,0 +1,92 @@
+import json
+import math
+import threading
+import time
+
+import numpy
+
+# Groups the geoip map's points into grid cells, so a map of years of
+# connections is a few thousand weighted points instead of one per address.
+#
+#   bin=N    cells N degrees on a side
+#   zoom=N   cells sized for a web map at zoom level N, eight to a tile
+
+max_zoom = 20
+
+def cell_size(queries):
+    ''' Degrees on a side of a cell, or None when no binning was asked for;
+    raises ValueError for nonsense. '''
+    try:
+        if 'bin' in queries:
+            size = float(queries['bin'][0])
+        elif 'zoom' in queries:
+            zoom = int(queries['zoom'][0])
+            if not 0 <= zoom <= max_zoom:
+                raise ValueError
+            size = 45 / 2 ** zoom
+        else:
+            return None
+    except ValueError:
+        raise ValueError('bin must be degrees, zoom 0 to %d' % max_zoom)
+
+    if not 0 < size <= 180:
+        raise ValueError('bin must be more than 0 and at most 180 degrees')
+    return size
+
+def bin_points(longitudes, latitudes, weights, size):
+    ''' Arrays of the centres of the occupied cells and their total weights. '''
+    longitudes = numpy.asarray(longitudes, dtype=float)
+    latitudes = numpy.asarray(latitudes, dtype=float)
+    weights = numpy.asarray(weights, dtype=float)
+
+    columns = math.ceil(360 / size)
+    rows = math.ceil(180 / size)
+    x = numpy.floor((longitudes + 180) / size).astype(numpy.int64)
+    y = numpy.floor((latitudes + 90) / size).astype(numpy.int64)
+    cells = numpy.clip(y, 0, rows - 1) * columns + \
+        numpy.clip(x, 0, columns - 1)
+
+    occupied, inverse = numpy.unique(cells, return_inverse=True)
+    totals = numpy.bincount(inverse, weights=weights, \
+        minlength=len(occupied))
+
+    centre_x = numpy.minimum((occupied % columns + 0.5) * size - 180, 180)
+    centre_y = numpy.minimum((occupied // columns + 0.5) * size - 90, 90)
+    return centre_x, centre_y, totals
+
+def feature_collection(longitudes, latitudes, counts):
+    # https://tools.ietf.org/html/rfc7946#section-3.3
+    features = [{'type': 'Feature', \
+        'geometry': {'type': 'Point', 'coordinates': [x, y]}, \
+        'properties': {'count': int(count)}} \
+        for x, y, count in zip(longitudes.round(6).tolist(), \
+            latitudes.round(6).tolist(), counts.tolist())]
+    return json.dumps({'type': 'FeatureCollection', 'features': features}) \
+        .encode()
+
+class BinCache():
+    ''' Encoded results by (time window, cell size), each kept for ttl
+    seconds. '''
+    def __init__(self, ttl=60, entries=64, clock=time.monotonic):
+        self.ttl = ttl
+        self.entries = entries
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.cache = {}
+
+    def get(self, key):
+        with self.lock:
+            found = self.cache.get(key)
+            if not found:
+                return None
+            if self.clock() - found[0] > self.ttl:
+                del self.cache[key]
+                return None
+            return found[1]
+
+    def put(self, key, value):
+        with self.lock:
+            if key not in self.cache and len(self.cache) >= self.entries:
+                # the one computed longest ago
+                del self.cache[min(self.cache, key=lambda k: self.cache[k][0])]
+            self.cache[key] = (self.clock(), value)
@@ -0,0 +1,45 @@
+import collections
+import threading
+
+# Whole responses, by path and query, with the ETag they were made for. The
+# handler works out the ETag from the tables a response reads, so an entry
+# is only used while nothing it depends on has changed.
+
+class ResponseCache():
+    def __init__(self, entries=256, max_bytes=64 * 1024 * 1024):
+        self.entries = entries
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.cache = collections.OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, etag):
+        ''' The (headers, body) stored for key, if it was made for etag. '''
+        with self.lock:
+            found = self.cache.get(key)
+            if not found or found[0] != etag:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.cache.move_to_end(key)
+            return found[1], found[2]
+
+    def put(self, key, etag, headers, body):
+        with self.lock:
+            if key in self.cache:
+                self.bytes -= len(self.cache.pop(key)[2])
+            if len(body) > self.max_bytes:
+                return
+            self.cache[key] = (etag, list(headers), body)
+            self.bytes += len(body)
+            while len(self.cache) > self.entries or \
+                self.bytes > self.max_bytes:
+                _, (_, _, oldest) = self.cache.popitem(last=False)
+                self.bytes -= len(oldest)
+
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.cache), 'bytes': self.bytes, \
+                'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,125 @@
+from urllib.parse import urlencode
+
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql import select
+from sqlalchemy.sql.functions import FunctionElement
+
+from hpotter.dictionary import source
+from hpotter.rollups import bucket
+from hpotter.tables import Connections
+
+# Turning a table request's query parameters into a select:
+#
+#   fields=a,b      only these columns
+#   order=asc|desc  by id
+#   after_id=N      keyset cursor: rows after id N in that order
+#   limit=N         at most N rows, with a link to the next page
+#   *_ago=N         only rows from connections made in the window
+#
+# The rollups have no id, so they can't be paged or ordered; their windows
+# are to the hour, as for /stats.
+
+max_limit = 10000
+
+def single(queries, name, default=None):
+    return queries[name][0] if name in queries else default
+
+def integer(queries, name, default=None):
+    value = single(queries, name)
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError('%s must be an integer' % name)
+
+class unlikely(FunctionElement):
+    ''' A condition few rows meet, hinted as such where it can be. '''
+    name = 'unlikely'
+
+@compiles(unlikely)
+def compile_unlikely(element, compiler, **kw):
+    return '(%s)' % compiler.process(element.clauses, **kw)
+
+@compiles(unlikely, 'sqlite')
+def compile_unlikely_sqlite(element, compiler, **kw):
+    # SQLite can't tell a recent window is a small part of the table, and
+    # without the hint walks a whole sourceIP or destPort index for a
+    # distinct or group by instead of searching on created_at
+    return 'likelihood(%s, 0.05)' % compiler.process(element.clauses, **kw)
+
+def since(when):
+    ''' Connections made after when. '''
+    return unlikely(Connections.__table__.c.created_at > when)
+
+def table_query(database, queries, deltas):
+    ''' Return the select and the limit (or None) for database; raises
+    ValueError for parameters that make no sense. '''
+    # interned values come back where they were, so the JSON looks the same
+    available, selectable = source(database)
+    columns = list(available.values())
+    limit = integer(queries, 'limit')
+    after_id = integer(queries, 'after_id')
+    order = single(queries, 'order', 'asc')
+
+    keyed = 'id' in database.c
+    if not keyed and ('limit' in queries or 'after_id' in queries or \
+        'order' in queries):
+        raise ValueError('%s has no id to page or order by' % database.name)
+
+    if 'fields' in queries:
+        names = [name for value in queries['fields'] \
+            for name in value.split(',') if name]
+        unknown = [name for name in names if name not in available]
+        if unknown:
+            raise ValueError('no such field: ' + ', '.join(unknown))
+        # the cursor needs the id of the last row
+        if keyed and limit is not None and 'id' not in names:
+            names.insert(0, 'id')
+        columns = [available[name] for name in names]
+
+    if order not in ('asc', 'desc'):
+        raise ValueError('order must be asc or desc')
+    if limit is not None and not 0 < limit <= max_limit:
+        raise ValueError('limit must be between 1 and %d' % max_limit)
+
+    connections = Connections.__table__
+    query = select(columns).select_from(selectable)
+    for delta in deltas:
+        if delta in queries:
+            when = deltas[delta](integer(queries, delta))
+            if 'bucket' in database.c:
+                query = query.where(database.c.bucket >= bucket(when))
+            elif database is connections or 'connections_id' in database.c:
+                if database is not connections:
+                    selectable = selectable.join(connections, \
+                        database.c.connections_id == connections.c.id)
+                query = select(columns).select_from(selectable) \
+                    .where(since(when))
+            else:
+                raise ValueError('%s has no time to window by' % \
+                    database.name)
+            break
+
+    if not keyed:
+        return query, limit
+
+    id_column = database.c.id
+    if after_id is not None:
+        query = query.where(id_column > after_id if order == 'asc' \
+            else id_column < after_id)
+
+    if 'order' in queries or limit is not None or after_id is not None:
+        query = query.order_by(id_column.asc() if order == 'asc' \
+            else id_column.desc())
+
+    if limit is not None:
+        # one more, to know if there's a next page
+        query = query.limit(limit + 1)
+
+    return query, limit
+
+def next_link(path, queries, after_id):
+    queries = dict(queries)
+    queries['after_id'] = [str(after_id)]
+    return path + '?' + urlencode(queries, doseq=True)
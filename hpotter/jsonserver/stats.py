@@ -0,0 +1,79 @@
+import collections
+
+from sqlalchemy import func, desc
+from sqlalchemy.sql import select
+
+from hpotter.rollups import bucket
+from hpotter.tables import PortCounts, CredentialCounts
+from hpotter.jsonserver.query import single, integer, max_limit
+
+# /stats/<name> reads the hourly rollups instead of the raw tables:
+#
+#   /stats/ports          connections by destPort and proto
+#   /stats/credentials    logins by username and password
+#   /stats/usernames      logins by username
+#   /stats/passwords      logins by password
+#
+# biggest count first, or by=hour for a count per hour. *_ago windows work
+# as they do for tables, to the hour; limit caps the rows.
+
+groupings = {
+    'ports': (PortCounts, ('destPort', 'proto')),
+    'credentials': (CredentialCounts, ('username', 'password')),
+    'usernames': (CredentialCounts, ('username',)),
+    'passwords': (CredentialCounts, ('password',)),
+}
+
+def stats_query(name, queries, deltas):
+    ''' The select for /stats/name; raises KeyError for no such name and
+    ValueError for parameters that make no sense. '''
+    table, keys = groupings[name]
+    table = table.__table__
+    columns = [table.c[key] for key in keys]
+
+    by = single(queries, 'by')
+    if by not in (None, 'hour'):
+        raise ValueError('by must be hour')
+    if by:
+        columns.insert(0, table.c.bucket)
+
+    query = select(columns + [func.sum(table.c.count).label('count')]) \
+        .group_by(*columns)
+    for delta in deltas:
+        if delta in queries:
+            query = query.where(table.c.bucket >= \
+                bucket(deltas[delta](integer(queries, delta))))
+            break
+
+    if by:
+        query = query.order_by(table.c.bucket, desc('count'))
+    else:
+        query = query.order_by(desc('count'))
+
+    limit = integer(queries, 'limit')
+    if limit is not None:
+        if not 0 < limit <= max_limit:
+            raise ValueError('limit must be between 1 and %d' % max_limit)
+        query = query.limit(limit)
+    return query
+
+def merge(results, queries):
+    ''' The rows of a stats_query run without its limit on each partition,
+    added up, ordered and limited as the query would have been. '''
+    counts = collections.OrderedDict()
+    keys = None
+    for result in results:
+        keys = keys or [key for key in result.keys() if key != 'count']
+        for row in result:
+            values = tuple(row[key] for key in keys)
+            counts[values] = counts.get(values, 0) + row['count']
+
+    if single(queries, 'by'):
+        ordered = sorted(counts.items(), key=lambda item: \
+            (item[0][0], -item[1]))
+    else:
+        ordered = sorted(counts.items(), key=lambda item: -item[1])
+
+    limit = integer(queries, 'limit')
+    return [collections.OrderedDict(list(zip(keys, values)) + \
+        [('count', count)]) for values, count in ordered[:limit]]
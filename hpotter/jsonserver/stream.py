@@ -0,0 +1,85 @@
+import json
+
+# Writing query results out as they're read, rather than building the whole
+# response first, so memory stays flat however big the table is.
+
+class ChunkedWriter():
+    ''' Collects writes and sends them on as HTTP/1.1 chunks of about size
+    bytes; close() sends the last, empty, chunk. '''
+    def __init__(self, wfile, size=64 * 1024):
+        self.wfile = wfile
+        self.size = size
+        self.buffer = bytearray()
+
+    def write(self, data):
+        self.buffer += data
+        if len(self.buffer) >= self.size:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.wfile.write(b'%x\r\n' % len(self.buffer))
+            self.wfile.write(self.buffer)
+            self.wfile.write(b'\r\n')
+            self.buffer.clear()
+
+    def close(self):
+        self.flush()
+        self.wfile.write(b'0\r\n\r\n')
+
+class CachingWriter(ChunkedWriter):
+    ''' A ChunkedWriter that keeps a copy of what it sends, in copy, until
+    that gets bigger than limit; then copy is None. '''
+    def __init__(self, wfile, limit, size=64 * 1024):
+        super().__init__(wfile, size)
+        self.limit = limit
+        self.copy = bytearray()
+
+    def write(self, data):
+        if self.copy is not None:
+            if len(self.copy) + len(data) > self.limit:
+                self.copy = None
+            else:
+                self.copy += data
+        super().write(data)
+
+def rows(result, size=1000):
+    ''' Every row of result, fetched size at a time. '''
+    while True:
+        batch = result.fetchmany(size)
+        if not batch:
+            return
+        yield from batch
+
+def write_rows(out, results, encoder):
+    ''' The rows as JSON objects separated by commas, no brackets. '''
+    separator = b''
+    for row in results:
+        out.write(separator)
+        out.write(json.dumps(dict(row), default=encoder).encode())
+        separator = b', '
+
+def write_json(out, results, encoder):
+    out.write(b'[')
+    write_rows(out, results, encoder)
+    out.write(b']')
+
+def write_jsonp(out, callback, results, encoder):
+    out.write(callback.encode() + b'(')
+    write_rows(out, results, encoder)
+    out.write(b')')
+
+# this is for https://datatables.net/ and
+# https://github.com/daleroy1/freeboard-table
+def write_header_and_data(out, columns, results):
+    out.write(b'{"header":[')
+    for column in columns:
+        out.write(b'"' + column.name.encode() + b'", ')
+    out.write(b'], "data": [')
+    for row in results:
+        out.write(b'{')
+        for column in columns:
+            out.write(b'"' + column.name.encode() + b'" : "' + \
+                str(row[column.name]).encode() + b'", ')
+        out.write(b'} ,')
+    out.write(b']}')
@@ -0,0 +1,130 @@
+import importlib
+import threading
+import time
+
+import hpotter.plugins
+from hpotter.env import logger, plugins_enabled, plugin_start_timeout
+from hpotter.metrics import gauge
+from hpotter.processes import forked_plugins, start_workers, stop_workers
+
+# Starts the plugins in [plugins] enabled, each in a thread of its own so
+# the ones that boot a container don't wait on each other, and stops them
+# the same way. How long each took is logged and kept for the metrics.
+
+class Plugin():
+    def __init__(self, name, package='hpotter.plugins'):
+        self.name = name
+        self.package = package
+        self.module = None
+        self.state = 'stopped'
+        self.start_seconds = None
+        self.stop_seconds = None
+
+    def start(self):
+        self.state = 'starting'
+        began = time.perf_counter()
+        try:
+            # only what's enabled is imported
+            self.module = importlib.import_module(self.package + '.' + \
+                self.name)
+            self.module.start_server()
+            self.state = 'running'
+        except Exception as exc:
+            logger.info('Could not start %s: %s', self.name, exc)
+            self.state = 'failed'
+        self.start_seconds = time.perf_counter() - began
+        if self.state == 'running':
+            logger.info('Started %s in %.2fs', self.name, self.start_seconds)
+
+    def stop(self):
+        if self.state != 'running':
+            return
+        self.state = 'stopping'
+        began = time.perf_counter()
+        try:
+            self.module.stop_server()
+        except Exception as exc:
+            logger.info('Could not stop %s: %s', self.name, exc)
+        self.state = 'stopped'
+        self.stop_seconds = time.perf_counter() - began
+        logger.info('Stopped %s in %.2fs', self.name, self.stop_seconds)
+
+def in_parallel(name, functions, timeout, daemon=False):
+    ''' Run each function in a thread and wait, at most timeout seconds for
+    them all; returns how many are still running. '''
+    # threads take after the thread that starts them, so the plugins'
+    # servers would be daemons too, and not keep the process up
+    threads = [threading.Thread(target=function, daemon=daemon, \
+        name='%s-%d' % (name, number)) \
+        for number, function in enumerate(functions)]
+    for thread in threads:
+        thread.start()
+    deadline = time.monotonic() + timeout
+    for thread in threads:
+        thread.join(max(0, deadline - time.monotonic()))
+    return sum(thread.is_alive() for thread in threads)
+
+class PluginManager():
+    def __init__(self, names, package='hpotter.plugins', \
+        timeout=plugin_start_timeout):
+        self.timeout = timeout
+        known = hpotter.plugins.__all__ if package == 'hpotter.plugins' \
+            else names
+        for name in names:
+            if name not in known:
+                logger.info('No plugin called %s', name)
+        self.forked = forked_plugins([name for name in names \
+            if name in known])
+        self.plugins = [Plugin(name, package) for name in names \
+            if name in known and name not in self.forked]
+
+    def start(self):
+        began = time.perf_counter()
+        # the workers come up in their own time, alongside the rest
+        start_workers(self.forked)
+        waiting = in_parallel('Start', \
+            [plugin.start for plugin in self.plugins], self.timeout)
+        if waiting:
+            logger.info('Still starting after %ds: %s', self.timeout, \
+                ', '.join(plugin.name for plugin in self.plugins \
+                    if plugin.state == 'starting'))
+        running = sum(plugin.state == 'running' for plugin in self.plugins)
+        logger.info('Started %d of %d plugins in %.2fs', \
+            running + len(self.forked), len(self.plugins) + len(self.forked), \
+            time.perf_counter() - began)
+
+    def stop(self):
+        began = time.perf_counter()
+        in_parallel('Stop', [plugin.stop for plugin in self.plugins] + \
+            [stop_workers], self.timeout, daemon=True)
+        logger.info('Stopped plugins in %.2fs', time.perf_counter() - began)
+
+manager = None
+
+def plugin_seconds(kind):
+    found = {}
+    for plugin in manager.plugins if manager else []:
+        seconds = getattr(plugin, kind + '_seconds')
+        if seconds is not None:
+            found[(plugin.name,)] = seconds
+    return found
+
+gauge('hpotter_plugin_start_seconds', 'How long each plugin took to start', \
+    ('plugin',), lambda: plugin_seconds('start'))
+gauge('hpotter_plugin_stop_seconds', 'How long each plugin took to stop', \
+    ('plugin',), lambda: plugin_seconds('stop'))
+gauge('hpotter_plugin_running', 'Whether each plugin is running', \
+    ('plugin',), lambda: {(plugin.name,): int(plugin.state == 'running') \
+        for plugin in (manager.plugins if manager else [])})
+
+def start_plugins(names=None):
+    global manager
+    manager = PluginManager(plugins_enabled if names is None else names)
+    manager.start()
+
+def stop_plugins():
+    global manager
+    if not manager:
+        return
+    manager.stop()
+    manager = None
@@ -0,0 +1,284 @@
+import bisect
+import collections
+import threading
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from hpotter.env import logger, metrics_address, metrics_port
+
+# Counters, gauges and histograms the plugins, the shell and the writer
+# update as they go, served in Prometheus' text format on a local port:
+#
+#   curl localhost:9180/metrics
+#
+# Every thread updates cells of its own, so an update is a thread local
+# lookup and an add, with no lock for a flood of connections to queue up
+# on. A scrape adds the cells up. The cells of threads that have finished
+# are folded in, so they don't pile up, at a scrape or once there are twice
+# as many as last time, whichever comes first.
+
+class Cells():
+    def __init__(self, size):
+        self.size = size
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.cells = []                 # (thread, cell)
+        self.retired = [0] * size
+        self.fold_at = 16
+
+    def cell(self):
+        try:
+            return self.local.cell
+        except AttributeError:
+            cell = self.local.cell = [0] * self.size
+            with self.lock:
+                self.cells.append((threading.current_thread(), cell))
+                # with nobody scraping, a thread per connection would
+                # otherwise leave a cell each
+                if len(self.cells) >= self.fold_at:
+                    self.fold()
+                    self.fold_at = max(16, 2 * len(self.cells))
+            return cell
+
+    def fold(self):
+        ''' Fold in finished threads' cells; the caller holds the lock. '''
+        live = []
+        for thread, cell in self.cells:
+            if thread.is_alive():
+                live.append((thread, cell))
+            else:
+                # it can't write any more, so it's safe to fold in
+                self.retired = [a + b for a, b in zip(self.retired, cell)]
+        self.cells = live
+
+    def totals(self):
+        with self.lock:
+            self.fold()
+            live = list(self.cells)
+            totals = list(self.retired)
+        for _, cell in live:
+            totals = [a + b for a, b in zip(totals, cell)]
+        return totals
+
+class Value():
+    def __init__(self):
+        self.cells = Cells(1)
+
+    def inc(self, amount=1):
+        self.cells.cell()[0] += amount
+
+    def dec(self, amount=1):
+        self.cells.cell()[0] -= amount
+
+    def get(self):
+        return self.cells.totals()[0]
+
+class Distribution():
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # a count per bucket, one for above them all, and the sum
+        self.cells = Cells(len(buckets) + 2)
+
+    def observe(self, value):
+        cell = self.cells.cell()
+        cell[bisect.bisect_left(self.buckets, value)] += 1
+        cell[-1] += value
+
+    def get(self):
+        totals = self.cells.totals()
+        return totals[:-1], totals[-1]
+
+class Metric():
+    kind = None
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(labels)
+        self.lock = threading.Lock()
+        self.children = {}
+
+    def child(self):
+        return Value()
+
+    def labels(self, *values):
+        ''' The metric for these label values, made the first time. '''
+        found = self.children.get(values)
+        if found is None:
+            if len(values) != len(self.label_names):
+                raise ValueError('%s takes labels %s' % \
+                    (self.name, ', '.join(self.label_names)))
+            with self.lock:
+                found = self.children.setdefault(values, self.child())
+        return found
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def dec(self, amount=1):
+        self.labels().dec(amount)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def samples(self):
+        ''' (suffix, labels, value) for everything there is to report. '''
+        for values, child in sorted(self.children.items()):
+            yield '', dict(zip(self.label_names, values)), child.get()
+
+class Counter(Metric):
+    kind = 'counter'
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def __init__(self, name, description, labels=(), function=None):
+        super().__init__(name, description, labels)
+        # called at each scrape, for a value that's kept somewhere else;
+        # with labels it returns {label values: value}
+        self.function = function
+
+    def samples(self):
+        if not self.function:
+            yield from super().samples()
+            return
+
+        found = self.function()
+        if not isinstance(found, dict):
+            found = {(): found}
+        for values, value in sorted(found.items()):
+            yield '', dict(zip(self.label_names, values)), value
+
+# in seconds, from a cache hit to a docker exec that hangs
+default_buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, \
+    0.25, 0.5, 1, 2.5, 5, 10)
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, description, labels=(), buckets=default_buckets):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def child(self):
+        return Distribution(self.buckets)
+
+    def samples(self):
+        for values, child in sorted(self.children.items()):
+            labels = dict(zip(self.label_names, values))
+            counts, total = child.get()
+            running = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                running += count
+                yield '_bucket', dict(labels, le=str(bound)), running
+            yield '_sum', labels, total
+            yield '_count', labels, running
+
+def escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n') \
+        .replace('"', r'\"')
+
+class Registry():
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = collections.OrderedDict()
+
+    def register(self, metric):
+        # report a plain metric from the start, zero or not
+        if not metric.label_names and not getattr(metric, 'function', None):
+            metric.labels()
+        with self.lock:
+            # modules can be imported more than once, by tests
+            return self.metrics.setdefault(metric.name, metric)
+
+    def expose(self):
+        lines = []
+        with self.lock:
+            metrics = list(self.metrics.values())
+        for metric in metrics:
+            try:
+                samples = list(metric.samples())
+            except Exception as exc:
+                logger.debug('Metric %s failed: %s', metric.name, exc)
+                continue
+            lines.append('# HELP %s %s' % (metric.name, metric.description))
+            lines.append('# TYPE %s %s' % (metric.name, metric.kind))
+            for suffix, labels, value in samples:
+                text = ','.join('%s="%s"' % (name, escape(label)) \
+                    for name, label in labels.items())
+                lines.append('%s%s%s %s' % (metric.name, suffix, \
+                    '{' + text + '}' if text else '', repr(float(value)) \
+                    if isinstance(value, float) else value))
+        return '\n'.join(lines) + '\n'
+
+registry = Registry()
+
+def counter(name, description, labels=()):
+    return registry.register(Counter(name, description, labels))
+
+def gauge(name, description, labels=(), function=None):
+    return registry.register(Gauge(name, description, labels, function))
+
+def histogram(name, description, labels=(), buckets=default_buckets):
+    return registry.register(Histogram(name, description, labels, buckets))
+
+# what the plugins share
+
+accepted = counter('hpotter_connections_accepted_total', \
+    'Connections accepted', ('plugin',))
+active = gauge('hpotter_sessions_active', \
+    'Connections being handled now', ('plugin',))
+proxied = counter('hpotter_proxied_bytes_total', \
+    'Bytes passed through to a container, in from the client or out to it', \
+    ('plugin', 'direction'))
+
+def thread_kinds():
+    # names go Thread-12 (process_request_thread), SshWorker-3, DBWriter
+    kinds = collections.Counter()
+    for thread in threading.enumerate():
+        kinds[(thread.name.split(' ')[0].rstrip('0123456789').rstrip('-'),)] \
+            += 1
+    return dict(kinds)
+
+gauge('hpotter_threads', 'Running threads, by name', ('kind',), thread_kinds)
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = registry.expose().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # a scrape every few seconds isn't worth a line each
+        pass
+
+metrics_server = None
+metrics_lock = threading.Lock()
+
+def start_metrics(address=None):
+    global metrics_server
+    with metrics_lock:
+        if metrics_server:
+            return metrics_server
+        address = address or (metrics_address, metrics_port)
+        logger.info('Serving metrics on %s:%d', *address)
+        metrics_server = ThreadingHTTPServer(address, MetricsHandler)
+        metrics_server.daemon_threads = True
+        threading.Thread(target=metrics_server.serve_forever, \
+            name='Metrics', daemon=True).start()
+        return metrics_server
+
+def stop_metrics():
+    global metrics_server
+    with metrics_lock:
+        if not metrics_server:
+            return
+        metrics_server.shutdown()
+        metrics_server.server_close()
+        metrics_server = None
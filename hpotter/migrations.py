@@ -0,0 +1,104 @@
+import logging
+
+from sqlalchemy import inspect
+
+# hpotter.env imports this, so no logger from there
+logger = logging.getLogger('hpotter')
+
+# Brings an existing database up to date with hpotter.tables. create_all
+# makes missing tables but never changes ones that are already there, so
+# every change to a shipped table needs a step here. Steps run in order and
+# the last one done is kept in schema_version. Each step checks before it
+# changes anything, so running one twice (two processes starting at once)
+# does no harm.
+
+steps = []
+
+def step(function):
+    steps.append(function)
+    return function
+
+def add_column(connection, table, name, kind):
+    names = [column['name'] for column in \
+        inspect(connection).get_columns(table)]
+    if name not in names:
+        logger.info('Adding %s.%s', table, name)
+        connection.execute('ALTER TABLE %s ADD COLUMN %s %s' % \
+            (table, name, kind))
+
+def add_index(connection, table, *columns):
+    connection.execute('CREATE INDEX IF NOT EXISTS ix_%s_%s ON %s (%s)' % \
+        (table, '_'.join(columns), table, ', '.join(columns)))
+
+@step
+def payloads(connection):
+    for table in ('httpcommands', 'sql'):
+        add_column(connection, table, 'payload', 'BLOB')
+
+@step
+def geoip(connection):
+    add_column(connection, 'connections', 'country', 'VARCHAR')
+    add_column(connection, 'connections', 'latitude', 'FLOAT')
+    add_column(connection, 'connections', 'longitude', 'FLOAT')
+
+@step
+def indexes(connection):
+    # what the jsonserver filters, joins and groups on
+    for column in ('created_at', 'sourceIP', 'destPort'):
+        add_index(connection, 'connections', column)
+    for table in ('shellcommands', 'credentials', 'httpcommands', 'sql'):
+        add_index(connection, table, 'connections_id')
+    connection.execute('ANALYZE')
+
+@step
+def rollups(connection):
+    # count what's already there; create_all has made the tables
+    hour = "strftime('%Y-%m-%d %H:00:00.000000', connections.created_at)"
+    if not connection.execute('SELECT 1 FROM portcounts LIMIT 1').scalar():
+        connection.execute('INSERT INTO portcounts ' \
+            '(bucket, "destPort", proto, count) ' \
+            'SELECT ' + hour + ', coalesce("destPort", 0), ' \
+            'coalesce(proto, 0), count(*) ' \
+            'FROM connections WHERE created_at IS NOT NULL GROUP BY 1, 2, 3')
+    if not connection.execute('SELECT 1 FROM credentialcounts LIMIT 1') \
+        .scalar():
+        connection.execute('INSERT INTO credentialcounts ' \
+            '(bucket, username, password, count) ' \
+            'SELECT ' + hour + ', coalesce(username, \'\'), ' \
+            'coalesce(password, \'\'), count(*) FROM credentials ' \
+            'JOIN connections ON connections.id = connections_id ' \
+            'WHERE created_at IS NOT NULL GROUP BY 1, 2, 3')
+
+@step
+def dictionary(connection):
+    # rows already stored keep their values where they are
+    add_column(connection, 'shellcommands', 'command_id', 'INTEGER')
+    add_column(connection, 'credentials', 'username_id', 'INTEGER')
+    add_column(connection, 'credentials', 'password_id', 'INTEGER')
+    for table in ('httpcommands', 'sql'):
+        add_column(connection, table, 'request_id', 'INTEGER')
+        add_column(connection, table, 'payload_id', 'INTEGER')
+
+@step
+def locations(connection):
+    # the map reads only located rows, and their distinct places
+    add_index(connection, 'connections', 'latitude', 'longitude')
+    connection.execute('ANALYZE')
+
+def version(connection):
+    connection.execute('CREATE TABLE IF NOT EXISTS schema_version ' \
+        '(id INTEGER PRIMARY KEY, version INTEGER NOT NULL)')
+    found = connection.execute('SELECT version FROM schema_version ' \
+        'WHERE id = 1').scalar()
+    return found or 0
+
+def migrate(engine):
+    with engine.begin() as connection:
+        done = version(connection)
+
+    for number, function in enumerate(steps[done:], done + 1):
+        logger.info('Schema migration %d: %s', number, function.__name__)
+        with engine.begin() as connection:
+            function(connection)
+            connection.execute('INSERT OR REPLACE INTO schema_version ' \
+                '(id, version) VALUES (1, ?)', number)
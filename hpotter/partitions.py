@@ -0,0 +1,341 @@
+import collections
+import datetime
+import gzip
+import logging
+import os
+import re
+import shutil
+import threading
+
+from sqlalchemy import select, func
+from sqlalchemy.orm import sessionmaker
+
+from hpotter.tables import Base, Connections, Dictionary, PortCounts, \
+    CredentialCounts
+from hpotter.rollups import add
+from hpotter.storage import create_storage_engine
+from hpotter.migrations import migrate
+
+# env imports this, so no logger from there
+logger = logging.getLogger('hpotter')
+
+# Rows go into a SQLite file per day or per week, named for the UTC day it
+# starts on, so inserts and recent windows only ever touch a small file
+# however long the sensor has been up. A connection's rows all go in the
+# partition it was made in.
+#
+# Ids run on from partition to partition: each one starts at its day
+# number times id_span, above anything in the old single database, so
+# ordering and paging by id work across all of them.
+#
+# Old partitions are gzipped into the archive directory after archive_after
+# days and deleted after drop_after days. The database in [database] url is
+# still read, as the partition before the first. Connections are never
+# written to it, but a partition's rollups and dictionary are added to its
+# before the partition is archived or dropped, so /stats and /dictionary
+# go back further than the partitions do.
+
+id_span = 2 ** 32
+
+name_pattern = re.compile(r'^hpotter-(\d{4}-\d{2}-\d{2})\.db$')
+
+epoch = datetime.date(1970, 1, 1)
+
+def start_of(when, period):
+    day = when.date() if isinstance(when, datetime.datetime) else when
+    if period == 'week':
+        day -= datetime.timedelta(days=day.weekday())
+    return day
+
+def base_of(start):
+    return (start - epoch).days * id_span
+
+class Partition():
+    def __init__(self, path, start, end, base, engine=None):
+        self.path = path
+        self.start = start          # None for the old single database
+        self.end = end
+        self.base = base            # ids are above this
+        self.engine = engine
+        self.Session = sessionmaker(bind=engine) if engine else None
+        self.next_ids = {}
+        self.newest = None
+
+    @property
+    def name(self):
+        return os.path.basename(self.path) if self.path else 'legacy'
+
+    def open(self, storage):
+        if not self.engine:
+            self.engine = storage('sqlite:///' + self.path)
+            self.Session = sessionmaker(bind=self.engine)
+
+    def close(self):
+        if self.engine:
+            self.engine.dispose()
+        self.engine = None
+        self.Session = None
+
+    def covers(self, since):
+        ''' Whether it can have connections made after since. '''
+        if since is None:
+            return True
+        if self.start is None:
+            # written before partitioning, so it only needs asking once
+            if self.newest is None:
+                self.newest = self.engine.execute(select( \
+                    [func.max(Connections.__table__.c.created_at)])) \
+                    .scalar() or datetime.datetime.min
+            return self.newest > since
+        return datetime.datetime.combine(self.end, datetime.time()) > since
+
+    def has_ids(self, after_id, descending):
+        ''' Whether it can have ids after after_id, in that order. '''
+        if after_id is None:
+            return True
+        if descending:
+            return self.base + 1 < after_id
+        return self.base + id_span > after_id
+
+    def assign_ids(self, session, rows):
+        ''' Give each new row the next id in this partition. Only the
+        DBWriter inserts, so it can keep count. '''
+        for row in rows:
+            table = getattr(row, '__table__', None)
+            if table is None or 'id' not in table.c or row.id is not None:
+                continue
+            if table.name not in self.next_ids:
+                found = session.execute(select([func.max(table.c.id)])) \
+                    .scalar()
+                self.next_ids[table.name] = max(found or 0, self.base) + 1
+            row.id = self.next_ids[table.name]
+            self.next_ids[table.name] += 1
+
+class Partitions():
+    def __init__(self, directory, period='day', legacy=None, \
+        archive_after=0, drop_after=0, open_partitions=32, storage=None):
+        if period not in ('day', 'week'):
+            raise ValueError('partition must be none, day or week')
+        self.directory = directory
+        self.archive = os.path.join(directory, 'archive')
+        self.period = period
+        self.archive_after = archive_after
+        self.drop_after = drop_after
+        self.open_partitions = open_partitions
+        self.storage = storage or create_storage_engine
+        self.legacy = Partition(None, None, None, 0, legacy) if legacy \
+            else None
+
+        self.lock = threading.Lock()
+        self.opened = collections.OrderedDict()    # path -> Partition
+        self.created = set()
+        self.current = None
+        self.retiring = None
+
+    def length(self):
+        return datetime.timedelta(weeks=1) if self.period == 'week' \
+            else datetime.timedelta(days=1)
+
+    def path_for(self, start):
+        return os.path.join(self.directory, \
+            'hpotter-' + start.isoformat() + '.db')
+
+    def starts(self):
+        ''' The start of every partition on disk, oldest first. '''
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        found = [name_pattern.match(name) for name in names]
+        return sorted(datetime.date.fromisoformat(match.group(1)) \
+            for match in found if match)
+
+    def partition(self, start, end, evict=True):
+        ''' The partition starting at start, opened; the caller holds the
+        lock. '''
+        path = self.path_for(start)
+        partition = self.opened.get(path)
+        if partition:
+            partition.end = end
+            self.opened.move_to_end(path)
+            return partition
+
+        partition = Partition(path, start, end, base_of(start))
+        partition.open(self.storage)
+        self.opened[path] = partition
+        if evict:
+            self.evict((path,))
+        return partition
+
+    def evict(self, keep=()):
+        ''' Close the least recently used partitions over open_partitions,
+        other than the paths in keep; the caller holds the lock. '''
+        for path in list(self.opened):
+            if len(self.opened) <= self.open_partitions:
+                return
+            if path not in keep:
+                self.opened.pop(path).close()
+
+    def for_writing(self, when):
+        ''' The partition for rows of a connection made at when, created if
+        it's the first. '''
+        start = start_of(when, self.period)
+        with self.lock:
+            if not os.path.exists(self.path_for(start)):
+                logger.info('Starting partition %s', self.path_for(start))
+                os.makedirs(self.directory, exist_ok=True)
+            partition = self.partition(start, start + self.length())
+            if partition.start not in self.created:
+                Base.metadata.create_all(partition.engine)
+                migrate(partition.engine)
+                self.created.add(partition.start)
+
+            rolled_over = self.current is None or start > self.current
+            if rolled_over:
+                self.current = start
+        if rolled_over:
+            self.start_retiring()
+        return partition
+
+    def covering(self, since=None, after_id=None, descending=False, \
+        rollups=False):
+        ''' The partitions that can have rows from connections made after
+        since, and ids after after_id, in id order. For rollups, the old
+        database is always one, as retired partitions' are kept there. '''
+        found = []
+        if self.legacy and (rollups or self.legacy.covers(since)) and \
+            self.legacy.has_ids(after_id, descending):
+            found.append(self.legacy)
+
+        with self.lock:
+            starts = self.starts()
+            # close what's been archived or dropped
+            gone = set(self.opened) - set(self.path_for(start) \
+                for start in starts)
+            for path in gone:
+                self.opened.pop(path).close()
+
+            for start, end in zip(starts, starts[1:] + [None]):
+                end = end or start + self.length()
+                candidate = Partition(None, start, end, base_of(start))
+                if candidate.covers(since) and \
+                    candidate.has_ids(after_id, descending):
+                    found.append(self.partition(start, end, evict=False))
+            # a request can need more than open_partitions; they're closed
+            # as others are opened after it
+            self.evict(set(partition.path for partition in found))
+
+        if descending:
+            found.reverse()
+        return found
+
+    def start_retiring(self):
+        if not (self.archive_after or self.drop_after):
+            return
+        with self.lock:
+            if self.retiring and self.retiring.is_alive():
+                return
+            self.retiring = threading.Thread(target=self.retire, \
+                name='PartitionRetire', daemon=True)
+            self.retiring.start()
+
+    def retire(self, today=None):
+        ''' Archive and drop the partitions that have aged out. '''
+        today = today or datetime.datetime.utcnow().date()
+        length = self.length()
+
+        starts = self.starts()
+        for start, end in zip(starts, starts[1:] + [None]):
+            end = end or start + length
+            age = (today - end).days
+            if self.drop_after and age >= self.drop_after:
+                self.keep(start)
+                self.remove(start)
+            elif self.archive_after and age >= self.archive_after:
+                self.keep(start)
+                self.compress(start)
+
+        if self.drop_after and os.path.isdir(self.archive):
+            for name in sorted(os.listdir(self.archive)):
+                match = name_pattern.match(name[:-len('.gz')])
+                if not match or not name.endswith('.gz'):
+                    continue
+                start = datetime.date.fromisoformat(match.group(1))
+                if (today - start - length).days >= self.drop_after:
+                    logger.info('Dropping archived partition %s', name)
+                    os.remove(os.path.join(self.archive, name))
+
+    def keep(self, start):
+        ''' Add start's rollups and dictionary to the old database's. '''
+        if not self.legacy:
+            logger.info('No database to keep the rollups of %s in', \
+                self.path_for(start))
+            return
+        source = self.storage('sqlite:///' + self.path_for(start))
+        try:
+            with self.legacy.engine.begin() as target:
+                for table, keys in ( \
+                    (PortCounts, ('bucket', 'destPort', 'proto')), \
+                    (CredentialCounts, ('bucket', 'username', 'password'))):
+                    table = table.__table__
+                    add(target, table, keys, {tuple(row[key] \
+                        for key in keys): row['count'] \
+                        for row in source.execute(select([table]))})
+
+                # by digest, as the ids are the partition's own
+                table = Dictionary.__table__
+                for row in source.execute(select([table])):
+                    result = target.execute(table.update() \
+                        .where(table.c.digest == row['digest']) \
+                        .values(count=table.c.count + row['count'], \
+                            first_seen=func.min(table.c.first_seen, \
+                                row['first_seen']), \
+                            last_seen=func.max(table.c.last_seen, \
+                                row['last_seen'])))
+                    if result.rowcount == 0:
+                        target.execute(table.insert().values( \
+                            digest=row['digest'], value=row['value'], \
+                            count=row['count'], first_seen=row['first_seen'], \
+                            last_seen=row['last_seen']))
+        finally:
+            source.dispose()
+
+    def forget(self, start):
+        ''' Close start's partition and flush its write-ahead log into the
+        file. '''
+        path = self.path_for(start)
+        with self.lock:
+            partition = self.opened.pop(path, None)
+        if not partition:
+            partition = Partition(path, start, None, 0)
+            partition.open(self.storage)
+        try:
+            partition.engine.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        finally:
+            partition.close()
+        return path
+
+    def remove(self, start):
+        path = self.forget(start)
+        logger.info('Dropping partition %s', path)
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+    def compress(self, start):
+        path = self.forget(start)
+        logger.info('Archiving partition %s', path)
+        os.makedirs(self.archive, exist_ok=True)
+        archived = os.path.join(self.archive, os.path.basename(path) + '.gz')
+        with open(path, 'rb') as source, \
+            gzip.open(archived + '.part', 'wb') as target:
+            shutil.copyfileobj(source, target)
+        os.replace(archived + '.part', archived)
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+    def close(self):
+        with self.lock:
+            while self.opened:
+                self.opened.popitem()[1].close()
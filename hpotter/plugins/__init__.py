@@ -1 +1 @@
-__all__ = ['mariadb']
+__all__ = ['http500', 'httpipe', 'mariadb', 'ssh', 'telnet']
@@ -1,8 +1,16 @@
+import datetime
+import errno
+import os
+import selectors
 import socket
 import threading
+import time
 
 from hpotter import tables
-from hpotter.env import logger, Session
+from hpotter.env import logger
+from hpotter.writer import write
+from hpotter.metrics import accepted, active, proxied
+from hpotter.admission import admission, turn_away
 
 # remember to put name in __init__.py
 
@@ -19,74 +27,149 @@ def wrap_socket(function):
         logger.debug(exc)
         raise Exception
 
+def preview(data, length=256):
+    # a short, readable version of a payload; the exact bytes go in payload
+    if length <= 0:
+        return None
+    return bytes(data[:length]).decode('utf-8', 'backslashreplace')
+
+class Capture():
+    ''' What a client sent, kept to at most limit bytes when limit > 0.
+    With a limit the buffer is allocated once and filled in place, either
+    straight from the socket by recv_into or by add. '''
+    def __init__(self, limit=0):
+        self.limit = limit
+        self.used = 0
+        self.buffer = bytearray(limit if limit > 0 else 0)
+        # a view would stop an unlimited buffer from growing
+        self.view = memoryview(self.buffer) if limit > 0 else None
+
+    def remaining(self):
+        return self.limit - self.used if self.limit > 0 else None
+
+    def full(self):
+        return self.limit > 0 and self.used >= self.limit
+
+    def recv_into(self, sock, size):
+        # only for limited captures; returns a view of what was read
+        start = self.used
+        received = sock.recv_into(self.view[start:], \
+            min(size, self.limit - start))
+        self.used += received
+        return self.view[start:self.used]
+
+    def add(self, data):
+        if self.limit > 0:
+            data = memoryview(data)[:self.limit - self.used]
+            self.view[self.used:self.used + len(data)] = data
+        else:
+            self.buffer += data
+        self.used += len(data)
+
+    def getvalue(self):
+        if self.limit > 0:
+            return bytes(self.view[:self.used])
+        return bytes(self.buffer)
+
+    def row(self, table, connection, length=256):
+        payload = self.getvalue()
+        return table(request=preview(payload, length), payload=payload, \
+            connection=connection)
+
 # started from: http://code.activestate.com/recipes/114642/
 
 class OneWayThread(threading.Thread):
-    def __init__(self, source, dest, table=None, limit=0):
+    # characters of the payload to keep as text in the request column
+    preview_length = 256
+
+    def __init__(self, source, dest, table=None, limit=0, name='pipe', \
+        address=None):
         super().__init__()
         self.source = source
         self.dest = dest
         self.limit = limit
         self.table = table
+        self.capture = None
+        # the client's address, released from admission when this finishes
+        self.address = address
+        # the client's side is the one with a table
+        self.proxied = proxied.labels(name, 'in' if table else 'out')
+        self.active = active.labels(name) if table else None
 
         if self.table:
-            self.session = Session()
             self.connection = tables.Connections(
                 sourceIP=self.source.getsockname()[0],
                 sourcePort=self.source.getsockname()[1],
                 destIP=self.dest.getsockname()[0],
                 destPort=self.dest.getsockname()[1],
                 proto=tables.TCP)
-            self.session.add(self.connection)
+            write(self.connection)
 
     def run(self):
+        if self.active:
+            self.active.inc()
+        try:
+            self.pipe()
+        finally:
+            if self.active:
+                self.active.dec()
+            if self.address:
+                admission.release(self.address)
+
+    def pipe(self):
         logger.debug('Starting timer')
         timer = threading.Timer(120, self.shutdown)
         timer.start()
 
-        total = b''
+        self.capture = capture = Capture(self.limit) \
+            if self.table or self.limit > 0 else None
         while 1:
             try:
-                data = wrap_socket(lambda: self.source.recv(4096))
+                if capture and self.limit > 0:
+                    # read straight into the capture, never past the limit
+                    data = wrap_socket(lambda: capture.recv_into(self.source, \
+                        4096))
+                else:
+                    data = wrap_socket(lambda: self.source.recv(4096))
             except Exception:
                 break
 
-            if data == b'' or not data:
+            if not data:
                 break
 
-            if self.table or self.limit > 0:
-                total += data
+            if capture and self.limit <= 0:
+                capture.add(data)
+            self.proxied.inc(len(data))
 
             try:
                 wrap_socket(lambda: self.dest.sendall(data))
             except Exception:
                 break
 
-            if self.limit > 0 and len(total) >= self.limit:
+            if capture and capture.full():
                 break
 
         if self.table:
-            http = self.table(request=str(total), connection=self.connection)
-            self.session.add(http)
-            self.session.commit()
+            write(capture.row(self.table, self.connection, \
+                self.preview_length))
 
         logger.debug('Canceling timer')
         timer.cancel()
         self.shutdown()
 
     def shutdown(self):
-        if self.table:
-            Session.remove()
         self.source.close()
         self.dest.close()
 
 class PipeThread(threading.Thread):
-    def __init__(self, bind_address, connect_address, table, limit):
+    def __init__(self, bind_address, connect_address, table, limit, \
+        name='pipe'):
         super().__init__()
         self.bind_address = bind_address
         self.connect_address = connect_address
         self.table = table
         self.limit = limit
+        self.name = name
         self.shutdown_requested = False
 
     def run(self):
@@ -106,13 +189,22 @@ class PipeThread(threading.Thread):
                     else:
                         continue
 
-                dest = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                # dest.settimeout(30)
-                dest.connect(self.connect_address)
-    
+                accepted.labels(self.name).inc()
+                if not admission.admit(address[0], self.name):
+                    turn_away(source, self.name)
+                    continue
+
+                try:
+                    dest = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                    # dest.settimeout(30)
+                    dest.connect(self.connect_address)
+                except OSError:
+                    admission.release(address[0])
+                    raise
 
-                OneWayThread(source, dest, self.table, self.limit).start()
-                OneWayThread(dest, source).start()
+                OneWayThread(source, dest, self.table, self.limit, \
+                    self.name, address[0]).start()
+                OneWayThread(dest, source, name=self.name).start()
 
             except OSError as exc:
                 source.close()
@@ -121,3 +213,270 @@ class PipeThread(threading.Thread):
 
     def request_shutdown(self):
         self.shutdown_requested = True
+
+# A single selector loop that multiplexes every proxied connection for a
+# plugin, rather than the two OneWayThreads (and their Timers) per accepted
+# connection that PipeThread starts. Same constructor, same request_shutdown.
+
+class Pipe():
+    # stop reading from one side while this much is waiting for the other
+    high_water = 256 * 1024
+
+    def __init__(self, loop, client, address):
+        self.loop = loop
+        self.client = client
+        self.address = address[0]
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.connected = False
+        self.closed = False
+        self.deadline = time.monotonic() + loop.timeout
+        self.registered = {}
+
+        # pending[sock] is what is waiting to be written to sock
+        self.peer = {client: self.server, self.server: client}
+        self.pending = {client: bytearray(), self.server: bytearray()}
+        self.eof = {client: False, self.server: False}
+
+        self.capture = None
+        if loop.table or loop.limit > 0:
+            self.capture = Capture(loop.limit)
+        self.proxied = {client: proxied.labels(loop.name, 'in'), \
+            self.server: proxied.labels(loop.name, 'out')}
+        self.connection = None
+        self.recorded = False
+        if loop.table:
+            # the address it came in on, not the 0.0.0.0 listened on; made
+            # now, but written once the container has answered or not
+            local = client.getsockname()
+            self.connection = tables.Connections(
+                sourceIP=address[0],
+                sourcePort=address[1],
+                destIP=local[0],
+                destPort=local[1],
+                proto=tables.TCP,
+                created_at=datetime.datetime.utcnow())
+
+        client.setblocking(False)
+        self.server.setblocking(False)
+        error = self.server.connect_ex(loop.connect_address)
+        if error not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            self.server.close()
+            # it was still made, and tried
+            self.record()
+            raise OSError(error, os.strerror(error))
+
+        self.update()
+
+    def record(self):
+        if self.connection is not None and not self.recorded:
+            self.recorded = True
+            write(self.connection)
+
+    def events(self, sock):
+        # until the connect finishes, just buffer what the client sends
+        if not self.connected and sock is self.server:
+            return selectors.EVENT_WRITE
+
+        events = 0
+        if not self.eof[sock] and \
+            len(self.pending[self.peer[sock]]) < self.high_water:
+            events |= selectors.EVENT_READ
+        if self.pending[sock] and self.connected:
+            events |= selectors.EVENT_WRITE
+        return events
+
+    def update(self):
+        selector = self.loop.selector
+        for sock in (self.client, self.server):
+            events = self.events(sock)
+            registered = self.registered.get(sock, 0)
+            if events == registered:
+                continue
+            if not events:
+                selector.unregister(sock)
+            elif not registered:
+                selector.register(sock, events, self)
+            else:
+                selector.modify(sock, events, self)
+            self.registered[sock] = events
+
+    def receive(self, sock):
+        if sock is not self.client or not self.capture:
+            return sock.recv(65536)
+
+        if self.capture.limit > 0:
+            # straight into the capture, as OneWayThread does
+            data = self.capture.recv_into(sock, 65536)
+        else:
+            data = sock.recv(65536)
+            self.capture.add(data)
+        if self.capture.full():
+            # as OneWayThread does, forward what we have and then hang up
+            self.eof[self.client] = True
+        return data
+
+    def flush(self, sock):
+        pending = self.pending[sock]
+        if pending and self.connected:
+            sent = sock.send(pending)
+            del pending[:sent]
+
+    def handle(self, sock, mask):
+        if self.closed:
+            return
+
+        try:
+            if sock is self.server and not self.connected:
+                error = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                if error:
+                    raise OSError(error, os.strerror(error))
+                self.connected = True
+                self.record()
+                self.flush(sock)
+
+            if mask & selectors.EVENT_READ:
+                data = self.receive(sock)
+                if not data:
+                    self.eof[sock] = True
+                else:
+                    self.proxied[sock].inc(len(data))
+                    self.pending[self.peer[sock]] += data
+                    self.flush(self.peer[sock])
+
+            if mask & selectors.EVENT_WRITE:
+                self.flush(sock)
+
+        except (BlockingIOError, InterruptedError):
+            pass
+        except OSError as error:
+            logger.debug(error)
+            self.close()
+            return
+
+        # like OneWayThread, either side finishing ends the whole pipe, once
+        # what it sent has been passed along
+        for side in (self.client, self.server):
+            if self.eof[side] and not self.pending[self.peer[side]]:
+                self.close()
+                return
+
+        self.update()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+
+        for sock in (self.client, self.server):
+            if self.registered.get(sock):
+                self.loop.selector.unregister(sock)
+            sock.close()
+        self.loop.pipes.discard(self)
+        active.labels(self.loop.name).dec()
+        admission.release(self.address)
+
+        if self.loop.table:
+            # a connect that failed, or never finished, is recorded too
+            self.record()
+            write(self.capture.row(self.loop.table, self.connection, \
+                self.loop.preview_length))
+
+class PipeLoop(threading.Thread):
+    preview_length = OneWayThread.preview_length
+
+    def __init__(self, bind_address, connect_address, table, limit, \
+        timeout=120, name='pipe'):
+        super().__init__()
+        self.bind_address = bind_address
+        self.connect_address = connect_address
+        self.table = table
+        self.limit = limit
+        self.timeout = timeout
+        self.name = name
+        self.shutdown_requested = False
+        self.ready = threading.Event()
+
+        self.selector = selectors.DefaultSelector()
+        self.listener = None
+        self.pipes = set()
+
+    def accept(self):
+        # drain the accept backlog in one go
+        while True:
+            try:
+                client, address = self.listener.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as exc:
+                logger.info(exc)
+                return
+
+            accepted.labels(self.name).inc()
+            if not admission.admit(address[0], self.name):
+                turn_away(client, self.name)
+                continue
+
+            try:
+                self.pipes.add(Pipe(self, client, address))
+            except OSError as exc:
+                logger.info(exc)
+                admission.release(address[0])
+                client.close()
+                continue
+            active.labels(self.name).inc()
+
+    def expire(self):
+        now = time.monotonic()
+        for pipe in [pipe for pipe in self.pipes if pipe.deadline < now]:
+            logger.debug('Timing out pipe')
+            pipe.close()
+
+    def run(self):
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(self.bind_address)
+        self.listener.listen(socket.SOMAXCONN)
+        self.listener.setblocking(False)
+        self.bind_address = self.listener.getsockname()
+        self.selector.register(self.listener, selectors.EVENT_READ)
+        self.ready.set()
+
+        while not self.shutdown_requested:
+            for key, mask in self.selector.select(timeout=1):
+                if key.fileobj is self.listener:
+                    self.accept()
+                else:
+                    key.data.handle(key.fileobj, mask)
+            self.expire()
+
+        logger.info('Shutdown requested')
+        for pipe in list(self.pipes):
+            pipe.close()
+        self.selector.unregister(self.listener)
+        self.listener.close()
+        self.selector.close()
+
+    def request_shutdown(self):
+        self.shutdown_requested = True
+
+def wait_for_backend(address, timeout=120):
+    ''' Wait for a server to be answering at address, for at most timeout
+    seconds; returns whether it is. Docker's proxy accepts as soon as the
+    container's up and hangs up until the server in it is listening, so
+    being able to connect isn't enough: it has to either say something
+    first or wait for us to. '''
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with socket.create_connection(address, timeout=1) as sock:
+                sock.settimeout(0.5)
+                try:
+                    if sock.recv(1):
+                        return True
+                except socket.timeout:
+                    return True
+        except OSError:
+            pass
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(0.25)
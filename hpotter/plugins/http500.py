@@ -5,7 +5,12 @@ from datetime import datetime
 import hpotter.env
 
 from hpotter import tables
-from hpotter.env import Session
+from hpotter.env import http500_workers, http500_backlog, http500_when_full
+from hpotter.writer import write
+from hpotter.metrics import active
+from hpotter.admission import AdmissionMixIn
+from hpotter.workers import PooledMixIn
+from hpotter.processes import SharedPortMixIn
 
 # remember to put name in __init__.py
 
@@ -29,6 +34,13 @@ Content-Type: text/html; charset=UTF-8
 
 class HTTPHandler(socketserver.BaseRequestHandler):
     def handle(self):
+        active.labels('http500').inc()
+        try:
+            self.respond()
+        finally:
+            active.labels('http500').dec()
+
+    def respond(self):
         connection = tables.Connections(
             sourceIP=self.client_address[0],
             sourcePort=self.client_address[1],
@@ -36,26 +48,28 @@ class HTTPHandler(socketserver.BaseRequestHandler):
             destPort=self.server.server_address[1],
             proto=tables.TCP)
 
-        self.session = Session()
-        self.session.add(connection)
-        self.session.commit()
+        write(connection)
 
         self.request.settimeout(30)
 
         try:
-            data = self.request.recv(4096).decode("utf-8")
+            data = self.request.recv(4096)
         except:
-            Session.remove()
             return
 
-        http = tables.HTTPCommands(request=data, connection=connection)
-        self.session.add(http)
-        self.session.commit()
-        Session.remove()
+        http = tables.HTTPCommands(request=data.decode('utf-8', \
+            'backslashreplace'), payload=data, connection=connection)
+        write(http)
 
         self.request.sendall(Header.encode('utf-8'))
 
-class HTTPServer(socketserver.ThreadingMixIn, socketserver.TCPServer): pass
+class HTTPServer(AdmissionMixIn, PooledMixIn, SharedPortMixIn, \
+    socketserver.TCPServer):
+    plugin = 'http500'
+    banner = Header.encode('utf-8')
+    workers = http500_workers
+    backlog = http500_backlog
+    when_full = http500_when_full
 
 def start_server():
     hpotter.env.http500_server = HTTPServer(('0.0.0.0', 80), HTTPHandler)
@@ -64,3 +78,4 @@ def start_server():
 def stop_server():
     if hpotter.env.http500_server:
         hpotter.env.http500_server.shutdown()
+        hpotter.env.http500_server.server_close()
@@ -1,10 +1,11 @@
 import os
 import platform
-import docker
+import time
 
 from hpotter.tables import HTTPCommands
-from hpotter.env import logger
-from hpotter.plugins.generic import PipeThread
+from hpotter.env import logger, plugin_ready_timeout
+from hpotter.docker.lifecycle import get_lifecycle
+from hpotter.plugins.generic import PipeLoop, wait_for_backend
 
 class Singletons():
     httpd_container = None
@@ -12,17 +13,15 @@ class Singletons():
 
 def rm_container():
     if Singletons.httpd_container:
-        logger.info('Stopping httpd_container')
-        Singletons.httpd_container.stop()
         logger.info('Removing httpd_container')
-        Singletons.httpd_container.remove()
+        get_lifecycle().remove(Singletons.httpd_container)
         Singletons.httpd_container = None
     else:
         logger.info('No httpd_container to stop')
 
 def start_server():     # leave these two in place
     try:
-        client = docker.from_env()
+        lifecycle = get_lifecycle()
 
         container = 'httpd:latest'
         if platform.machine() == 'armv6l':
@@ -36,11 +35,11 @@ def start_server():     # leave these two in place
             logger.info(error)
             return
 
-        Singletons.httpd_container = client.containers.run(container, \
+        Singletons.httpd_container = lifecycle.container('httpd', container, \
             detach=True, ports={'80/tcp': 8080}, read_only=True, \
             volumes={'apache2': \
                 {'bind': '/usr/local/apache2/logs', 'mode': 'rw'}})
-        logger.info('Created: %s', Singletons.httpd_container)
+        logger.info('Running: %s', Singletons.httpd_container)
 
     except OSError as err:
         logger.info(err)
@@ -49,10 +48,19 @@ def start_server():     # leave these two in place
             rm_container()
         return
 
-    Singletons.httpd_thread = PipeThread(('0.0.0.0', 80), \
-        ('127.0.0.1', 8080), HTTPCommands, 4096)
+    began = time.monotonic()
+    if wait_for_backend(('127.0.0.1', 8080), plugin_ready_timeout):
+        logger.info('httpd answering after %.1fs', time.monotonic() - began)
+    else:
+        logger.info('httpd not answering after %ds, proxying anyway', \
+            plugin_ready_timeout)
+
+    Singletons.httpd_thread = PipeLoop(('0.0.0.0', 80), \
+        ('127.0.0.1', 8080), HTTPCommands, 4096, name='httpipe')
     Singletons.httpd_thread.start()
 
 def stop_server():
-    Singletons.httpd_thread.request_shutdown()
+    if Singletons.httpd_thread:
+        Singletons.httpd_thread.request_shutdown()
+        Singletons.httpd_thread = None
     rm_container()
@@ -1,10 +1,11 @@
 import os
 import platform
-import docker
+import time
 
 from hpotter.tables import SQL
-from hpotter.env import logger
-from hpotter.plugins.generic import PipeThread
+from hpotter.env import logger, plugin_ready_timeout
+from hpotter.docker.lifecycle import get_lifecycle
+from hpotter.plugins.generic import PipeLoop, wait_for_backend
 
 class Singletons():
     mariadb_container = None
@@ -12,17 +13,15 @@ class Singletons():
 
 def rm_container():
     if Singletons.mariadb_container:
-        logger.info('Stopping mariadb_container')
-        Singletons.mariadb_container.stop()
         logger.info('Removing mariadb_container')
-        Singletons.mariadb_container.remove()
+        get_lifecycle().remove(Singletons.mariadb_container)
         Singletons.mariadb_container = None
     else:
         logger.info('No mariadb_container to stop')
 
 def start_server():     # leave these two in place
     try:
-        client = docker.from_env()
+        lifecycle = get_lifecycle()
 
         container = 'mariadb:latest'
         if platform.machine() == 'armv6l':
@@ -37,13 +36,13 @@ def start_server():     # leave these two in place
             logger.info(error)
             return
 
-        Singletons.mariadb_container = client.containers.run(container, \
-            detach=True, ports={'3306/tcp': 33060}, read_only=True, \
-            environment=['MYSQL_ALLOW_EMPTY_PASSWORD=yes'], \
+        Singletons.mariadb_container = lifecycle.container('mariadb', \
+            container, detach=True, ports={'3306/tcp': 33060}, \
+            read_only=True, environment=['MYSQL_ALLOW_EMPTY_PASSWORD=yes'], \
             volumes={'tmp': {'bind': '/tmp', 'mode': 'rw'}, \
                 'mysqld': {'bind': '/var/run/mysqld', 'mode': 'rw'}
             })
-        logger.info('Created: %s', Singletons.mariadb_container)
+        logger.info('Running: %s', Singletons.mariadb_container)
 
     except OSError as err:
         logger.info(err)
@@ -52,10 +51,19 @@ def start_server():     # leave these two in place
             rm_container()
         return
 
-    Singletons.mariadb_thread = PipeThread(('0.0.0.0', 3306), \
-        ('127.0.0.1', 33060), SQL, 4096)
+    began = time.monotonic()
+    if wait_for_backend(('127.0.0.1', 33060), plugin_ready_timeout):
+        logger.info('mariadb answering after %.1fs', time.monotonic() - began)
+    else:
+        logger.info('mariadb not answering after %ds, proxying anyway', \
+            plugin_ready_timeout)
+
+    Singletons.mariadb_thread = PipeLoop(('0.0.0.0', 3306), \
+        ('127.0.0.1', 33060), SQL, 4096, name='mariadb')
     Singletons.mariadb_thread.start()
 
 def stop_server():
-    Singletons.mariadb_thread.request_shutdown()
+    if Singletons.mariadb_thread:
+        Singletons.mariadb_thread.request_shutdown()
+        Singletons.mariadb_thread = None
     rm_container()
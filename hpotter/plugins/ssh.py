@@ -4,11 +4,15 @@ import threading
 from binascii import hexlify
 import paramiko
 from paramiko.py3compat import u, decodebytes
-import _thread
 
 import hpotter.env
 from hpotter import tables
-from hpotter.env import logger, Session
+from hpotter.env import logger, ssh_workers, ssh_backlog
+from hpotter.writer import write
+from hpotter.workers import WorkerPool
+from hpotter.metrics import accepted, active, counter, gauge
+from hpotter.admission import admission, turn_away
+from hpotter.processes import share_port
 from hpotter.docker.shell import fake_shell
 
 class SSHServer(paramiko.ServerInterface):
@@ -20,9 +24,8 @@ class SSHServer(paramiko.ServerInterface):
         b"UWT10hcuO4Ks8=")
     good_pub_key = paramiko.RSAKey(data=decodebytes(data))
 
-    def __init__(self, session, connection):
+    def __init__(self, connection):
         self.event = threading.Event()
-        self.session = session
         self.connection = connection
 
     def check_channel_request(self, kind, chanid):
@@ -35,7 +38,7 @@ class SSHServer(paramiko.ServerInterface):
         if username and password:
             login = tables.Credentials(username=username, password=password, \
                 connection=self.connection)
-            self.session.add(login)
+            write(login)
 
             return paramiko.AUTH_SUCCESSFUL
         return paramiko.AUTH_FAILED
@@ -76,61 +79,113 @@ class SSHServer(paramiko.ServerInterface):
         pixelwidth, pixelheight, modes):
         return True
 
+rejected = counter('hpotter_ssh_rejected_total', \
+    'ssh connections dropped because every worker was busy')
+gauge('hpotter_ssh_queued', 'ssh connections waiting for a worker', \
+    function=lambda: hpotter.env.ssh_server_thread.pool.queue.qsize() \
+        if hpotter.env.ssh_server_thread else 0)
+
 class SshThread(threading.Thread):
-    def __init__(self):
+    # what a tarpitted client is sent, a byte at a time
+    banner = b'SSH-2.0-OpenSSH_7.4\r\n'
+
+    def __init__(self, address=('0.0.0.0', 22), workers=ssh_workers, \
+        backlog=ssh_backlog):
         super(SshThread, self).__init__()
         self.ssh_socket = socket.socket(socket.AF_INET)
-        self.ssh_socket.bind(('0.0.0.0', 22))
-        self.ssh_socket.listen(4)
-        self.chan = None
+        share_port(self.ssh_socket)
+        self.ssh_socket.bind(address)
+        self.ssh_socket.listen(socket.SOMAXCONN)
+
+        # Experiment with different key sizes at:
+        # http://travistidwell.com/jsencrypt/demo/
+        self.host_key = paramiko.RSAKey(filename="RSAKey.cfg")
+        paramiko.Transport.load_server_moduli()
+
+        self.accept_timeout = 60
+        self.pool = WorkerPool(workers, backlog, 'SshWorker')
+        self.channels = set()
+        self.stopping = threading.Event()
 
     def run(self):
         while True:
             try:
                 client, addr = self.ssh_socket.accept()
-            except ConnectionAbortedError:
-                break
-
-            session = Session()
-            connection = tables.Connections(
-                sourceIP=addr[0],
-                sourcePort=addr[1],
-                destIP=self.ssh_socket.getsockname()[0],
-                destPort=self.ssh_socket.getsockname()[1],
-                proto=tables.TCP)
-            session.add(connection)
-            session.commit()
-
-            transport = paramiko.Transport(client)
-            transport.load_server_moduli()
-
-            # Experiment with different key sizes at:
-            # http://travistidwell.com/jsencrypt/demo/
-            host_key = paramiko.RSAKey(filename="RSAKey.cfg")
-            transport.add_server_key(host_key)
+            except OSError as exc:
+                if self.stopping.is_set():
+                    break
+                # out of file descriptors, or the client gave up before it
+                # was accepted; neither is a reason to stop listening
+                logger.info('ssh accept failed: %s', exc)
+                self.stopping.wait(0.1)
+                continue
 
+            accepted.labels('ssh').inc()
+            if not admission.admit(addr[0], 'ssh'):
+                turn_away(client, 'ssh', self.banner)
+                continue
+            if not self.pool.submit(self.handle, client, addr):
+                logger.info('ssh workers busy, dropping %s', addr[0])
+                rejected.inc()
+                admission.release(addr[0])
+                client.close()
+
+    def handle(self, client, addr):
+        active.labels('ssh').inc()
+        try:
+            self.session(client, addr)
+        finally:
+            active.labels('ssh').dec()
+            admission.release(addr[0])
+
+    def discard(self, client, addr):
+        # still queued when stopping
+        admission.release(addr[0])
+        client.close()
+
+    def session(self, client, addr):
+        connection = tables.Connections(
+            sourceIP=addr[0],
+            sourcePort=addr[1],
+            destIP=self.ssh_socket.getsockname()[0],
+            destPort=self.ssh_socket.getsockname()[1],
+            proto=tables.TCP)
+        write(connection)
+
+        transport = paramiko.Transport(client)
+        transport.add_server_key(self.host_key)
 
-            server = SSHServer(session, connection)
+        try:
+            server = SSHServer(connection)
             transport.start_server(server=server)
 
-            self.chan = transport.accept()
-            if not self.chan:
+            chan = transport.accept(self.accept_timeout)
+            if not chan:
                 logger.info('no chan')
-                continue
-            fake_shell(self.chan, session, connection, '# ')
-            self.chan.close()
+                return
 
-            Session.remove()
+            self.channels.add(chan)
+            try:
+                fake_shell(chan, connection, '# ')
+            finally:
+                self.channels.discard(chan)
+                chan.close()
+        except (paramiko.SSHException, EOFError, OSError) as exc:
+            logger.debug(exc)
+        finally:
+            transport.close()
 
     def stop(self):
-        Session.remove()
-        self.ssh_socket.close()
-        if self.chan:
-            self.chan.close()
+        self.stopping.set()
+        # close alone doesn't wake a thread blocked in accept
         try:
-            _thread.exit()
-        except SystemExit:
+            self.ssh_socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
             pass
+        self.ssh_socket.close()
+        for chan in list(self.channels):
+            chan.close()
+        self.pool.stop(5, self.discard)
 
 def start_server():
     hpotter.env.ssh_server_thread = SshThread()
@@ -1,12 +1,17 @@
 import socketserver
 import threading
-import _thread
 
 import hpotter.env
 
 from hpotter import tables
-from hpotter.env import logger, Session
-from hpotter.docker.shell import fake_shell, get_string
+from hpotter.env import logger, telnet_workers, telnet_backlog, \
+    telnet_when_full
+from hpotter.writer import write
+from hpotter.metrics import active
+from hpotter.admission import AdmissionMixIn
+from hpotter.workers import PooledMixIn
+from hpotter.processes import SharedPortMixIn
+from hpotter.docker.shell import fake_shell, LineReader
 
 # https://docs.python.org/3/library/socketserver.html
 class TelnetHandler(socketserver.BaseRequestHandler):
@@ -18,8 +23,8 @@ class TelnetHandler(socketserver.BaseRequestHandler):
         while response == '':
             self.request.sendall(prompt)
 
-            logger.debug('Before creds get_string')
-            response = get_string(self.request, limit=256, telnet=True)
+            logger.debug('Before creds readline')
+            response = self.reader.readline(limit=256)
 
             tries += 1
             if tries > 2:
@@ -30,17 +35,23 @@ class TelnetHandler(socketserver.BaseRequestHandler):
         return response
 
     def handle(self):
+        active.labels('telnet').inc()
+        try:
+            self.session()
+        finally:
+            active.labels('telnet').dec()
+
+    def session(self):
         self.request.settimeout(30)
+        self.reader = LineReader(self.request, telnet=True)
 
-        self.session = Session()
         connection = tables.Connections(
             sourceIP=self.client_address[0],
             sourcePort=self.client_address[1],
             destIP=self.server.socket.getsockname()[0],
             destPort=self.server.socket.getsockname()[1],
             proto=tables.TCP)
-        self.session.add(connection)
-        self.session.commit()
+        write(connection)
         logger.debug('telnet submitted connection')
 
         try:
@@ -48,33 +59,36 @@ class TelnetHandler(socketserver.BaseRequestHandler):
             password = self.creds(b'Password: ')
         except Exception as exception:
             logger.debug(exception)
-            Session.remove()
             self.request.close()
             return
         logger.debug('After creds')
 
         creds = tables.Credentials(username=username, password=password, \
             connection=connection)
-        self.session.add(creds)
-        self.session.commit()
+        write(creds)
         logger.debug('telnet submitted creds')
 
         self.request.sendall(b'Last login: Mon Nov 20 12:41:05 2017 from 8.8.8.8\n')
 
         prompt = b'\n$: ' if username in ('root', 'admin') else b'\n#: '
         try:
-            fake_shell(self.request, self.session, connection, prompt, \
-                telnet=True)
+            fake_shell(self.request, connection, prompt, telnet=True, \
+                reader=self.reader)
         except Exception as exc:
             logger.debug(type(exc))
             logger.debug(exc)
             logger.debug('telnet fake_shell threw exception')
 
-        Session.remove()
         self.request.close()
         logger.debug('telnet handle finished')
 
-class TelnetServer(socketserver.ThreadingMixIn, socketserver.TCPServer): pass
+class TelnetServer(AdmissionMixIn, PooledMixIn, SharedPortMixIn, \
+    socketserver.TCPServer):
+    plugin = 'telnet'
+    banner = b'Username: '
+    workers = telnet_workers
+    backlog = telnet_backlog
+    when_full = telnet_when_full
 
 def start_server():
     hpotter.env.telnet_server = TelnetServer(('0.0.0.0', 23), TelnetHandler)
@@ -83,3 +97,4 @@ def start_server():
 def stop_server():
     if hpotter.env.telnet_server:
         hpotter.env.telnet_server.shutdown()
+        hpotter.env.telnet_server.server_close()
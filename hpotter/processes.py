@@ -0,0 +1,295 @@
+import collections
+import datetime
+import importlib
+import itertools
+import multiprocessing
+import multiprocessing.connection
+import os
+import queue
+import signal
+import socket
+import threading
+import time
+import weakref
+
+from sqlalchemy import inspect
+
+import hpotter.writer
+from hpotter import tables
+from hpotter.env import logger, metrics_enabled, metrics_address, \
+    metrics_port, process_workers, process_plugins
+from hpotter.metrics import counter, gauge, start_metrics, stop_metrics
+from hpotter.docker.pool import stop_shell
+
+# With [processes] workers above 1, the listeners named in [processes]
+# plugins each run in that many worker processes instead of as threads in
+# this one, so ssh handshakes and the rest are spread over the cores rather
+# than queued on one GIL. Each worker binds the same ports with
+# SO_REUSEPORT and the kernel shares new connections out between them.
+#
+# A supervisor thread here starts the workers and restarts any that die.
+# Workers never open the database: hpotter.env only opens it for the first
+# DBWriter, and a worker puts a Forwarder in the writer's place before any
+# plugin starts. What they write() is sent back over a queue, each row with
+# a token for the connection it belongs to, and put back together and
+# written here by the one DBWriter.
+
+# which worker this is, in a worker
+worker_number = None
+
+restarts = counter('hpotter_worker_restarts_total', \
+    'Worker processes started again after dying')
+forwarded = counter('hpotter_rows_forwarded_total', \
+    'Rows received from worker processes')
+
+def share_port(sock):
+    ''' Let each worker bind sock's port; call it before binding. '''
+    if worker_number is not None:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+
+class SharedPortMixIn():
+    ''' For socketserver servers that can run in worker processes. '''
+    def server_bind(self):
+        share_port(self.socket)
+        super().server_bind()
+
+def dump(row, token):
+    ''' row as something to pickle: its table, its columns, and token's
+    number for its connection, rather than the connection itself. '''
+    values = {attribute.key: getattr(row, attribute.key) \
+        for attribute in inspect(row).mapper.column_attrs}
+    if isinstance(row, tables.Connections):
+        # when it was made, not when it gets to the writer
+        if values.get('created_at') is None:
+            values['created_at'] = datetime.datetime.utcnow()
+        connection = row
+    else:
+        connection = getattr(row, 'connection', None)
+    return os.getpid(), type(row).__name__, values, \
+        token(connection) if connection is not None else None
+
+class Forwarder():
+    ''' Takes the DBWriter's place in a worker, sending rows to the parent. '''
+    def __init__(self, rows, put_timeout=5):
+        self.queue = rows
+        self.put_timeout = put_timeout
+        self.lock = threading.Lock()
+        self.tokens = weakref.WeakKeyDictionary()
+        self.numbers = itertools.count(1)
+        self.dropped = 0
+
+    def token(self, connection):
+        with self.lock:
+            token = self.tokens.get(connection)
+            if token is None:
+                token = self.tokens[connection] = next(self.numbers)
+            return token
+
+    def write(self, row):
+        # like the DBWriter, block a flood for a while and then drop
+        try:
+            self.queue.put(dump(row, self.token), timeout=self.put_timeout)
+            return True
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+            hpotter.writer.written.labels('dropped').inc()
+            logger.info('Row queue full, dropping %s', type(row).__name__)
+            return False
+
+    def flush(self, timeout=None):
+        # they're written when the parent gets to them
+        return True
+
+    def stop(self):
+        # wait for what's been put to be sent
+        self.queue.close()
+        self.queue.join_thread()
+
+    def stats(self):
+        return {'queue_depth': self.queue.qsize(), 'dropped': self.dropped}
+
+class Receiver(threading.Thread):
+    ''' Writes what the workers send, with each row given back its
+    connection. '''
+    def __init__(self, rows, remember=65536):
+        super().__init__(name='RowReceiver', daemon=True)
+        self.rows = rows
+        self.remember = remember
+        # (pid, token) -> Connections, for the rows that follow them
+        self.connections = collections.OrderedDict()
+
+    def load(self, message):
+        pid, name, values, token = message
+        row = getattr(tables, name)(**values)
+        if token is None:
+            return row
+
+        key = (pid, token)
+        if isinstance(row, tables.Connections):
+            self.connections[key] = row
+            if len(self.connections) > self.remember:
+                self.connections.popitem(last=False)
+            return row
+
+        connection = self.connections.get(key)
+        if connection is None:
+            logger.debug('No connection for a %s from worker %d', name, pid)
+        else:
+            self.connections.move_to_end(key)
+            row.connection = connection
+        return row
+
+    def run(self):
+        while True:
+            message = self.rows.get()
+            if message is None:
+                return
+            try:
+                row = self.load(message)
+            except Exception as exc:
+                logger.info('Could not read a row from a worker: %s', exc)
+                continue
+            forwarded.inc()
+            hpotter.writer.write(row)
+
+def work(number, plugins, rows):
+    ''' A worker's main: run plugins until the supervisor says stop. '''
+    global worker_number
+    worker_number = number
+
+    # ^C goes to the whole group; let the parent decide what happens
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+
+    hpotter.writer.writer = Forwarder(rows)
+    if metrics_enabled:
+        try:
+            start_metrics((metrics_address, metrics_port + number))
+        except OSError as exc:
+            logger.info('Worker %d not serving metrics: %s', number, exc)
+
+    modules = []
+    for name in plugins:
+        module = importlib.import_module('hpotter.plugins.' + name)
+        logger.info('Worker %d starting %s', number, name)
+        module.start_server()
+        modules.append(module)
+
+    while not stopping.wait(1):
+        pass
+
+    for module in modules:
+        module.stop_server()
+    stop_shell()
+    hpotter.writer.stop_writer()
+    stop_metrics()
+
+class Supervisor(threading.Thread):
+    def __init__(self, plugins, workers, queue_size=10000):
+        super().__init__(name='Supervisor', daemon=True)
+        self.plugins = plugins
+        self.workers = workers
+        # a fresh interpreter, not a fork of this one and its threads
+        self.context = multiprocessing.get_context('spawn')
+        self.rows = self.context.Queue(queue_size)
+        self.receiver = Receiver(self.rows)
+        self.processes = {}         # number -> (Process, when started)
+        self.delays = {}
+        self.restart_at = {}
+        self.stopping = threading.Event()
+
+    def spawn(self, number):
+        process = self.context.Process(target=work, \
+            args=(number, self.plugins, self.rows), \
+            name='hpotter-worker-%d' % number)
+        process.start()
+        self.processes[number] = (process, time.monotonic())
+        logger.info('Started worker %d, pid %d', number, process.pid)
+
+    def start(self):
+        self.receiver.start()
+        for number in range(1, self.workers + 1):
+            self.spawn(number)
+        super().start()
+
+    def run(self):
+        while not self.stopping.is_set():
+            timeout = 1
+            if self.restart_at:
+                timeout = max(0, min(timeout, \
+                    min(self.restart_at.values()) - time.monotonic()))
+            multiprocessing.connection.wait([process.sentinel \
+                for process, _ in self.processes.values() \
+                if process.is_alive()], timeout)
+            if self.stopping.is_set():
+                return
+
+            now = time.monotonic()
+            for number, (process, started) in list(self.processes.items()):
+                if process.is_alive() or number in self.restart_at:
+                    continue
+                # back off from one that dies as soon as it's started
+                delay = 1 if now - started > 60 else \
+                    min(60, self.delays.get(number, 0.5) * 2)
+                self.delays[number] = delay
+                logger.info('Worker %d, pid %d, exited with %s; restarting ' \
+                    'in %ds', number, process.pid, process.exitcode, delay)
+                self.restart_at[number] = now + delay
+
+            for number, when in list(self.restart_at.items()):
+                if when <= now:
+                    del self.restart_at[number]
+                    restarts.inc()
+                    self.spawn(number)
+
+    def stop(self, timeout=10):
+        self.stopping.set()
+        if self.is_alive():
+            self.join()
+
+        processes = [process for process, _ in self.processes.values()]
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        deadline = time.monotonic() + timeout
+        for process in processes:
+            process.join(max(0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.info('Killing worker pid %d', process.pid)
+                process.kill()
+                process.join()
+
+        # every row the workers sent is ahead of this
+        self.rows.put(None)
+        self.receiver.join()
+
+supervisor = None
+
+gauge('hpotter_worker_processes', 'Worker processes running', \
+    function=lambda: sum(process.is_alive() for process, _ in \
+        supervisor.processes.values()) if supervisor else 0)
+
+def forked_plugins(names):
+    ''' Which of names run in worker processes. '''
+    if process_workers <= 1:
+        return []
+    return [name for name in names if name in process_plugins]
+
+def start_workers(plugins):
+    global supervisor
+    if supervisor or not plugins:
+        return
+    logger.info('Starting %d workers for %s', process_workers, \
+        ', '.join(plugins))
+    supervisor = Supervisor(plugins, process_workers)
+    supervisor.start()
+
+def stop_workers():
+    global supervisor
+    if not supervisor:
+        return
+    logger.info('Stopping workers')
+    supervisor.stop()
+    supervisor = None
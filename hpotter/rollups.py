@@ -0,0 +1,58 @@
+import collections
+import datetime
+
+from sqlalchemy import and_
+
+from hpotter.tables import Connections, Credentials, PortCounts, \
+    CredentialCounts
+
+# Hourly counts kept up to date as rows are written, so the dashboard's
+# "connections per port" and "top logins" read a row per hour rather than
+# every connection. The DBWriter calls update with each batch, in the same
+# transaction, so the counts and the rows can't disagree. Rows count in the
+# hour their connection was made, as the migration's backfill counts them,
+# however long they took to be written.
+
+def bucket(when):
+    return when.replace(minute=0, second=0, microsecond=0)
+
+def created(connection, now):
+    if connection is None:
+        return now
+    # stamped now if it wasn't made with a time, so it's stored with the
+    # one it's counted by
+    if connection.created_at is None:
+        connection.created_at = now
+    return connection.created_at
+
+def tally(rows, now):
+    ports = collections.Counter()
+    credentials = collections.Counter()
+    for row in rows:
+        if isinstance(row, Connections):
+            hour = bucket(created(row, now))
+            ports[(hour, row.destPort or 0, row.proto or 0)] += 1
+        elif isinstance(row, Credentials):
+            hour = bucket(created(row.connection, now))
+            credentials[(hour, row.username or '', row.password or '')] += 1
+    return ports, credentials
+
+def add(session, table, keys, counts):
+    # update, and insert if there was nothing to update: the writer is the
+    # only one adding, so nothing can get in between
+    for values, count in counts.items():
+        where = and_(*[table.c[key] == value \
+            for key, value in zip(keys, values)])
+        result = session.execute(table.update().where(where) \
+            .values(count=table.c.count + count))
+        if result.rowcount == 0:
+            row = dict(zip(keys, values))
+            row['count'] = count
+            session.execute(table.insert().values(row))
+
+def update(session, rows, now=None):
+    ''' Count rows into the rollups, through session. '''
+    ports, credentials = tally(rows, now or datetime.datetime.utcnow())
+    add(session, PortCounts.__table__, ('bucket', 'destPort', 'proto'), ports)
+    add(session, CredentialCounts.__table__, \
+        ('bucket', 'username', 'password'), credentials)
@@ -0,0 +1,55 @@
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import QueuePool
+
+# How the database is opened. SQLite's defaults suit a single process: with
+# the rollback journal a reader blocks the writer (and the other way round),
+# and every commit waits for a full fsync. The honeypot writes while the
+# jsonserver reads, so it runs in WAL mode. The pragmas are set on every
+# new connection and the connections are pooled, so that happens once per
+# connection rather than once per session.
+
+profiles = {
+    'default': {},
+    'safe': {
+        'journal_mode': 'WAL',
+        'synchronous': 'FULL',
+        'busy_timeout': 5000,
+    },
+    'tuned': {
+        'journal_mode': 'WAL',
+        # a power cut can lose the last commits, never the database
+        'synchronous': 'NORMAL',
+        'mmap_size': 256 * 1024 * 1024,
+        # negative is in KiB
+        'cache_size': -64 * 1024,
+        'busy_timeout': 5000,
+        'temp_store': 'MEMORY',
+    },
+}
+
+def pragmas_for(profile, overrides=None):
+    if profile not in profiles:
+        raise ValueError('No storage profile ' + profile)
+    pragmas = dict(profiles[profile])
+    pragmas.update(overrides or {})
+    return pragmas
+
+def create_storage_engine(url, profile='tuned', pool_size=5, overrides=None):
+    pragmas = pragmas_for(profile, overrides)
+    if not url.startswith('sqlite'):
+        return create_engine(url, pool_size=pool_size)
+
+    # the pool hands connections between threads, one at a time
+    engine = create_engine(url, poolclass=QueuePool, pool_size=pool_size, \
+        max_overflow=2 * pool_size, \
+        connect_args={'check_same_thread': False, \
+            'timeout': int(pragmas.get('busy_timeout', 5000)) / 1000})
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(connection, _):
+        cursor = connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute('PRAGMA %s = %s' % (name, value))
+        cursor.close()
+
+    return engine
@@ -1,4 +1,5 @@
-from sqlalchemy import Column, String, Integer, ForeignKey, DateTime, func
+from sqlalchemy import Column, String, Integer, ForeignKey, DateTime, \
+    LargeBinary, Float, Index, func
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declared_attr, declarative_base
 from sqlalchemy_utils import IPAddressType
@@ -9,6 +10,22 @@ UDP = 17
 
 Base = declarative_base()
 
+# Each distinct value the other tables have stored, once, by its sha256;
+# see hpotter.dictionary.
+
+class Dictionary(Base):
+    # pylint: disable=E0213, R0903
+    @declared_attr
+    def __tablename__(cls):
+        return cls.__name__.lower()
+
+    id = Column(Integer, primary_key=True)
+    digest = Column(LargeBinary, nullable=False, unique=True)
+    value = Column(LargeBinary, nullable=False)
+    count = Column(Integer, nullable=False, default=0)
+    first_seen = Column(DateTime)
+    last_seen = Column(DateTime)
+
 class Connections(Base):
     # pylint: disable=E0213, R0903
     @declared_attr
@@ -16,12 +33,19 @@ class Connections(Base):
         return cls.__name__.lower()
 
     id = Column(Integer, primary_key=True)
-    created_at = Column(DateTime, default=func.now())
-    sourceIP = Column(IPAddressType)
+    created_at = Column(DateTime, default=func.now(), index=True)
+    sourceIP = Column(IPAddressType, index=True)
     sourcePort = Column(Integer)
     destIP = Column(IPAddressType)
-    destPort = Column(Integer)
+    destPort = Column(Integer, index=True)
     proto = Column(Integer)
+    # filled in from GeoIP as the row is written
+    country = Column(String)
+    latitude = Column(Float)
+    longitude = Column(Float)
+
+    __table_args__ = (Index('ix_connections_latitude_longitude', \
+        'latitude', 'longitude'),)
 
 class ShellCommands(Base):
     # pylint: disable=E0213, R0903
@@ -30,8 +54,11 @@ class ShellCommands(Base):
         return cls.__name__.lower()
 
     id = Column(Integer, primary_key=True)
+    # the value is in command or, once interned, the dictionary
     command = Column(String)
-    connections_id = Column(Integer, ForeignKey('connections.id'))
+    command_id = Column(Integer, ForeignKey('dictionary.id'))
+    connections_id = Column(Integer, ForeignKey('connections.id'), \
+        index=True)
     connection = relationship('Connections')
 
 class Credentials(Base):
@@ -43,7 +70,10 @@ class Credentials(Base):
     id = Column(Integer, primary_key=True)
     username = Column(String)
     password = Column(String)
-    connections_id = Column(Integer, ForeignKey('connections.id'))
+    username_id = Column(Integer, ForeignKey('dictionary.id'))
+    password_id = Column(Integer, ForeignKey('dictionary.id'))
+    connections_id = Column(Integer, ForeignKey('connections.id'), \
+        index=True)
     connection = relationship('Connections')
 
 class HTTPCommands(Base):
@@ -53,8 +83,13 @@ class HTTPCommands(Base):
         return cls.__name__.lower()
 
     id = Column(Integer, primary_key=True)
+    # request is a text preview, payload the exact bytes when there are any
     request = Column(String)
-    connections_id = Column(Integer, ForeignKey('connections.id'))
+    payload = Column(LargeBinary)
+    request_id = Column(Integer, ForeignKey('dictionary.id'))
+    payload_id = Column(Integer, ForeignKey('dictionary.id'))
+    connections_id = Column(Integer, ForeignKey('connections.id'), \
+        index=True)
     connection = relationship('Connections')
 
 
@@ -65,6 +100,35 @@ class SQL(Base):
         return cls.__name__.lower()
 
     id = Column(Integer, primary_key=True)
+    # request is a text preview, payload the exact bytes when there are any
     request = Column(String)
-    connections_id = Column(Integer, ForeignKey('connections.id'))
+    payload = Column(LargeBinary)
+    request_id = Column(Integer, ForeignKey('dictionary.id'))
+    payload_id = Column(Integer, ForeignKey('dictionary.id'))
+    connections_id = Column(Integer, ForeignKey('connections.id'), \
+        index=True)
     connection = relationship('Connections')
+
+# Rollups, counted by hour as rows are written; see hpotter.rollups.
+
+class PortCounts(Base):
+    # pylint: disable=E0213, R0903
+    @declared_attr
+    def __tablename__(cls):
+        return cls.__name__.lower()
+
+    bucket = Column(DateTime, primary_key=True)
+    destPort = Column(Integer, primary_key=True)
+    proto = Column(Integer, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+class CredentialCounts(Base):
+    # pylint: disable=E0213, R0903
+    @declared_attr
+    def __tablename__(cls):
+        return cls.__name__.lower()
+
+    bucket = Column(DateTime, primary_key=True)
+    username = Column(String, primary_key=True)
+    password = Column(String, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
@@ -0,0 +1,34 @@
+import os
+import tempfile
+import unittest
+
+from sqlalchemy import create_engine
+
+from hpotter import tables
+
+class DatabaseTestCase(unittest.TestCase):
+    ''' Each test gets an SQLite file of its own, at path, and engine on it
+    with the tables made; open more engines on it with connect. '''
+    make_engine = True
+    make_tables = True
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        self.engines = []
+        if self.make_engine:
+            self.engine = self.connect()
+            if self.make_tables:
+                tables.Base.metadata.create_all(self.engine)
+
+    def tearDown(self):
+        for engine in self.engines:
+            engine.dispose()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.path + suffix):
+                os.remove(self.path + suffix)
+
+    def connect(self, create=create_engine, *args, **kwargs):
+        engine = create('sqlite:///' + self.path, *args, **kwargs)
+        self.engines.append(engine)
+        return engine
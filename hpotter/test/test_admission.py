@@ -0,0 +1,139 @@
+import socket
+import socketserver
+import time
+import unittest
+
+from hpotter.admission import TokenBucket, Admission, Tarpit, \
+    AdmissionMixIn, turn_away
+from hpotter.metrics import accepted
+
+class Clock():
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+class TestTokenBucket(unittest.TestCase):
+    def test_refills(self):
+        bucket = TokenBucket(2, 3, 0)
+        self.assertEqual([bucket.take(0) for _ in range(4)], \
+            [True, True, True, False])
+        self.assertTrue(bucket.take(0.5))
+        self.assertFalse(bucket.take(0.5))
+        # never more than burst
+        self.assertEqual([bucket.take(100) for _ in range(4)], \
+            [True, True, True, False])
+
+class TestAdmission(unittest.TestCase):
+    def test_rate(self):
+        clock = Clock()
+        admission = Admission(rate=1, burst=2, global_rate=0, \
+            per_address=0, connections=0, clock=clock)
+        self.assertEqual([admission.admit('10.0.0.1') for _ in range(3)], \
+            [True, True, False])
+        # someone else has a bucket of their own
+        self.assertTrue(admission.admit('10.0.0.2'))
+        clock.now = 1
+        self.assertTrue(admission.admit('10.0.0.1'))
+
+    def test_global_rate(self):
+        admission = Admission(rate=0, global_rate=1, global_burst=2, \
+            per_address=0, connections=0, clock=Clock())
+        self.assertEqual([admission.admit('10.0.0.%d' % number) \
+            for number in range(3)], [True, True, False])
+
+    def test_open(self):
+        admission = Admission(rate=0, global_rate=0, per_address=2, \
+            connections=3, clock=Clock())
+        self.assertEqual([admission.admit('10.0.0.1') for _ in range(3)], \
+            [True, True, False])
+        self.assertTrue(admission.admit('10.0.0.2'))
+        self.assertFalse(admission.admit('10.0.0.3'))
+
+        admission.release('10.0.0.1')
+        self.assertTrue(admission.admit('10.0.0.3'))
+        self.assertEqual(admission.total, 3)
+        for address in ('10.0.0.1', '10.0.0.2', '10.0.0.3'):
+            admission.release(address)
+        self.assertEqual(admission.total, 0)
+        self.assertFalse(admission.open)
+
+    def test_exempt(self):
+        admission = Admission(rate=1, burst=1, per_address=1, \
+            exempt=['127.0.0.1'], clock=Clock())
+        self.assertTrue(all(admission.admit('127.0.0.1') for _ in range(5)))
+        admission.release('127.0.0.1')
+        self.assertEqual(admission.total, 0)
+
+    def test_forgets(self):
+        admission = Admission(rate=1, burst=1, addresses=2, clock=Clock())
+        for number in range(3):
+            admission.admit('10.0.0.%d' % number)
+        self.assertEqual(list(admission.buckets), ['10.0.0.1', '10.0.0.2'])
+
+class TestTarpit(unittest.TestCase):
+    def setUp(self):
+        self.tarpit = Tarpit(connections=1, interval=0.05, seconds=5)
+
+    def tearDown(self):
+        self.tarpit.stop()
+
+    def test_drips(self):
+        held, client = socket.socketpair()
+        client.settimeout(5)
+        self.assertTrue(self.tarpit.hold(held, b'ab'))
+        self.assertEqual(b''.join(client.recv(1) for _ in range(3)), b'aba')
+
+        # leaving lets someone else in
+        other, _ = socket.socketpair()
+        self.assertFalse(self.tarpit.hold(other))
+        client.close()
+        deadline = time.monotonic() + 5
+        while self.tarpit.held and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(self.tarpit.hold(other))
+
+    def test_full(self):
+        first, _ = socket.socketpair()
+        second, client = socket.socketpair()
+        self.assertTrue(self.tarpit.hold(first))
+        turn_away(second, pit=self.tarpit)
+        client.settimeout(5)
+        self.assertEqual(client.recv(1), b'')
+
+class Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        self.request.sendall(b'hello')
+
+class Server(AdmissionMixIn, socketserver.ThreadingMixIn, \
+    socketserver.TCPServer):
+    plugin = 'test'
+
+class TestAdmissionMixIn(unittest.TestCase):
+    def test_releases(self):
+        server = Server(('127.0.0.1', 0), Handler)
+        server.admission = Admission(rate=0, global_rate=0, per_address=1)
+        server.block_on_close = True
+        for _ in range(2):
+            with socket.create_connection(server.server_address, 5) as client:
+                server.handle_request()
+                self.assertEqual(client.recv(5), b'hello')
+            # released once its thread is done
+            deadline = time.monotonic() + 5
+            while server.admission.total and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(server.admission.total, 0)
+        server.server_close()
+
+    def test_counted(self):
+        server = Server(('127.0.0.1', 0), Handler)
+        server.admission = Admission(rate=0, global_rate=0)
+        server.block_on_close = True
+        counted = accepted.labels('test').get()
+        with socket.create_connection(server.server_address, 5) as client:
+            server.handle_request()
+            self.assertEqual(client.recv(5), b'hello')
+        # by the server as it accepts, not left to each handler
+        self.assertEqual(accepted.labels('test').get(), counted + 1)
+        server.server_close()
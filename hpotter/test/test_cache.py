@@ -0,0 +1,71 @@
+import unittest
+from unittest.mock import Mock
+
+from hpotter.docker.cache import OutputCache, normalize
+from hpotter.docker.shell import exec_command, output_cache
+
+class TestOutputCache(unittest.TestCase):
+    def setUp(self):
+        self.now = 0
+        self.cache = OutputCache(entries=2, ttl=10, max_bytes=10, \
+            clock=lambda: self.now)
+
+    def test_normalize(self):
+        self.assertEqual(normalize('uname   -a'), 'uname -a')
+        self.assertEqual(normalize("cat '/etc/passwd'"), 'cat /etc/passwd')
+        self.assertIsNone(normalize('wget http://example.com/x.sh'))
+        self.assertIsNone(normalize('cat /etc/passwd > /tmp/x'))
+        self.assertIsNone(normalize('cat "unbalanced'))
+        self.assertEqual(normalize('find / -name passwd'), \
+            'find / -name passwd')
+        self.assertIsNone(normalize('find /tmp -delete'))
+        self.assertIsNone(normalize('find / -exec rm {} +'))
+
+    def test_hit_and_miss(self):
+        self.assertIsNone(self.cache.get('a'))
+        self.cache.put('a', 0, b'out')
+        self.assertEqual(self.cache.get('a'), (0, b'out'))
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+        self.assertEqual(stats['hit_rate'], 0.5)
+
+    def test_ttl(self):
+        self.cache.put('a', 0, b'out')
+        self.now = 10
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(self.cache.stats()['expirations'], 1)
+
+    def test_lru(self):
+        self.cache.put('a', 0, b'1')
+        self.cache.put('b', 0, b'2')
+        self.cache.get('a')
+        self.cache.put('c', 0, b'3')
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(self.cache.get('a'), (0, b'1'))
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+
+    def test_bytes(self):
+        self.cache.put('a', 0, b'123456')
+        self.cache.put('b', 0, b'123456')
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(self.cache.stats()['bytes'], 6)
+        self.cache.put('c', 0, b'x' * 11)
+        self.assertIsNone(self.cache.get('c'))
+
+class TestExecCommand(unittest.TestCase):
+    def test_cached_across_containers(self):
+        self.addCleanup(output_cache.clear)
+        containers = [Mock(), Mock()]
+        for container in containers:
+            container.attrs = {'Config': {'Image': 'busybox:latest'}}
+            container.exec_run.return_value = (0, b'Linux\n')
+
+        self.assertEqual(exec_command(containers[0], 'uname -s', '/tmp'), \
+            (0, b'Linux\n'))
+        self.assertEqual(exec_command(containers[1], 'uname  -s', '/tmp'), \
+            (0, b'Linux\n'))
+        containers[1].exec_run.assert_not_called()
+
+        exec_command(containers[1], 'touch x', '/tmp')
+        exec_command(containers[1], 'touch x', '/tmp')
+        self.assertEqual(containers[1].exec_run.call_count, 2)
@@ -0,0 +1,71 @@
+from sqlalchemy import select
+
+from hpotter import tables
+from hpotter.dictionary import Interner, source
+from hpotter.rollups import update
+from hpotter.writer import DBWriter
+from hpotter.test.database import DatabaseTestCase
+
+class TestDictionary(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.interner = Interner(entries=10)
+
+    def write(self, *rows):
+        writer = DBWriter(self.engine, interner=self.interner, rollup=update)
+        writer.start()
+        for row in rows:
+            writer.write(row)
+        writer.stop()
+
+    def dictionary(self):
+        return {row.value: row.count for row in \
+            self.engine.execute(tables.Dictionary.__table__.select())}
+
+    def read(self, table):
+        columns, selectable = source(table.__table__)
+        return [dict(row) for row in self.engine.execute( \
+            select(list(columns.values())).select_from(selectable) \
+            .order_by(table.__table__.c.id))]
+
+    def test_credentials(self):
+        self.write(*[tables.Credentials(username='root', password='toor') \
+            for _ in range(5)])
+        self.assertEqual(self.dictionary(), {b'root': 5, b'toor': 5})
+        self.assertEqual(self.interner.stats()['misses'], 2)
+
+        raw = self.engine.execute('SELECT username, username_id ' \
+            'FROM credentials').fetchall()
+        self.assertEqual(len(raw), 5)
+        self.assertTrue(all(row[0] is None and row[1] for row in raw))
+
+        # read back just as they were written
+        self.assertEqual(self.read(tables.Credentials)[0], {'id': 1, \
+            'username': 'root', 'password': 'toor', 'connections_id': None})
+        # and counted before they were interned
+        self.assertEqual(self.engine.execute( \
+            'SELECT username, count FROM credentialcounts').fetchall(), \
+            [('root', 5)])
+
+    def test_payloads(self):
+        self.write(tables.HTTPCommands(request='GET /', payload=b'GET /\xff'), \
+            tables.SQL(request='select', payload=b'select'))
+        self.assertEqual(self.read(tables.HTTPCommands)[0]['payload'], \
+            b'GET /\xff')
+        # text and bytes that are the same are stored once
+        self.assertEqual(self.dictionary()[b'select'], 2)
+
+    def test_old_rows(self):
+        self.engine.execute(tables.ShellCommands.__table__.insert(), \
+            {'command': 'ls'})
+        self.write(tables.ShellCommands(command='pwd'))
+        self.assertEqual([row['command'] for row in \
+            self.read(tables.ShellCommands)], ['ls', 'pwd'])
+
+    def test_failed_batch(self):
+        # the unmapped object fails the batch; the rest go one at a time
+        self.write(tables.Credentials(username='root', password='a'), \
+            object(), tables.Credentials(username='root', password='b'))
+        self.assertEqual(self.dictionary(), {b'root': 2, b'a': 1, b'b': 1})
+        self.assertEqual([row['password'] for row in \
+            self.read(tables.Credentials)], ['a', 'b'])
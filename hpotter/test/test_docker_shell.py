@@ -1,6 +1,7 @@
 import unittest
-# from unittest.mock import MagicMock, call
-from hpotter.docker.shell import change_directory
+from unittest.mock import Mock, call, patch
+from hpotter.docker.emulator import Snapshot, Node
+from hpotter.docker.shell import change_directory, LineReader, run_shell
 
 class TestTelnet(unittest.TestCase):
     def test_empty_change_directory(self):
@@ -31,7 +32,80 @@ class TestTelnet(unittest.TestCase):
     def test_absolute_change_directory(self):
         self.assertEqual(change_directory('cd /', '/foo/bar'), '/')
         self.assertEqual(change_directory('cd /', '/'), '/')
+        self.assertEqual(change_directory('cd /dev/shm', '/etc'), '/dev/shm')
+        self.assertEqual(change_directory('cd //tmp/../etc/', '/'), '/etc')
 
     def test_relative_change_directory(self):
         self.assertEqual(change_directory('cd etc', '/'), '/etc')
         self.assertEqual(change_directory('cd etc', '/etc'), '/etc/etc')
+
+class TestRunShell(unittest.TestCase):
+    def test_cd(self):
+        snapshot = Snapshot()
+        snapshot.add('/etc', Node('dir'))
+        snapshot.add('/etc/passwd', Node('file', b''))
+        container = Mock()
+        container.exec_run.side_effect = lambda command, workdir: \
+            (0 if command == 'test -d /dev/shm' else 1, b'')
+        reader = Mock()
+        reader.readline.side_effect = ['cd /etc/passwd', 'cd /dev/shm', \
+            'cd /nope', 'pwd']
+        client_socket = Mock()
+
+        with patch('hpotter.docker.shell.get_snapshot', \
+            return_value=snapshot), patch('hpotter.docker.shell.write'):
+            run_shell(client_socket, None, b'$: ', reader, container)
+
+        sent = [args[0] for args, _ in client_socket.sendall.call_args_list \
+            if args[0] != b'$: ']
+        # only what isn't in the snapshot is looked for in the container
+        self.assertEqual(sent, [b"sh: cd: can't cd to /etc/passwd\r\n", \
+            b"sh: cd: can't cd to /nope\r\n", b'/dev/shm\r\n'])
+        self.assertEqual(container.exec_run.call_count, 2)
+
+class TestLineReader(unittest.TestCase):
+    def reader(self, chunks, telnet=True):
+        self.socket = Mock()
+        self.socket.recv.side_effect = chunks
+        return LineReader(self.socket, telnet=telnet)
+
+    def test_lines_in_one_chunk(self):
+        reader = self.reader([b'root\r\ntoor\r\nls\n'])
+        self.assertEqual(reader.readline(), 'root')
+        self.assertEqual(reader.readline(), 'toor')
+        self.assertEqual(reader.readline(), 'ls')
+        self.assertEqual(self.socket.recv.call_count, 1)
+
+    def test_cr_nul_across_chunks(self):
+        reader = self.reader([b'root\r', b'\x00toor\r', b'\n'])
+        self.assertEqual(reader.readline(), 'root')
+        self.assertEqual(reader.readline(), 'toor')
+
+    def test_negotiation(self):
+        # IAC WILL ECHO, IAC DO NAWS, then a split subnegotiation
+        reader = self.reader([b'\xff\xfb\x01\xff\xfd\x1fro', \
+            b'\xff\xfa\x1f\x00\x50\xff', b'\xf0ot\xff\xf1\n'])
+        self.assertEqual(reader.readline(), 'root')
+
+    def test_editing(self):
+        reader = self.reader([b'rooo\bt\n', b'garbage\x15ls\n'])
+        self.assertEqual(reader.readline(), 'root')
+        self.assertEqual(reader.readline(), 'ls')
+
+    def test_meta(self):
+        reader = self.reader([b'ro\xff\xffot\n'])
+        self.assertRaises(UnicodeError, reader.readline)
+
+    def test_limit(self):
+        reader = self.reader([b'x' * 10 + b'\n'])
+        self.assertRaises(IOError, reader.readline, 5)
+
+    def test_closed(self):
+        reader = self.reader([b'ro', b''])
+        self.assertRaises(IOError, reader.readline)
+
+    def test_coalesced_echo(self):
+        reader = self.reader([b'ro', b'ot\r\n'], telnet=False)
+        self.assertEqual(reader.readline(), 'root')
+        self.socket.sendall.assert_has_calls([call(b'ro'), call(b'ot\r\n')])
+        self.assertEqual(self.socket.sendall.call_count, 2)
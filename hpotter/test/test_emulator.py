@@ -0,0 +1,97 @@
+import io
+import tarfile
+import unittest
+from unittest.mock import Mock
+
+from hpotter.docker.emulator import Snapshot, emulate, covered
+
+def archive(entries):
+    data = io.BytesIO()
+    with tarfile.open(fileobj=data, mode='w') as tar:
+        for name, content in entries:
+            info = tarfile.TarInfo(name)
+            if content is None:
+                info.type = tarfile.DIRTYPE
+                tar.addfile(info)
+            elif isinstance(content, tuple):
+                info.type = tarfile.SYMTYPE
+                info.linkname = content[0]
+                tar.addfile(info)
+            else:
+                info.size = len(content)
+                tar.addfile(info, io.BytesIO(content))
+    return data.getvalue()
+
+class TestEmulator(unittest.TestCase):
+    def setUp(self):
+        container = Mock()
+        etc = archive([('etc', None), ('etc/passwd', b'root:x:0:0\n'), \
+            ('etc/.hidden', b''), ('etc/init.d', None)])
+        home = archive([('home', None), ('home/user', None), \
+            ('home/etc', ('../etc',))])
+
+        def get_archive(path):
+            if path == '/etc':
+                return [etc[:100], etc[100:]], {}
+            if path == '/home':
+                return [home], {}
+            raise IOError('not found')
+        container.get_archive.side_effect = get_archive
+        container.exec_run.side_effect = lambda command: (0, \
+            command.encode() + b' output\n')
+
+        self.snapshot = Snapshot.from_container(container)
+
+    def run_command(self, command, workdir='/'):
+        return emulate(command, workdir, self.snapshot)
+
+    def test_canned(self):
+        self.assertEqual(self.run_command('uname  -a'), \
+            (0, b'uname -a output\n'))
+        self.assertEqual(self.run_command('cat /proc/cpuinfo'), \
+            (0, b'cat /proc/cpuinfo output\n'))
+
+    def test_pwd_echo(self):
+        self.assertEqual(self.run_command('pwd', '/etc'), (0, b'/etc\n'))
+        self.assertEqual(self.run_command('echo "hello  there" $HOME'), \
+            (0, b'hello  there $HOME\n'))
+        self.assertEqual(self.run_command('echo -n hi'), (0, b'hi'))
+        self.assertIsNone(self.run_command('echo -e hi'))
+
+    def test_cat(self):
+        self.assertEqual(self.run_command('cat passwd', '/etc'), \
+            (0, b'root:x:0:0\n'))
+        self.assertEqual(self.run_command('cat /home/etc/passwd'), \
+            (0, b'root:x:0:0\n'))
+        self.assertEqual(self.run_command('cat /etc/nope')[0], 1)
+        self.assertIsNone(self.run_command('cat /proc/uptime'))
+
+    def test_ls(self):
+        self.assertEqual(self.run_command('ls /etc'), \
+            (0, b'init.d\npasswd\n'))
+        self.assertEqual(self.run_command('ls -a', '/etc'), \
+            (0, b'.\n..\n.hidden\ninit.d\npasswd\n'))
+        self.assertEqual(self.run_command('ls /home/etc/passwd'), \
+            (0, b'/home/etc/passwd\n'))
+        self.assertEqual(self.run_command('ls /'), (0, b'etc\nhome\n'))
+        self.assertEqual(self.run_command('ls /etc/nope /home'), \
+            (1, b'ls: /etc/nope: No such file or directory\n\n' \
+                b'/home:\netc\nuser\n'))
+        # not in the snapshot, so maybe in the container
+        self.assertIsNone(self.run_command('ls /nope'))
+        self.assertIsNone(self.run_command('ls -l'))
+
+    def test_isdir(self):
+        self.assertTrue(self.snapshot.isdir('/home/etc'))
+        self.assertFalse(self.snapshot.isdir('/etc/passwd'))
+
+    def test_covered(self):
+        self.assertTrue(covered('/'))
+        self.assertTrue(covered('/etc/init.d'))
+        self.assertFalse(covered('/dev/shm'))
+        self.assertFalse(covered('/etcetera'))
+
+    def test_fallback(self):
+        self.assertIsNone(self.run_command('wget http://example.com/x.sh'))
+        self.assertIsNone(self.run_command('echo "unbalanced'))
+        self.assertIsNone(emulate('pwd', '/', False))
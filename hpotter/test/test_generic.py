@@ -1,6 +1,8 @@
+import socket
 import unittest
-from unittest.mock import MagicMock, call
-from hpotter.plugins.generic import OneWayThread
+from unittest.mock import MagicMock, call, patch
+from hpotter import tables
+from hpotter.plugins.generic import OneWayThread, PipeLoop, Capture
 
 class TestGeneric(unittest.TestCase):
     # pylint: disable=R0201
@@ -33,14 +35,131 @@ class TestGeneric(unittest.TestCase):
     def test_too_many(self):
         source = unittest.mock.MagicMock()
         dest = unittest.mock.MagicMock()
-        source.recv.side_effect = 'fubar'
+        chunks = iter([b'f', b'ubar'])
+
+        # with a limit, data is read straight into the capture buffer
+        def recv_into(buffer, size):
+            data = next(chunks)[:size]
+            buffer[:len(data)] = data
+            return len(data)
+        source.recv_into.side_effect = recv_into
 
         OneWayThread(source, dest, limit=2).run()
 
-        source.sendall.assert_has_calls = [call.recv(4096), \
-            call.recv(4096), call.close()]
-        dest.sendall.assert_has_calls = [ \
-            call.sendall('f'), \
-            call.sendall('u'), \
-            call.close()]
+        self.assertEqual(source.recv_into.call_args_list[1][0][1], 1)
+        self.assertEqual([bytes(c[0][0]) for c in dest.sendall.call_args_list], \
+            [b'f', b'u'])
+        source.close.assert_called_once_with()
+        dest.close.assert_called_once_with()
+
+class TestCapture(unittest.TestCase):
+    def test_limited(self):
+        capture = Capture(4)
+        capture.add(b'fu')
+        capture.add(b'bar')
+        self.assertTrue(capture.full())
+        self.assertEqual(capture.getvalue(), b'fuba')
+
+    def test_unlimited(self):
+        capture = Capture()
+        capture.add(b'fu')
+        capture.add(b'\xffbar')
+        self.assertFalse(capture.full())
+        self.assertEqual(capture.getvalue(), b'fu\xffbar')
+
+    def test_row(self):
+        capture = Capture()
+        capture.add(b'GET /\xff')
+        self.assertEqual(capture.row(dict, None, 4), \
+            {'request': 'GET ', 'payload': b'GET /\xff', 'connection': None})
+
+class TestPipeLoop(unittest.TestCase):
+    def setUp(self):
+        self.backend = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.backend.bind(('127.0.0.1', 0))
+        self.backend.listen()
+        self.backend.settimeout(5)
+
+    def tearDown(self):
+        self.loop.request_shutdown()
+        self.loop.join()
+        self.backend.close()
+
+    def start(self, limit=0, table=None, host='127.0.0.1', backend=None):
+        self.loop = PipeLoop((host, 0), backend or \
+            self.backend.getsockname(), table, limit)
+        self.loop.start()
+        self.loop.ready.wait(5)
+
+        client = socket.create_connection(('127.0.0.1', \
+            self.loop.bind_address[1]), timeout=5)
+        if backend:
+            return client, None
+        server, _ = self.backend.accept()
+        server.settimeout(5)
+        return client, server
+
+    def test_both_ways(self):
+        client, server = self.start()
+
+        client.sendall(b'fubar')
+        self.assertEqual(server.recv(4096), b'fubar')
+        server.sendall(b'raboof')
+        self.assertEqual(client.recv(4096), b'raboof')
+
+        client.close()
+        self.assertEqual(server.recv(4096), b'')
+        server.close()
+
+    def test_too_many(self):
+        client, server = self.start(limit=2)
+
+        client.sendall(b'fubar')
+        received = b''
+        while True:
+            data = server.recv(4096)
+            if not data:
+                break
+            received += data
+
+        # the rest is never read, and the proxy hung up
+        self.assertEqual(received, b'fu')
+        client.close()
+        server.close()
+
+    def test_rows(self):
+        rows = []
+        with patch('hpotter.plugins.generic.write', rows.append):
+            client, server = self.start(table=tables.HTTPCommands, \
+                host='0.0.0.0')
+            client.sendall(b'GET /')
+            self.assertEqual(server.recv(4096), b'GET /')
+            client.close()
+            self.assertEqual(server.recv(4096), b'')
+            server.close()
+            self.loop.request_shutdown()
+            self.loop.join()
+
+        connection, command = rows
+        # where it came in, not what was listened on
+        self.assertEqual(connection.destIP, '127.0.0.1')
+        self.assertEqual(connection.destPort, self.loop.bind_address[1])
+        self.assertEqual(command.request, 'GET /')
+
+    def test_no_backend(self):
+        # a port nothing listens on
+        backend = self.backend.getsockname()
+        self.backend.close()
+        rows = []
+        with patch('hpotter.plugins.generic.write', rows.append):
+            client, _ = self.start(table=tables.HTTPCommands, \
+                backend=backend)
+            self.assertEqual(client.recv(4096), b'')
+            client.close()
+            self.loop.request_shutdown()
+            self.loop.join()
 
+        # the connection is still recorded, once
+        self.assertIsInstance(rows[0], tables.Connections)
+        self.assertEqual(sum(isinstance(row, tables.Connections) \
+            for row in rows), 1)
@@ -0,0 +1,52 @@
+import unittest
+
+from hpotter import tables
+from hpotter.geoip import locate, enrich, backfill
+from hpotter.test.database import DatabaseTestCase
+
+class TestGeoIP(unittest.TestCase):
+    def test_locate(self):
+        country, latitude, longitude = locate('81.2.69.142')
+        self.assertEqual(country, 'GB')
+        self.assertIsNotNone(latitude)
+        self.assertIsNotNone(longitude)
+
+    def test_nowhere(self):
+        self.assertIsNone(locate('127.0.0.1'))
+        self.assertIsNone(locate('not an address'))
+
+    def test_cached(self):
+        locate.cache_clear()
+        locate('81.2.69.142')
+        locate('81.2.69.142')
+        self.assertEqual(locate.cache_info().hits, 1)
+
+    def test_enrich(self):
+        row = tables.Connections(sourceIP='81.2.69.142')
+        enrich(row)
+        self.assertEqual(row.country, 'GB')
+        self.assertIsNotNone(row.latitude)
+
+        # already done, or nothing to do
+        row = tables.Connections(sourceIP='81.2.69.142', latitude=1.0)
+        enrich(row)
+        self.assertIsNone(row.country)
+        row = tables.Credentials(username='root')
+        enrich(row)
+
+class TestBackfill(DatabaseTestCase):
+    def test_backfill(self):
+        self.engine.execute(tables.Connections.__table__.insert(), \
+            [{'sourceIP': address, 'latitude': latitude} \
+                for address, latitude in (('81.2.69.142', None), \
+                    ('127.0.0.1', None), ('81.2.69.142', 1.0))] * 2)
+        self.assertEqual(backfill(self.engine, batch_size=4), 2)
+
+        table = tables.Connections.__table__
+        found = self.engine.execute(table.select().order_by(table.c.id)) \
+            .fetchall()
+        self.assertEqual([row.country for row in found], \
+            ['GB', None, None] * 2)
+        self.assertEqual(found[2].latitude, 1.0)
+        # nothing it can do twice
+        self.assertEqual(backfill(self.engine), 0)
@@ -0,0 +1,358 @@
+import datetime
+import http.client
+import io
+import json
+import threading
+import unittest
+from http.server import ThreadingHTTPServer
+from unittest.mock import Mock, patch
+from urllib.parse import urlparse, parse_qs
+
+from sqlalchemy import create_engine
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import sessionmaker
+
+from hpotter.tables import Base, Connections, Credentials, PortCounts
+from hpotter.jsonserver.query import table_query, next_link
+from hpotter.jsonserver.stats import stats_query, merge
+from hpotter.jsonserver.binning import BinCache, cell_size, bin_points, \
+    feature_collection
+from hpotter.jsonserver.stream import ChunkedWriter, CachingWriter, rows, \
+    write_json, write_jsonp
+from hpotter.jsonserver.cache import ResponseCache
+import hpotter.jsonserver.__main__ as jsonserver
+from hpotter.test.database import DatabaseTestCase
+
+class TestStream(unittest.TestCase):
+    def test_chunks(self):
+        wfile = io.BytesIO()
+        out = ChunkedWriter(wfile, size=4)
+        out.write(b'ab')
+        self.assertEqual(wfile.getvalue(), b'')
+        out.write(b'cdefghijklmnop')
+        out.write(b'q')
+        out.close()
+        self.assertEqual(wfile.getvalue(), \
+            b'10\r\nabcdefghijklmnop\r\n1\r\nq\r\n0\r\n\r\n')
+
+    def test_rows(self):
+        result = Mock()
+        result.fetchmany.side_effect = [[1, 2], [3], []]
+        self.assertEqual(list(rows(result, 2)), [1, 2, 3])
+        result.fetchmany.assert_called_with(2)
+
+    def test_json(self):
+        out = io.BytesIO()
+        write_json(out, iter([{'id': 1}, {'id': 2}]), str)
+        self.assertEqual(out.getvalue(), b'[{"id": 1}, {"id": 2}]')
+
+        out = io.BytesIO()
+        write_json(out, iter([]), str)
+        self.assertEqual(out.getvalue(), b'[]')
+
+    def test_jsonp(self):
+        out = io.BytesIO()
+        write_jsonp(out, 'jQuery', iter([{'id': 1}, {'id': 2}]), str)
+        self.assertEqual(out.getvalue(), b'jQuery({"id": 1}, {"id": 2})')
+
+    def test_caching(self):
+        wfile = io.BytesIO()
+        out = CachingWriter(wfile, 4, size=2)
+        out.write(b'abc')
+        out.close()
+        self.assertEqual(out.copy, b'abc')
+        self.assertEqual(wfile.getvalue(), b'3\r\nabc\r\n0\r\n\r\n')
+
+        out = CachingWriter(io.BytesIO(), 4)
+        out.write(b'abc')
+        out.write(b'de')
+        out.write(b'f')
+        self.assertIsNone(out.copy)
+
+class TestResponseCache(unittest.TestCase):
+    def test_etag(self):
+        cache = ResponseCache()
+        self.assertIsNone(cache.get('/connections', '"a"'))
+        cache.put('/connections', '"a"', [('Link', 'x')], b'[]')
+        self.assertEqual(cache.get('/connections', '"a"'), \
+            ([('Link', 'x')], b'[]'))
+        self.assertIsNone(cache.get('/connections', '"b"'))
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 2)
+
+    def test_entries(self):
+        cache = ResponseCache(entries=2)
+        cache.put('/a', '"1"', [], b'a')
+        cache.put('/b', '"1"', [], b'b')
+        cache.get('/a', '"1"')
+        cache.put('/c', '"1"', [], b'c')
+        self.assertIsNone(cache.get('/b', '"1"'))
+        self.assertIsNotNone(cache.get('/a', '"1"'))
+        self.assertIsNotNone(cache.get('/c', '"1"'))
+
+    def test_bytes(self):
+        cache = ResponseCache(max_bytes=10)
+        cache.put('/a', '"1"', [], b'12345')
+        cache.put('/b', '"1"', [], b'123456')
+        self.assertIsNone(cache.get('/a', '"1"'))
+        self.assertEqual(cache.stats()['bytes'], 6)
+        cache.put('/c', '"1"', [], b'12345678901')
+        self.assertIsNone(cache.get('/c', '"1"'))
+        cache.put('/b', '"2"', [], b'12')
+        self.assertEqual(cache.stats()['bytes'], 2)
+
+def hours_ago(diff):
+    return datetime.datetime.utcnow() - datetime.timedelta(hours=diff)
+
+class TestQuery(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine('sqlite://')
+        Base.metadata.create_all(self.engine)
+        old = datetime.datetime.utcnow() - datetime.timedelta(days=2)
+        self.engine.execute(Connections.__table__.insert(), \
+            [{'id': 1, 'created_at': old}, \
+                {'id': 2, 'created_at': datetime.datetime.utcnow()}])
+        self.engine.execute(Credentials.__table__.insert(), \
+            [{'id': i, 'username': 'u%d' % i, 'password': 'p', \
+                'connections_id': 1 if i < 5 else 2} for i in range(1, 11)])
+        self.table = Credentials.__table__
+        self.deltas = {'hours_ago': hours_ago}
+
+    def ids(self, query):
+        return [row['id'] for row in self.engine.execute(query)]
+
+    def query(self, **queries):
+        return table_query(self.table, \
+            {key: [value] for key, value in queries.items()}, self.deltas)
+
+    def test_everything(self):
+        query, limit = self.query()
+        self.assertIsNone(limit)
+        self.assertEqual(sorted(self.ids(query)), list(range(1, 11)))
+
+    def test_pages(self):
+        query, limit = self.query(limit='3')
+        self.assertEqual(limit, 3)
+        # one extra row says there's another page
+        self.assertEqual(self.ids(query), [1, 2, 3, 4])
+        query, _ = self.query(limit='3', after_id='3')
+        self.assertEqual(self.ids(query), [4, 5, 6, 7])
+        query, _ = self.query(limit='3', after_id='9')
+        self.assertEqual(self.ids(query), [10])
+
+    def test_descending(self):
+        query, _ = self.query(limit='2', order='desc')
+        self.assertEqual(self.ids(query), [10, 9, 8])
+        query, _ = self.query(limit='2', order='desc', after_id='3')
+        self.assertEqual(self.ids(query), [2, 1])
+
+    def test_ago(self):
+        query, _ = self.query(hours_ago='1', limit='3', after_id='5')
+        self.assertEqual(self.ids(query), [6, 7, 8, 9])
+        query, _ = self.query(hours_ago='1', order='desc')
+        self.assertEqual(self.ids(query), [10, 9, 8, 7, 6, 5])
+
+    def test_fields(self):
+        query, _ = self.query(fields='username,password')
+        self.assertEqual([column.name for column in query.columns], \
+            ['username', 'password'])
+        # paging needs the id
+        query, _ = self.query(fields='username', limit='1')
+        self.assertEqual(list(self.engine.execute(query)), \
+            [(1, 'u1'), (2, 'u2')])
+
+    def test_bad(self):
+        for queries in ({'fields': 'nope'}, {'order': 'up'}, \
+            {'limit': '0'}, {'limit': 'lots'}, {'after_id': 'x'}, \
+            {'hours_ago': 'y'}):
+            with self.assertRaises(ValueError):
+                self.query(**queries)
+
+    def test_since_hint(self):
+        query, _ = self.query(hours_ago='1')
+        self.assertIn('likelihood(', str(query.compile(dialect= \
+            sqlite.dialect())))
+        # only SQLite has it
+        self.assertNotIn('likelihood(', str(query.compile(dialect= \
+            postgresql.dialect())))
+
+    def test_next_link(self):
+        link = next_link('/credentials', \
+            {'limit': ['3'], 'after_id': ['3'], 'fields': ['id,username']}, 9)
+        url = urlparse(link)
+        self.assertEqual(url.path, '/credentials')
+        self.assertEqual(parse_qs(url.query), \
+            {'limit': ['3'], 'after_id': ['9'], 'fields': ['id,username']})
+
+class TestBinning(unittest.TestCase):
+    def test_cell_size(self):
+        self.assertIsNone(cell_size({}))
+        self.assertEqual(cell_size({'bin': ['10']}), 10)
+        self.assertEqual(cell_size({'zoom': ['0']}), 45)
+        self.assertEqual(cell_size({'zoom': ['3']}), 45 / 8)
+        for queries in ({'bin': ['0']}, {'bin': ['x']}, {'zoom': ['99']}):
+            with self.assertRaises(ValueError):
+                cell_size(queries)
+
+    def test_bins(self):
+        longitudes, latitudes, counts = bin_points( \
+            [1, 9, 11, 180, -180], [1, 9, 1, 90, -90], [1, 2, 3, 4, 5], 10)
+        self.assertEqual(list(zip(longitudes, latitudes, counts)), \
+            [(-175, -85, 5), (5, 5, 3), (15, 5, 3), (175, 85, 4)])
+
+    def test_empty(self):
+        body = feature_collection(*bin_points([], [], [], 10))
+        self.assertEqual(body, b'{"type": "FeatureCollection", "features": []}')
+
+    def test_features(self):
+        body = feature_collection(*bin_points([1], [2], [7], 10))
+        self.assertEqual(json.loads(body)['features'], [{'type': 'Feature', \
+            'geometry': {'type': 'Point', 'coordinates': [5, 5]}, \
+            'properties': {'count': 7}}])
+
+    def test_cache(self):
+        now = [0]
+        cache = BinCache(ttl=10, entries=2, clock=lambda: now[0])
+        cache.put('a', b'1')
+        now[0] = 5
+        cache.put('b', b'2')
+        self.assertEqual(cache.get('a'), b'1')
+        now[0] = 8
+        cache.put('c', b'3')
+        self.assertIsNone(cache.get('a'))
+        now[0] = 16
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), b'3')
+
+class TestStats(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine('sqlite://')
+        Base.metadata.create_all(self.engine)
+        hour = datetime.datetime.utcnow().replace(minute=0, second=0, \
+            microsecond=0)
+        old = hour - datetime.timedelta(days=2)
+        self.engine.execute(PortCounts.__table__.insert(), [
+            {'bucket': hour, 'destPort': 23, 'proto': 6, 'count': 5},
+            {'bucket': hour, 'destPort': 22, 'proto': 6, 'count': 7},
+            {'bucket': old, 'destPort': 23, 'proto': 6, 'count': 10}])
+        self.deltas = {'hours_ago': hours_ago}
+
+    def stats(self, name, **queries):
+        return [tuple(row) for row in self.engine.execute(stats_query(name, \
+            {key: [value] for key, value in queries.items()}, self.deltas))]
+
+    def test_ports(self):
+        self.assertEqual(self.stats('ports'), [(23, 6, 15), (22, 6, 7)])
+        self.assertEqual(self.stats('ports', hours_ago='1'), \
+            [(22, 6, 7), (23, 6, 5)])
+        self.assertEqual(self.stats('ports', limit='1'), [(23, 6, 15)])
+
+    def test_by_hour(self):
+        rows = self.stats('ports', by='hour')
+        self.assertEqual([row[1:] for row in rows], \
+            [(23, 6, 10), (22, 6, 7), (23, 6, 5)])
+
+    def test_merge(self):
+        # as if from two partitions
+        other = create_engine('sqlite://')
+        Base.metadata.create_all(other)
+        other.execute(PortCounts.__table__.insert(), [
+            {'bucket': datetime.datetime(2000, 1, 1), 'destPort': 22, \
+                'proto': 6, 'count': 20}])
+
+        def merged(**queries):
+            queries = {key: [value] for key, value in queries.items()}
+            query = stats_query('ports', queries, self.deltas).limit(None)
+            return [tuple(row.values()) for row in merge( \
+                [engine.execute(query) for engine in (self.engine, other)], \
+                queries)]
+
+        self.assertEqual(merged(), [(22, 6, 27), (23, 6, 15)])
+        self.assertEqual(merged(limit='1'), [(22, 6, 27)])
+        self.assertEqual([row[1:] for row in merged(by='hour')], \
+            [(22, 6, 20), (23, 6, 10), (22, 6, 7), (23, 6, 5)])
+
+    def test_bad(self):
+        with self.assertRaises(KeyError):
+            self.stats('nope')
+        with self.assertRaises(ValueError):
+            self.stats('ports', by='minute')
+
+class TestHandler(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.hour = datetime.datetime.utcnow().replace(minute=0, second=0, \
+            microsecond=0)
+        self.engine.execute(PortCounts.__table__.insert(), [
+            {'bucket': self.hour, 'destPort': 23, 'proto': 6, 'count': 5},
+            {'bucket': self.hour - datetime.timedelta(days=2), \
+                'destPort': 22, 'proto': 6, 'count': 7}])
+
+        for name, value in (('Session', sessionmaker(bind=self.engine)), \
+            ('partitions', None), ('response_cache', ResponseCache())):
+            patcher = patch.object(jsonserver, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), \
+            jsonserver.JSONHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True) \
+            .start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        super().tearDown()
+
+    def get(self, path):
+        connection = http.client.HTTPConnection(*self.server.server_address, \
+            timeout=5)
+        try:
+            connection.request('GET', path)
+            response = connection.getresponse()
+            return response.status, response.read()
+        finally:
+            connection.close()
+
+    def test_rollup(self):
+        status, body = self.get('/portcounts')
+        self.assertEqual(status, 200)
+        self.assertEqual(sorted(row['destPort'] for row in json.loads(body)), \
+            [22, 23])
+
+        status, body = self.get('/portcounts?hours_ago=1')
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body), [{'bucket': \
+            self.hour.isoformat(), 'destPort': 23, 'proto': 6, 'count': 5}])
+
+        # nothing to page by
+        for query in ('limit=10', 'after_id=1', 'order=desc'):
+            self.assertEqual(self.get('/portcounts?' + query)[0], 400)
+
+    def test_geoip_binned_sees_new_rows(self):
+        def add(latitude):
+            self.engine.execute(Connections.__table__.insert(), \
+                {'created_at': datetime.datetime.utcnow(), \
+                    'latitude': latitude, 'longitude': 10.0})
+
+        add(20.0)
+        status, first = self.get('/connections?geoip=1&bin=1')
+        self.assertEqual(status, 200)
+        add(-20.0)
+        status, second = self.get('/connections?geoip=1&bin=1')
+        self.assertEqual(status, 200)
+        self.assertEqual(len(json.loads(first)['features']), 1)
+        self.assertEqual(len(json.loads(second)['features']), 2)
+
+    def test_error_while_streaming(self):
+        def fail(handler, query, results):
+            handler.out.write(b'[')
+            raise RuntimeError('the database went away')
+
+        self.server.handle_error = Mock()
+        with patch.object(jsonserver.JSONHandler, 'write_results', fail):
+            # cut short rather than ended with the last chunk
+            with self.assertRaises(http.client.IncompleteRead):
+                self.get('/stats/ports')
+        # and nothing half written was cached
+        self.assertEqual(len(jsonserver.response_cache.cache), 0)
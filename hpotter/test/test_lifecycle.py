@@ -0,0 +1,156 @@
+import itertools
+import os
+import shutil
+import tempfile
+import unittest
+
+import docker
+
+from hpotter.docker.lifecycle import Lifecycle, fingerprint
+
+class FakeImage():
+    def __init__(self, name):
+        self.id = 'sha256:' + name
+        self.attrs = {'RepoDigests': [name.split(':')[0] + '@sha256:1234']}
+
+class FakeImages():
+    def __init__(self, *local):
+        self.local = {name: FakeImage(name) for name in local}
+        self.pulled = []
+
+    def get(self, name):
+        if name not in self.local:
+            raise docker.errors.ImageNotFound(name)
+        return self.local[name]
+
+    def pull(self, name):
+        self.pulled.append(name)
+        image = self.local[name] = FakeImage(name)
+        return image
+
+class FakeContainer():
+    names = itertools.count()
+
+    def __init__(self, labels, status='running', health=None):
+        self.name = 'container-%d' % next(self.names)
+        self.labels = labels
+        self.status = status
+        self.attrs = {'State': {'Health': {'Status': health}} if health \
+            else {}}
+        self.calls = []
+
+    def start(self):
+        self.calls.append('start')
+        self.status = 'running'
+
+    def restart(self):
+        self.calls.append('restart')
+
+    def stop(self, timeout=10):
+        self.calls.append('stop')
+        self.status = 'exited'
+
+    def remove(self, force=False, v=False):
+        self.calls.append('remove')
+        self.removed_volumes = v
+
+class FakeContainers():
+    def __init__(self):
+        self.all = []
+        self.runs = []
+
+    def run(self, image, labels=None, **options):
+        self.runs.append((image, options))
+        container = FakeContainer(labels)
+        self.all.append(container)
+        return container
+
+    def list(self, all=False, filters=None):
+        key, value = filters['label'].split('=')
+        return [container for container in self.all \
+            if container.labels.get(key) == value and \
+                'remove' not in container.calls]
+
+class FakeClient():
+    def __init__(self, *local):
+        self.images = FakeImages(*local)
+        self.containers = FakeContainers()
+
+class TestLifecycle(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.pins = os.path.join(self.directory, 'images.json')
+        self.client = FakeClient()
+
+    def leftover(self, role, image, status='exited', health=None, \
+        **options):
+        container = FakeContainer({'hpotter.role': role, \
+            'hpotter.config': fingerprint(image, options)}, status, health)
+        self.client.containers.all.append(container)
+        return container
+
+    def test_pinned_once(self):
+        lifecycle = Lifecycle(self.client, self.pins)
+        self.assertEqual(lifecycle.image('httpd:latest'), \
+            ('httpd@sha256:1234', True))
+        self.assertEqual(self.client.images.pulled, ['httpd:latest'])
+
+        # a restart uses what was pinned, and it's already here
+        self.client.images.local['httpd@sha256:1234'] = FakeImage('httpd')
+        lifecycle = Lifecycle(self.client, self.pins)
+        self.assertEqual(lifecycle.image('httpd:latest'), \
+            ('httpd@sha256:1234', False))
+        self.assertEqual(self.client.images.pulled, ['httpd:latest'])
+
+    def test_local_image_not_pulled(self):
+        self.client = FakeClient('busybox:latest')
+        lifecycle = Lifecycle(self.client, self.pins)
+        self.assertEqual(lifecycle.image('busybox:latest'), \
+            ('busybox@sha256:1234', False))
+        self.assertEqual(self.client.images.pulled, [])
+
+    def test_container_always_new(self):
+        lifecycle = Lifecycle(self.client, self.pins)
+        image, _ = lifecycle.image('httpd:latest')
+        # kept or crashed, it may have been written to
+        kept = self.leftover('httpd', image, detach=True)
+        crashed = self.leftover('httpd', image, 'running', detach=True)
+        container = lifecycle.container('httpd', 'httpd:latest', detach=True)
+
+        self.assertNotIn(container, (kept, crashed))
+        self.assertEqual(self.client.containers.runs, \
+            [('httpd@sha256:1234', {'detach': True})])
+        self.assertEqual((kept.calls, crashed.calls), \
+            (['remove'], ['remove']))
+        self.assertEqual(kept.removed_volumes, True)
+
+    def test_adopt(self):
+        lifecycle = Lifecycle(self.client, self.pins)
+        image, _ = lifecycle.image('busybox:latest')
+        kept = [self.leftover('shell', image, tty=True) for _ in range(3)]
+        used = self.leftover('shell', image, 'running', tty=True)
+
+        adopted = lifecycle.adopt('shell', 'busybox:latest', 2, tty=True)
+        self.assertEqual(adopted, kept[:2])
+        self.assertEqual([container.calls for container in kept], \
+            [['start'], ['start'], ['remove']])
+        self.assertEqual(used.calls, ['remove'])
+
+    def test_retire(self):
+        lifecycle = Lifecycle(self.client, self.pins)
+        container = lifecycle.run('shell', 'busybox:latest', tty=True)
+        lifecycle.retire(container, timeout=0)
+        self.assertEqual(container.calls, ['stop'])
+
+    def test_no_reuse(self):
+        lifecycle = Lifecycle(self.client, self.pins, reuse=False)
+        image, _ = lifecycle.image('busybox:latest')
+        kept = self.leftover('shell', image, tty=True)
+        self.assertEqual(lifecycle.adopt('shell', 'busybox:latest', 2, \
+            tty=True), [])
+        self.assertEqual(kept.calls, ['remove'])
+
+        container = lifecycle.run('shell', 'busybox:latest', tty=True)
+        lifecycle.retire(container)
+        self.assertEqual(container.calls, ['remove'])
@@ -0,0 +1,95 @@
+import socket
+import sys
+import threading
+import time
+import types
+import unittest
+
+from hpotter.manager import PluginManager
+from hpotter.plugins.generic import wait_for_backend
+
+def plugin(name, seconds, fail=False):
+    module = types.ModuleType('fake_plugins.' + name)
+    module.events = []
+
+    def start_server():
+        time.sleep(seconds)
+        if fail:
+            raise OSError('no docker')
+        module.events.append('started')
+
+    def stop_server():
+        time.sleep(seconds)
+        module.events.append('stopped')
+    module.start_server = start_server
+    module.stop_server = stop_server
+    sys.modules[module.__name__] = module
+    return module
+
+class TestPluginManager(unittest.TestCase):
+    def test_parallel(self):
+        modules = [plugin(name, 0.3) for name in ('one', 'two', 'three')]
+        manager = PluginManager(['one', 'two', 'three'], 'fake_plugins')
+
+        began = time.perf_counter()
+        manager.start()
+        self.assertLess(time.perf_counter() - began, 0.8)
+        self.assertEqual([plugin.state for plugin in manager.plugins], \
+            ['running'] * 3)
+        self.assertTrue(all(plugin.start_seconds >= 0.3 \
+            for plugin in manager.plugins))
+
+        began = time.perf_counter()
+        manager.stop()
+        self.assertLess(time.perf_counter() - began, 0.8)
+        self.assertEqual([module.events for module in modules], \
+            [['started', 'stopped']] * 3)
+
+    def test_failure(self):
+        broken = plugin('broken', 0, fail=True)
+        working = plugin('working', 0)
+        manager = PluginManager(['broken', 'working'], 'fake_plugins')
+        manager.start()
+        self.assertEqual([plugin.state for plugin in manager.plugins], \
+            ['failed', 'running'])
+        manager.stop()
+        self.assertEqual(broken.events, [])
+        self.assertEqual(working.events, ['started', 'stopped'])
+
+class TestWaitForBackend(unittest.TestCase):
+    def setUp(self):
+        self.server = socket.socket()
+        self.server.bind(('127.0.0.1', 0))
+        self.server.listen()
+        self.address = self.server.getsockname()
+
+    def tearDown(self):
+        self.server.close()
+
+    def serve(self, answer):
+        def accept():
+            while True:
+                try:
+                    client, _ = self.server.accept()
+                except OSError:
+                    return
+                if answer:
+                    client.sendall(answer)
+                    time.sleep(0.1)
+                client.close()
+        threading.Thread(target=accept, daemon=True).start()
+
+    def test_greeting(self):
+        self.serve(b'5.5.5-MariaDB')
+        self.assertTrue(wait_for_backend(self.address, 2))
+
+    def test_silent(self):
+        # an http server waits for the request
+        self.assertTrue(wait_for_backend(self.address, 2))
+
+    def test_hangs_up(self):
+        # what docker's proxy does before the server inside is listening
+        self.serve(None)
+        began = time.monotonic()
+        self.assertFalse(wait_for_backend(self.address, 0.3))
+        self.assertGreater(time.monotonic() - began, 0.3)
@@ -0,0 +1,88 @@
+import threading
+import unittest
+import urllib.request
+
+from hpotter.metrics import Counter, Gauge, Histogram, Registry, \
+    start_metrics, stop_metrics
+
+class TestMetrics(unittest.TestCase):
+    def test_counter(self):
+        counter = Counter('requests_total', 'Requests', ('plugin',))
+
+        def count():
+            for _ in range(1000):
+                counter.labels('telnet').inc()
+
+        threads = [threading.Thread(target=count) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        counter.labels('ssh').inc(5)
+
+        # the finished threads' counts are kept
+        self.assertEqual(list(counter.samples()), [
+            ('', {'plugin': 'ssh'}, 5),
+            ('', {'plugin': 'telnet'}, 4000)])
+        self.assertEqual(counter.labels('telnet').cells.cells, [])
+
+        with self.assertRaises(ValueError):
+            counter.labels()
+
+    def test_unscraped(self):
+        counter = Counter('connections_total', 'Connections')
+        for _ in range(2000):
+            thread = threading.Thread(target=counter.inc)
+            thread.start()
+            thread.join()
+        # folded in as they're made, with no scrape to do it
+        self.assertLess(len(counter.labels().cells.cells), 32)
+        self.assertEqual(list(counter.samples()), [('', {}, 2000)])
+
+    def test_gauge(self):
+        gauge = Gauge('active', 'Active')
+        gauge.inc()
+        thread = threading.Thread(target=gauge.dec)
+        thread.start()
+        thread.join()
+        gauge.inc()
+        self.assertEqual(list(gauge.samples()), [('', {}, 1)])
+
+        gauge = Gauge('threads', 'Threads', ('kind',), \
+            lambda: {('Worker',): 3})
+        self.assertEqual(list(gauge.samples()), [('', {'kind': 'Worker'}, 3)])
+
+    def test_histogram(self):
+        histogram = Histogram('seconds', 'Seconds', buckets=(0.1, 1))
+        for value in (0.05, 0.1, 0.5, 2):
+            histogram.observe(value)
+        self.assertEqual(list(histogram.samples()), [
+            ('_bucket', {'le': '0.1'}, 2),
+            ('_bucket', {'le': '1'}, 3),
+            ('_bucket', {'le': '+Inf'}, 4),
+            ('_sum', {}, 2.65),
+            ('_count', {}, 4)])
+
+    def test_expose(self):
+        registry = Registry()
+        counter = registry.register(Counter('hits_total', 'Hits', ('path',)))
+        registry.register(Counter('misses_total', 'Misses'))
+        counter.labels('/a"b').inc(2)
+        self.assertEqual(registry.expose(), \
+            '# HELP hits_total Hits\n'
+            '# TYPE hits_total counter\n'
+            'hits_total{path="/a\\"b"} 2\n'
+            '# HELP misses_total Misses\n'
+            '# TYPE misses_total counter\n'
+            'misses_total 0\n')
+
+    def test_server(self):
+        server = start_metrics(('127.0.0.1', 0))
+        try:
+            url = 'http://127.0.0.1:%d/metrics' % server.server_address[1]
+            with urllib.request.urlopen(url) as response:
+                body = response.read().decode()
+            self.assertIn('# TYPE hpotter_threads gauge', body)
+            self.assertIn('hpotter_threads{kind="Metrics"} 1', body)
+        finally:
+            stop_metrics()
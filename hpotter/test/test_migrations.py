@@ -0,0 +1,72 @@
+from sqlalchemy import inspect
+
+from hpotter import tables
+from hpotter.migrations import migrate, steps
+from hpotter.test.database import DatabaseTestCase
+
+# the tables as first released
+original = (
+    'CREATE TABLE connections (id INTEGER NOT NULL, created_at DATETIME, '
+    '"sourceIP" VARCHAR(50), "sourcePort" INTEGER, "destIP" VARCHAR(50), '
+    '"destPort" INTEGER, proto INTEGER, PRIMARY KEY (id))',
+    'CREATE TABLE httpcommands (id INTEGER NOT NULL, request VARCHAR, '
+    'connections_id INTEGER, PRIMARY KEY (id))',
+    'CREATE TABLE sql (id INTEGER NOT NULL, request VARCHAR, '
+    'connections_id INTEGER, PRIMARY KEY (id))',
+)
+
+class TestMigrations(DatabaseTestCase):
+    # as an old database would be
+    make_tables = False
+
+    def version(self):
+        return self.engine.execute('SELECT version FROM schema_version') \
+            .scalar()
+
+    def test_upgrade(self):
+        for statement in original:
+            self.engine.execute(statement)
+        self.engine.execute('INSERT INTO connections ' \
+            '(created_at, "sourceIP", "destPort", proto) ' \
+            "VALUES ('2020-01-02 03:04:05', '127.0.0.1', 23, 6)")
+        tables.Base.metadata.create_all(self.engine)
+        migrate(self.engine)
+
+        inspector = inspect(self.engine)
+        columns = [column['name'] for column in \
+            inspector.get_columns('connections')]
+        self.assertIn('latitude', columns)
+        self.assertIn('payload', [column['name'] for column in \
+            inspector.get_columns('sql')])
+        self.assertIn('ix_connections_created_at', [index['name'] for index \
+            in inspector.get_indexes('connections')])
+        self.assertEqual(self.version(), len(steps))
+        self.assertEqual(self.engine.execute( \
+            tables.Connections.__table__.count()).scalar(), 1)
+        # counted into the rollups
+        self.assertEqual(self.engine.execute( \
+            'SELECT count FROM portcounts').scalar(), 1)
+
+        # nothing left to do
+        migrate(self.engine)
+        self.assertEqual(self.version(), len(steps))
+
+    def test_fresh(self):
+        tables.Base.metadata.create_all(self.engine)
+        migrate(self.engine)
+        self.assertEqual(self.version(), len(steps))
+
+    def test_query_plan(self):
+        tables.Base.metadata.create_all(self.engine)
+        migrate(self.engine)
+        plan = ' '.join(str(row) for row in self.engine.execute( \
+            'EXPLAIN QUERY PLAN SELECT * FROM credentials ' \
+            'JOIN connections ON connections.id = connections_id ' \
+            "WHERE connections.created_at > '2020-01-01'"))
+        self.assertIn('ix_connections_created_at', plan)
+
+        # the map's points come from the index alone
+        plan = ' '.join(str(row) for row in self.engine.execute( \
+            'EXPLAIN QUERY PLAN SELECT DISTINCT longitude, latitude ' \
+            'FROM connections WHERE latitude IS NOT NULL'))
+        self.assertIn('COVERING INDEX ix_connections_latitude_longitude', plan)
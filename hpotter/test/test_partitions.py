@@ -0,0 +1,149 @@
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+from sqlalchemy import create_engine, select
+
+from hpotter import tables
+from hpotter.dictionary import Interner
+from hpotter.rollups import update
+from hpotter.partitions import Partitions, start_of, base_of, id_span
+from hpotter.writer import DBWriter
+
+def storage(url):
+    return create_engine(url)
+
+class TestPartitions(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.legacy = create_engine('sqlite:///' + \
+            os.path.join(self.directory, 'main.db'))
+        tables.Base.metadata.create_all(self.legacy)
+        self.partitions = Partitions(os.path.join(self.directory, 'parts'), \
+            legacy=self.legacy, storage=storage)
+
+    def tearDown(self):
+        self.partitions.close()
+        self.legacy.dispose()
+        shutil.rmtree(self.directory)
+
+    def connection(self, when):
+        return tables.Connections(sourceIP='127.0.0.1', sourcePort=1234, \
+            destIP='127.0.0.1', destPort=23, proto=tables.TCP, \
+            created_at=when)
+
+    def test_start_of(self):
+        when = datetime.datetime(2020, 3, 5, 23, 59)
+        self.assertEqual(start_of(when, 'day'), datetime.date(2020, 3, 5))
+        self.assertEqual(start_of(when, 'week'), datetime.date(2020, 3, 2))
+
+    def test_writer(self):
+        writer = DBWriter(self.legacy, rollup=update, \
+            partitions=self.partitions)
+        writer.start()
+        before = self.connection(datetime.datetime(2020, 3, 5, 23, 59))
+        after = self.connection(datetime.datetime(2020, 3, 6, 0, 1))
+        writer.write(before)
+        writer.write(after)
+        # goes with its connection, not the day it's written on
+        writer.write(tables.Credentials(username='root', password='toor', \
+            connection=before))
+        writer.stop()
+
+        base = base_of(datetime.date(2020, 3, 5))
+        self.assertEqual(before.id, base + 1)
+        self.assertEqual(after.id, base + id_span + 1)
+
+        found = self.partitions.covering()
+        self.assertEqual([partition.name for partition in found], \
+            ['legacy', 'hpotter-2020-03-05.db', 'hpotter-2020-03-06.db'])
+        counts = [partition.engine.execute( \
+            tables.Credentials.__table__.count()).scalar() \
+            for partition in found]
+        self.assertEqual(counts, [0, 1, 0])
+        self.assertEqual(found[1].engine.execute( \
+            tables.PortCounts.__table__.count()).scalar(), 1)
+
+    def test_covering(self):
+        self.legacy.execute(tables.Connections.__table__.insert(), \
+            created_at=datetime.datetime(2020, 3, 1))
+        for day in (5, 6, 7):
+            self.partitions.for_writing(datetime.datetime(2020, 3, day))
+
+        def names(*args, **kwargs):
+            return [partition.name for partition in \
+                self.partitions.covering(*args, **kwargs)]
+
+        self.assertEqual(names(datetime.datetime(2020, 3, 6, 12)), \
+            ['hpotter-2020-03-06.db', 'hpotter-2020-03-07.db'])
+        self.assertEqual(names(datetime.datetime(2020, 2, 28))[0], 'legacy')
+
+        after_id = base_of(datetime.date(2020, 3, 6)) + 5
+        self.assertEqual(names(after_id=after_id), \
+            ['hpotter-2020-03-06.db', 'hpotter-2020-03-07.db'])
+        self.assertEqual(names(after_id=after_id, descending=True), \
+            ['hpotter-2020-03-06.db', 'hpotter-2020-03-05.db', 'legacy'])
+
+    def test_covering_more_than_open(self):
+        partitions = Partitions(self.partitions.directory, \
+            open_partitions=2, storage=storage)
+        self.addCleanup(partitions.close)
+        for day in (1, 2, 3, 4):
+            partitions.for_writing(datetime.datetime(2020, 3, day))
+
+        found = partitions.covering()
+        self.assertEqual(len(found), 4)
+        for partition in found:
+            self.assertIsNotNone(partition.Session)
+        # and back down to two once another is opened
+        partitions.for_writing(datetime.datetime(2020, 3, 5))
+        self.assertEqual(len(partitions.opened), 2)
+
+    def test_retire(self):
+        partitions = Partitions(self.partitions.directory, storage=storage)
+        for day in (1, 3, 5, 6):
+            partitions.for_writing(datetime.datetime(2020, 3, day))
+        # set after, or writing would start retiring them as of today
+        partitions.archive_after = 2
+        partitions.drop_after = 4
+        partitions.retire(datetime.date(2020, 3, 7))
+
+        self.assertEqual(sorted(os.listdir(partitions.directory)), \
+            ['archive', 'hpotter-2020-03-05.db', 'hpotter-2020-03-06.db'])
+        self.assertEqual(os.listdir(partitions.archive), \
+            ['hpotter-2020-03-03.db.gz'])
+
+        partitions.retire(datetime.date(2020, 3, 9))
+        self.assertEqual(sorted(os.listdir(partitions.archive)), \
+            ['hpotter-2020-03-05.db.gz', 'hpotter-2020-03-06.db.gz'])
+        partitions.close()
+
+    def test_retire_keeps_rollups(self):
+        writer = DBWriter(self.legacy, rollup=update, interner=Interner(), \
+            partitions=self.partitions)
+        writer.start()
+        for day in (1, 1, 2):
+            connection = self.connection(datetime.datetime(2020, 3, day, 9))
+            writer.write(connection)
+            writer.write(tables.Credentials(username='root', \
+                password='toor', connection=connection))
+        writer.stop()
+        self.partitions.archive_after = 3
+        self.partitions.retire(datetime.date(2020, 3, 5))
+
+        ports = tables.PortCounts.__table__
+        self.assertEqual(self.legacy.execute(select([ports.c.bucket, \
+            ports.c.count])).fetchall(), \
+            [(datetime.datetime(2020, 3, 1, 9), 2)])
+        dictionary = tables.Dictionary.__table__
+        self.assertEqual(sorted(self.legacy.execute(select( \
+            [dictionary.c.value, dictionary.c.count])).fetchall()), \
+            [(b'root', 2), (b'toor', 2)])
+
+        # and are still asked for, however recent the window
+        since = datetime.datetime(2020, 3, 2)
+        self.assertEqual([partition.name for partition in \
+            self.partitions.covering(since, rollups=True)], \
+            ['legacy', 'hpotter-2020-03-02.db'])
@@ -0,0 +1,81 @@
+import itertools
+import threading
+import time
+import unittest
+
+from hpotter.docker.pool import ContainerPool
+
+class TestContainerPool(unittest.TestCase):
+    def setUp(self):
+        self.counter = itertools.count()
+        self.destroyed = []
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def create(self):
+        self.gate.wait()
+        return next(self.counter)
+
+    def pool(self, size, maximum):
+        pool = ContainerPool(self.create, self.destroyed.append, size, maximum)
+        pool.start()
+        self.addCleanup(pool.stop)
+        return pool
+
+    def wait_for(self, check):
+        end = time.monotonic() + 5
+        while not check():
+            self.assertLess(time.monotonic(), end)
+            time.sleep(0.01)
+
+    def test_warm(self):
+        pool = self.pool(2, 4)
+        self.wait_for(lambda: pool.stats()['idle'] == 2)
+
+        self.assertEqual(pool.lease(), 0)
+        self.assertEqual(pool.stats()['hits'], 1)
+        # the one just leased gets replaced
+        self.wait_for(lambda: pool.stats()['idle'] == 2)
+
+    def test_release_recycles(self):
+        pool = self.pool(1, 2)
+        container = pool.lease()
+        pool.release(container)
+        self.wait_for(lambda: self.destroyed == [container])
+        self.assertEqual(pool.stats()['recycled'], 1)
+
+    def test_miss_waits(self):
+        self.gate.clear()
+        pool = self.pool(1, 2)
+        threading.Timer(0.1, self.gate.set).start()
+
+        self.assertIsNotNone(pool.lease())
+        stats = pool.stats()
+        self.assertEqual(stats['misses'], 1)
+        self.assertGreater(stats['max_lease_wait_seconds'], 0.05)
+
+    def test_maximum(self):
+        pool = self.pool(1, 2)
+        pool.lease()
+        pool.lease()
+        self.assertRaises(IOError, pool.lease, 0.1)
+        self.assertEqual(pool.stats()['alive'], 2)
+
+    def test_stop_removes_idle(self):
+        pool = ContainerPool(self.create, self.destroyed.append, 2, 2)
+        pool.start()
+        self.wait_for(lambda: pool.stats()['idle'] == 2)
+        pool.stop()
+        self.assertEqual(sorted(self.destroyed), [0, 1])
+
+    def test_adopted_and_kept(self):
+        kept = []
+        pool = ContainerPool(self.create, self.destroyed.append, 2, 2, \
+            kept.append)
+        pool.adopt(['old'])
+        pool.start()
+        self.assertEqual(pool.lease(), 'old')
+        self.wait_for(lambda: pool.stats()['idle'] == 1)
+        pool.stop()
+        # the one leased is neither; the idle one is kept
+        self.assertEqual((kept, self.destroyed), ([0], []))
@@ -0,0 +1,78 @@
+import os
+import queue
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import hpotter.processes
+from hpotter import tables
+from hpotter.processes import Forwarder, Receiver, share_port
+
+class TestForwarding(unittest.TestCase):
+    def test_connection_kept(self):
+        rows = queue.Queue()
+        forwarder = Forwarder(rows)
+        connection = tables.Connections(sourceIP='10.0.0.1', sourcePort=1, \
+            destIP='10.0.0.2', destPort=23, proto=tables.TCP)
+        forwarder.write(connection)
+        forwarder.write(tables.Credentials(username='root', \
+            password='toor', connection=connection))
+        forwarder.write(tables.ShellCommands(command='uname', \
+            connection=connection))
+
+        receiver = Receiver(rows)
+        loaded = [receiver.load(rows.get()) for _ in range(3)]
+        self.assertEqual(loaded[0].sourceIP, '10.0.0.1')
+        self.assertIsNotNone(loaded[0].created_at)
+        self.assertEqual(loaded[1].password, 'toor')
+        self.assertIs(loaded[1].connection, loaded[0])
+        self.assertIs(loaded[2].connection, loaded[0])
+
+    def test_forgets(self):
+        rows = queue.Queue()
+        forwarder = Forwarder(rows)
+        receiver = Receiver(rows, remember=1)
+        connections = [tables.Connections(destPort=port) for port in (1, 2)]
+        for connection in connections:
+            forwarder.write(connection)
+        forwarder.write(tables.SQL(request='x', connection=connections[0]))
+
+        loaded = [receiver.load(rows.get()) for _ in range(3)]
+        self.assertIsNone(loaded[2].connection)
+        self.assertEqual(list(receiver.connections.values()), [loaded[1]])
+
+    def test_full(self):
+        forwarder = Forwarder(queue.Queue(1), put_timeout=0)
+        self.assertTrue(forwarder.write(tables.Connections()))
+        self.assertFalse(forwarder.write(tables.Connections()))
+        self.assertEqual(forwarder.dropped, 1)
+
+class TestSharePort(unittest.TestCase):
+    def test_share_port(self):
+        with patch.object(hpotter.processes, 'worker_number', 1):
+            first = socket.socket()
+            share_port(first)
+            first.bind(('127.0.0.1', 0))
+            second = socket.socket()
+            share_port(second)
+            second.bind(first.getsockname())
+        first.close()
+        second.close()
+
+class TestWorker(unittest.TestCase):
+    def test_imports_no_database(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        config = os.path.join(directory, 'hpotter.conf')
+        with open(config, 'w') as conf:
+            conf.write('[database]\nurl = sqlite:///%s\npartition = none\n' \
+                % os.path.join(directory, 'main.db'))
+
+        # what a spawned worker imports before it runs any plugin
+        subprocess.run([sys.executable, '-c', 'import hpotter.processes'], \
+            check=True, env=dict(os.environ, HPOTTER_CONFIG=config))
+        self.assertEqual(os.listdir(directory), ['hpotter.conf'])
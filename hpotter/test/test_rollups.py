@@ -0,0 +1,57 @@
+import datetime
+
+from hpotter import tables
+from hpotter.rollups import bucket, tally, update
+from hpotter.writer import DBWriter
+from hpotter.test.database import DatabaseTestCase
+
+class TestRollups(DatabaseTestCase):
+    def connection(self, port=23):
+        return tables.Connections(sourceIP='127.0.0.1', sourcePort=1234, \
+            destIP='127.0.0.1', destPort=port, proto=tables.TCP)
+
+    def test_bucket(self):
+        self.assertEqual(bucket(datetime.datetime(2020, 1, 2, 3, 4, 5, 6)), \
+            datetime.datetime(2020, 1, 2, 3))
+
+    def test_tally(self):
+        now = datetime.datetime(2020, 1, 2, 3, 4)
+        hour = datetime.datetime(2020, 1, 2, 3)
+        connection = self.connection()
+        ports, credentials = tally([connection, self.connection(), \
+            self.connection(22), tables.Credentials(username='root', \
+                password=None, connection=connection)], now)
+        self.assertEqual(ports, {(hour, 23, tables.TCP): 2, \
+            (hour, 22, tables.TCP): 1})
+        self.assertEqual(credentials, {(hour, 'root', ''): 1})
+        self.assertEqual(connection.created_at, now)
+
+    def test_tally_by_connection(self):
+        # made before the hour, written after it
+        made = datetime.datetime(2020, 1, 2, 2, 59, 59)
+        connection = self.connection()
+        connection.created_at = made
+        ports, credentials = tally([connection, tables.Credentials( \
+            username='root', password='toor', connection=connection)], \
+            datetime.datetime(2020, 1, 2, 3, 0, 1))
+        hour = datetime.datetime(2020, 1, 2, 2)
+        self.assertEqual(ports, {(hour, 23, tables.TCP): 1})
+        self.assertEqual(credentials, {(hour, 'root', 'toor'): 1})
+
+    def test_writer(self):
+        writer = DBWriter(self.engine, batch_size=2, flush_interval=10, \
+            rollup=update)
+        writer.start()
+        for port in (23, 23, 22, 23, 22):
+            connection = self.connection(port)
+            writer.write(connection)
+            writer.write(tables.Credentials(username='root', \
+                password='toor', connection=connection))
+        writer.stop()
+
+        counts = dict(((row.destPort, row.count) for row in \
+            self.engine.execute(tables.PortCounts.__table__.select())))
+        self.assertEqual(counts, {23: 3, 22: 2})
+        self.assertEqual(self.engine.execute( \
+            tables.CredentialCounts.__table__.select()).fetchall()[0] \
+            .count, 5)
@@ -0,0 +1,32 @@
+import errno
+import socket
+import threading
+import unittest
+from unittest.mock import Mock
+
+from hpotter.plugins.ssh import SshThread
+
+class TestSsh(unittest.TestCase):
+    def test_accept_fails(self):
+        thread = SshThread(('127.0.0.1', 0), workers=1, backlog=1)
+        listening = thread.ssh_socket
+        failures = iter([OSError(errno.EMFILE, 'Too many open files')])
+
+        def accept():
+            for failure in failures:
+                raise failure
+            return listening.accept()
+
+        thread.ssh_socket = Mock(wraps=listening)
+        thread.ssh_socket.accept.side_effect = accept
+        handled = threading.Event()
+        thread.handle = lambda client, addr: (client.close(), handled.set())
+        thread.start()
+        try:
+            # out of descriptors for a moment, then back to listening
+            with socket.create_connection(listening.getsockname()):
+                self.assertTrue(handled.wait(5))
+        finally:
+            thread.stop()
+            thread.join(5)
+        self.assertFalse(thread.is_alive())
@@ -0,0 +1,56 @@
+from sqlalchemy.exc import OperationalError
+
+from hpotter.storage import create_storage_engine
+from hpotter.test.database import DatabaseTestCase
+
+class TestStorage(DatabaseTestCase):
+    # each test opens its own, with the settings it's testing
+    make_engine = False
+
+    def engine(self, *args, **kwargs):
+        return self.connect(create_storage_engine, *args, **kwargs)
+
+    def pragma(self, engine, name):
+        return engine.execute('PRAGMA ' + name).scalar()
+
+    def test_tuned(self):
+        engine = self.engine('tuned')
+        self.assertEqual(self.pragma(engine, 'journal_mode'), 'wal')
+        # NORMAL
+        self.assertEqual(self.pragma(engine, 'synchronous'), 1)
+        self.assertEqual(self.pragma(engine, 'busy_timeout'), 5000)
+
+    def test_default(self):
+        engine = self.engine('default')
+        self.assertEqual(self.pragma(engine, 'journal_mode'), 'delete')
+
+    def test_overrides(self):
+        engine = self.engine('safe', overrides={'synchronous': 'OFF'})
+        self.assertEqual(self.pragma(engine, 'synchronous'), 0)
+        with self.assertRaises(ValueError):
+            self.engine('fastest')
+
+    def commit_while_reading(self, profile):
+        engine = self.engine(profile, overrides={'busy_timeout': 0})
+        engine.execute('CREATE TABLE t (x INTEGER)')
+        engine.execute('INSERT INTO t VALUES (1), (2)')
+
+        # the jsonserver part way through streaming a table
+        reader = engine.connect()
+        result = reader.execute('SELECT x FROM t')
+        result.fetchone()
+        try:
+            writer = engine.connect()
+            with writer.begin():
+                writer.execute('INSERT INTO t VALUES (3)')
+            writer.close()
+        finally:
+            result.close()
+            reader.close()
+
+    def test_commit_while_reading(self):
+        self.commit_while_reading('tuned')
+
+    def test_default_blocks(self):
+        with self.assertRaises(OperationalError):
+            self.commit_while_reading('default')
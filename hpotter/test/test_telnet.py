@@ -2,7 +2,7 @@ import unittest
 from unittest.mock import MagicMock, call
 from hpotter.plugins.telnet import TelnetHandler
 # from hpotter.plugins.telnet import start_server, stop_server
-from hpotter.env import start_shell, stop_shell
+from hpotter.docker.pool import start_shell, stop_shell
 
 class TestTelnet(unittest.TestCase):
     def setUp(self):
@@ -0,0 +1,99 @@
+import socket
+import socketserver
+import threading
+import time
+import unittest
+
+from hpotter.workers import WorkerPool, PooledMixIn
+
+class TestWorkerPool(unittest.TestCase):
+    def test_runs(self):
+        pool = WorkerPool(2, 4)
+        done = []
+        for number in range(4):
+            self.assertTrue(pool.submit(done.append, number))
+        pool.stop(5)
+        self.assertEqual(sorted(done), [0, 1, 2, 3])
+
+    def test_full(self):
+        gate = threading.Event()
+        pool = WorkerPool(1, 1)
+        started = threading.Event()
+
+        def block():
+            started.set()
+            gate.wait()
+        pool.submit(block)
+        started.wait(5)
+
+        self.assertTrue(pool.submit(gate.wait))
+        self.assertFalse(pool.submit(gate.wait))
+        gate.set()
+        pool.stop(5)
+
+    def test_survives_exceptions(self):
+        pool = WorkerPool(1, 2)
+        done = []
+        pool.submit(lambda: 1 / 0)
+        pool.submit(done.append, 'after')
+        pool.stop(5)
+        self.assertEqual(done, ['after'])
+
+    def test_stop_when_full(self):
+        gate = threading.Event()
+        self.addCleanup(gate.set)
+        pool = WorkerPool(1, 2)
+        pool.submit(gate.wait)
+        self.assertTrue(pool.submit(gate.wait))
+        # the worker may not have taken the first yet
+        pool.submit(gate.wait)
+
+        discarded = []
+        began = time.monotonic()
+        pool.stop(0.5, lambda: discarded.append(1))
+        self.assertLess(time.monotonic() - began, 2)
+        self.assertIn(len(discarded), (1, 2))
+
+        # without discard, what's queued would run, but it doesn't wait
+        pool = WorkerPool(1, 1)
+        pool.submit(gate.wait)
+        pool.submit(gate.wait)
+        began = time.monotonic()
+        pool.stop(0.5)
+        self.assertLess(time.monotonic() - began, 2)
+
+class Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        self.server.gate.wait(5)
+        self.request.sendall(b'hello')
+
+class Server(PooledMixIn, socketserver.TCPServer):
+    workers = 1
+    backlog = 1
+    when_full = 'reject'
+    plugin = 'test'
+
+class TestPooledMixIn(unittest.TestCase):
+    def test_full(self):
+        server = Server(('127.0.0.1', 0), Handler)
+        server.gate = threading.Event()
+        clients = []
+        for _ in range(3):
+            clients.append(socket.create_connection(server.server_address, 5))
+            server.handle_request()
+            # the first has to be with the worker before the next comes
+            deadline = time.monotonic() + 5
+            while server.pool.queue.qsize() and len(clients) == 1 and \
+                time.monotonic() < deadline:
+                time.sleep(0.01)
+
+        # one being handled, one waiting, and one turned away
+        self.assertEqual(clients[2].recv(5), b'')
+        server.gate.set()
+        self.assertEqual([client.recv(5) for client in clients[:2]], \
+            [b'hello', b'hello'])
+        self.assertEqual(len(server.pool.threads), 1)
+
+        server.server_close()
+        for client in clients:
+            client.close()
@@ -0,0 +1,57 @@
+from hpotter import tables
+from hpotter.writer import DBWriter
+from hpotter.test.database import DatabaseTestCase
+
+class TestWriter(DatabaseTestCase):
+    def count(self, table):
+        return self.engine.execute(table.__table__.count()).scalar()
+
+    def connection(self):
+        return tables.Connections(sourceIP='127.0.0.1', sourcePort=1234, \
+            destIP='127.0.0.1', destPort=23, proto=tables.TCP)
+
+    def test_enrich(self):
+        seen = []
+        writer = DBWriter(self.engine, enrich=seen.append)
+        writer.start()
+        connection = self.connection()
+        writer.write(connection)
+        writer.stop()
+        self.assertEqual(seen, [connection])
+
+    def test_batches(self):
+        writer = DBWriter(self.engine, batch_size=2, flush_interval=10)
+        writer.start()
+
+        connection = self.connection()
+        writer.write(connection)
+        writer.write(tables.Credentials(username='root', password='toor', \
+            connection=connection))
+        writer.write(tables.ShellCommands(command='ls', connection=connection))
+        writer.stop()
+
+        self.assertEqual(self.count(tables.Connections), 1)
+        self.assertEqual(self.count(tables.Credentials), 1)
+        self.assertEqual(self.count(tables.ShellCommands), 1)
+
+        stats = writer.stats()
+        self.assertEqual(stats['rows'], 3)
+        self.assertEqual(stats['batches'], 2)
+        self.assertEqual(stats['queue_depth'], 0)
+
+    def test_flush(self):
+        writer = DBWriter(self.engine, batch_size=100, flush_interval=10)
+        writer.start()
+
+        writer.write(self.connection())
+        self.assertTrue(writer.flush(5))
+        self.assertEqual(self.count(tables.Connections), 1)
+        writer.stop()
+
+    def test_backpressure(self):
+        writer = DBWriter(self.engine, max_queue=1, put_timeout=0.01)
+
+        self.assertTrue(writer.write(self.connection()))
+        self.assertFalse(writer.write(self.connection()))
+        self.assertEqual(writer.stats()['dropped'], 1)
+        self.assertEqual(writer.stats()['queue_depth'], 1)
@@ -0,0 +1,139 @@
+import queue
+import socket
+import threading
+import time
+import weakref
+
+from hpotter.env import logger
+from hpotter.metrics import counter, gauge, histogram
+from hpotter.admission import turn_away
+
+waits = histogram('hpotter_worker_wait_seconds', \
+    'Time connections waited in the queue for a worker', ('pool',))
+rejected = counter('hpotter_worker_rejected_total', \
+    'Connections turned away because every worker was busy', ('pool',))
+
+pools = weakref.WeakSet()
+
+gauge('hpotter_worker_queued', 'Connections waiting for a worker', \
+    ('pool',), lambda: {(pool.name,): pool.queue.qsize() \
+        for pool in list(pools)})
+
+def remaining(deadline):
+    return None if deadline is None else max(0, deadline - time.monotonic())
+
+class WorkerPool():
+    ''' A fixed number of threads working through a bounded queue, so a
+    flood of connections can't start a flood of threads. '''
+    def __init__(self, workers, queue_size, name='Worker'):
+        self.name = name
+        self.wait = waits.labels(name)
+        self.queue = queue.Queue(queue_size)
+        self.threads = [threading.Thread(target=self.work, daemon=True, \
+            name='%s-%d' % (name, number)) for number in range(workers)]
+        for thread in self.threads:
+            thread.start()
+        pools.add(self)
+
+    def submit(self, function, *args):
+        ''' Queue function(*args), or return False if the queue is full. '''
+        try:
+            self.queue.put_nowait((function, args, time.monotonic()))
+            return True
+        except queue.Full:
+            rejected.labels(self.name).inc()
+            return False
+
+    def work(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            function, args, queued = item
+            self.wait.observe(time.monotonic() - queued)
+            try:
+                function(*args)
+            except Exception as exc:
+                logger.info('%s failed: %s', function.__name__, exc)
+
+    def drain(self, discard):
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                return
+            if item is None:
+                continue
+            function, args, _ = item
+            try:
+                discard(*args)
+            except Exception as exc:
+                logger.info('Could not discard a queued %s: %s', \
+                    function.__name__, exc)
+
+    def stop(self, timeout=None, discard=None):
+        ''' Stop the workers, waiting at most timeout seconds for them all.
+        What's still queued is run first, or with discard, handed to it
+        instead. '''
+        deadline = None if timeout is None else time.monotonic() + timeout
+        if discard:
+            self.drain(discard)
+        for _ in self.threads:
+            try:
+                self.queue.put(None, timeout=remaining(deadline))
+            except queue.Full:
+                logger.info('%s still busy after %ss', self.name, timeout)
+                break
+        for thread in self.threads:
+            thread.join(remaining(deadline))
+
+class PooledMixIn():
+    ''' For socketserver servers, in place of ThreadingMixIn: connections
+    wait in a queue of backlog for one of a fixed number of workers. When
+    the queue is full they're tarpitted, or with when_full = 'reject',
+    closed. '''
+    workers = 32
+    backlog = 64
+    when_full = 'tarpit'
+    plugin = 'unknown'
+    banner = b'\r\n'
+    pool = None
+    # accepting is cheap now, so let the kernel queue a burst rather than
+    # drop its SYNs; the queue above is what's bounded
+    request_queue_size = socket.SOMAXCONN
+
+    def server_activate(self):
+        super().server_activate()
+        self.pool = WorkerPool(self.workers, self.backlog, \
+            self.plugin.capitalize() + 'Worker')
+
+    def process_request(self, request, client_address):
+        if not self.pool.submit(self.process_request_pooled, request, \
+            client_address):
+            logger.info('%s workers busy, turning away %s', self.plugin, \
+                client_address[0])
+            self.saturated(request, client_address)
+
+    def saturated(self, request, client_address):
+        if self.when_full == 'tarpit':
+            turn_away(request, self.plugin, self.banner)
+        else:
+            self.shutdown_request(request)
+
+    def discard(self, request, client_address):
+        # still queued when the server closed
+        self.shutdown_request(request)
+
+    def process_request_pooled(self, request, client_address):
+        # what ThreadingMixIn.process_request_thread does
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        if self.pool:
+            self.pool.stop(5, self.discard)
@@ -0,0 +1,269 @@
+import atexit
+import collections
+import datetime
+import queue
+import threading
+import time
+
+from sqlalchemy.orm import sessionmaker
+
+from hpotter.env import logger, get_database, geoip_enrich, intern, \
+    intern_cache
+from hpotter.dictionary import Interner
+from hpotter.geoip import enrich, start_backfill
+from hpotter.rollups import update
+from hpotter.tables import Connections
+from hpotter.metrics import counter, gauge, histogram
+
+# All database writes go through here: the plugins hand rows to write() and
+# a single thread adds them in batches, so network threads never wait on the
+# SQLite file lock or an fsync.
+
+commit_seconds = histogram('hpotter_db_commit_seconds', \
+    'Time to write a batch, retries included')
+written = counter('hpotter_db_rows_total', 'Rows handed to the writer, by ' \
+    'what happened to them', ('outcome',))
+
+class DBWriter(threading.Thread):
+    def __init__(self, bind, batch_size=500, flush_interval=1.0, \
+        max_queue=10000, put_timeout=5, enrich=None, rollup=None, \
+        interner=None, partitions=None):
+        super().__init__(name='DBWriter', daemon=True)
+        # rows stay usable by the plugins after they're committed
+        self.session = sessionmaker(bind=bind, expire_on_commit=False)()
+        # when set, rows go to the partition their connection was made in,
+        # each through a session of its own
+        self.partitions = partitions
+        self.partition = None
+        self.sessions = collections.OrderedDict()
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        # called on each row before it's added, off the network threads
+        self.enrich = enrich
+        # called with the session and the rows, before they're committed
+        self.rollup = rollup
+        # moves repeated values into the dictionary table
+        self.interner = interner
+        self.queue = queue.Queue(max_queue)
+        self.stop_requested = False
+
+        self.lock = threading.Lock()
+        self.rows = 0
+        self.batches = 0
+        self.dropped = 0
+        self.failed = 0
+        self.commit_seconds = 0.0
+        self.max_commit_seconds = 0.0
+        self.last_commit_seconds = 0.0
+
+    def write(self, row):
+        # block when the queue is full, so a flood slows the plugins down
+        # instead of growing without bound; give up after put_timeout
+        try:
+            self.queue.put(row, timeout=self.put_timeout)
+            return True
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+            written.labels('dropped').inc()
+            logger.info('DBWriter queue full, dropping %s', type(row).__name__)
+            return False
+
+    def flush(self, timeout=None):
+        done = threading.Event()
+        self.queue.put(done)
+        return done.wait(timeout)
+
+    def stop(self):
+        self.stop_requested = True
+        self.flush()
+        self.join()
+        self.session.close()
+        for session in self.sessions.values():
+            session.close()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'queue_depth': self.queue.qsize(),
+                'queue_max': self.queue.maxsize,
+                'rows': self.rows,
+                'batches': self.batches,
+                'dropped': self.dropped,
+                'failed': self.failed,
+                'commit_seconds': self.commit_seconds,
+                'max_commit_seconds': self.max_commit_seconds,
+                'last_commit_seconds': self.last_commit_seconds,
+            }
+
+    def next_batch(self):
+        ''' Wait for a row, then gather more until the batch is full or
+        flush_interval has passed. Flush requests end a batch early. '''
+        batch = []
+        waiters = []
+        item = self.queue.get()
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            if isinstance(item, threading.Event):
+                waiters.append(item)
+                break
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                break
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self.queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+        return batch, waiters
+
+    def route(self, batch):
+        ''' The batch split by partition, in order. '''
+        if not self.partitions:
+            return [(None, batch)]
+
+        routed = collections.OrderedDict()
+        now = datetime.datetime.utcnow()
+        for row in batch:
+            connection = row if isinstance(row, Connections) \
+                else getattr(row, 'connection', None)
+            when = now
+            if connection is not None:
+                if connection.created_at is None:
+                    connection.created_at = now
+                when = connection.created_at
+            partition = self.partitions.for_writing(when)
+            routed.setdefault(partition.path, (partition, []))[1].append(row)
+        return list(routed.values())
+
+    def use(self, partition):
+        if partition is None:
+            return
+        self.partition = partition
+        if partition.path not in self.sessions:
+            self.sessions[partition.path] = sessionmaker( \
+                bind=partition.engine, expire_on_commit=False)()
+        self.sessions.move_to_end(partition.path)
+        self.session = self.sessions[partition.path]
+
+        # a connection's rows can come in after midnight, rarely much later
+        while len(self.sessions) > 2:
+            self.sessions.popitem(last=False)[1].close()
+
+    def add(self, rows):
+        if self.partition:
+            self.partition.assign_ids(self.session, rows)
+        self.session.add_all(rows)
+        if self.rollup:
+            self.rollup(self.session, rows)
+        if self.interner:
+            self.interner.intern(self.session, rows)
+        self.session.commit()
+
+    def rollback(self, rows):
+        self.session.rollback()
+        if self.interner:
+            self.interner.reset(rows)
+
+    def commit(self, batch):
+        start = time.perf_counter()
+        failed = 0
+        if self.enrich:
+            for row in batch:
+                try:
+                    self.enrich(row)
+                except Exception as exc:
+                    logger.info('DBWriter could not enrich %s: %s', \
+                        type(row).__name__, exc)
+        try:
+            routed = self.route(batch)
+        except Exception as exc:
+            logger.info('DBWriter could not open a partition: %s', exc)
+            routed = []
+            failed = len(batch)
+        for partition, rows in routed:
+            self.use(partition)
+            failed += self.commit_rows(rows)
+        elapsed = time.perf_counter() - start
+        commit_seconds.observe(elapsed)
+        written.labels('written').inc(len(batch) - failed)
+        if failed:
+            written.labels('failed').inc(failed)
+
+        with self.lock:
+            self.rows += len(batch) - failed
+            self.failed += failed
+            self.batches += 1
+            self.commit_seconds += elapsed
+            self.max_commit_seconds = max(self.max_commit_seconds, elapsed)
+            self.last_commit_seconds = elapsed
+
+    def commit_rows(self, rows):
+        ''' Add rows, or as many of them as will go; returns how many
+        wouldn't. '''
+        try:
+            self.add(rows)
+            return 0
+        except Exception as exc:
+            logger.info('DBWriter batch failed, retrying one by one: %s', exc)
+            self.rollback(rows)
+
+        failed = 0
+        for row in rows:
+            try:
+                self.add([row])
+            except Exception as exc:
+                logger.info('DBWriter dropping %s: %s', \
+                    type(row).__name__, exc)
+                self.rollback([row])
+                failed += 1
+        return failed
+
+    def run(self):
+        while True:
+            batch, waiters = self.next_batch()
+            if batch:
+                self.commit(batch)
+            for waiter in waiters:
+                waiter.set()
+            if self.stop_requested and self.queue.empty():
+                break
+
+writer = None
+writer_lock = threading.Lock()
+
+def get_writer():
+    global writer
+    with writer_lock:
+        if not writer:
+            engine, partitions = get_database()
+            if geoip_enrich:
+                start_backfill(engine, partitions)
+            writer = DBWriter(engine, \
+                enrich=enrich if geoip_enrich else None, rollup=update, \
+                interner=Interner(intern_cache) if intern else None, \
+                partitions=partitions)
+            writer.start()
+        return writer
+
+gauge('hpotter_db_queue_depth', 'Rows waiting for the writer', \
+    function=lambda: writer.queue.qsize() if writer else 0)
+
+def write(row):
+    return get_writer().write(row)
+
+def stop_writer():
+    global writer
+    with writer_lock:
+        if not writer:
+            return
+        logger.info('Flushing database writer')
+        writer.stop()
+        writer = None
+
+# rows queued when the interpreter exits normally still get written
+atexit.register(stop_writer)
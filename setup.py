@@ -10,6 +10,7 @@ setup(name='hpotter',
         ('hpotter',
             ['hpotter/env.py',
              'hpotter/logging.conf',
+             'hpotter/hpotter.conf',
              'hpotter/requirements.txt',
              'README.md'])],
       description='An easy to install, configure, and run honeypot',